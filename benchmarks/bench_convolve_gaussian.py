@@ -0,0 +1,84 @@
+"""
+Benchmark of misc.convolve_gaussian against the previous implementation,
+which oversampled the spectrum by 10-20x and used a complex FFT with
+wrap-around. Run from the repository root with:
+
+  python benchmarks/bench_convolve_gaussian.py
+"""
+import numpy as np
+from time import perf_counter
+from scipy.interpolate import interp1d
+from spectra.misc import convolve_gaussian, convolve_gaussian_R, logarange
+
+def convolve_gaussian_old(x, y, FWHM):
+  """
+  Previous version of convolve_gaussian, kept for comparison.
+  """
+  sigma = FWHM/2.355
+
+  def next_pow_2(N_in):
+    N_out = 1
+    while N_out < N_in:
+      N_out *= 2
+    return N_out
+
+  xi = np.linspace(x[0], x[-1], next_pow_2(10*len(x)))
+  yi = interp1d(x, y)(xi)
+
+  yg = np.exp(-0.5*((xi-x[0])/sigma)**2)
+  yg += yg[::-1]
+  yg /= np.sum(yg)
+
+  yiF = np.fft.fft(yi)
+  ygF = np.fft.fft(yg)
+  yic = np.fft.ifft(yiF * ygF).real
+
+  return interp1d(xi, yic)(x)
+
+def timeit(fun, *args, repeat=3):
+  """
+  Best of 'repeat' calls, in seconds.
+  """
+  best = np.inf
+  for _ in range(repeat):
+    t0 = perf_counter()
+    fun(*args)
+    best = min(best, perf_counter()-t0)
+  return best
+
+def test_spectrum(x):
+  """
+  Smooth continuum with absorption lines, and a little noise.
+  """
+  rng = np.random.default_rng(42)
+  y = 1 + 0.1*np.sin(x/300)
+  for x0 in rng.uniform(x[0], x[-1], 200):
+    y -= 0.5*np.exp(-0.5*((x-x0)/0.5)**2)
+  return y + 0.01*rng.standard_normal(len(x))
+
+def main():
+  cases = [
+    ("uniform", lambda N: np.linspace(3000., 10000., N)),
+    ("non-uniform", lambda N: 3000. + 7000.*np.linspace(0., 1., N)**1.5),
+  ]
+  print(f"{'grid':>12} {'Npix':>8} {'FWHM':>6} {'old/s':>8} {'new/s':>8} {'speedup':>8} {'max|diff|':>10}")
+  for label, grid in cases:
+    for N in (10**4, 10**5, 10**6):
+      x = grid(N)
+      y = test_spectrum(x)
+      for fwhm in (0.1, 2.0, 50.):
+        t_old = timeit(convolve_gaussian_old, x, y, fwhm)
+        t_new = timeit(convolve_gaussian, x, y, fwhm)
+        #compare away from the ends, where the old version wraps around
+        edge = slice(N//10, -N//10)
+        diff = np.max(np.abs(convolve_gaussian_old(x, y, fwhm) - convolve_gaussian(x, y, fwhm))[edge])
+        print(f"{label:>12} {N:>8} {fwhm:>6} {t_old:>8.4f} {t_new:>8.4f} {t_old/t_new:>8.1f} {diff:>10.2e}")
+
+  x = logarange(3000., 10000., 3e5)
+  y = test_spectrum(x)
+  t_old = timeit(lambda: convolve_gaussian_old(np.log(x), y, 1/5000))
+  t_new = timeit(convolve_gaussian_R, x, y, 5000)
+  print(f"convolve_gaussian_R, log-uniform grid, {len(x)} pixels, R=5000: {t_old:.4f}s -> {t_new:.4f}s ({t_old/t_new:.1f}x)")
+
+if __name__ == "__main__":
+  main()
@@ -5,6 +5,11 @@ __author__ = "Mark Hollands"
 __email__ = "M.Hollands.1@warwick.ac.uk"
 
 from .spec_class import Spectrum 
+from .spec_batch import SpectrumBatch
+from .grid import WavelengthGrid
+from .lazy import LazySpectrum
+from .spec_archive import SpectrumArchive
+from .model_grid import ModelCatalogue, ModelGrid
 from .spec_io import *
 from .spec_functions import *
 from .misc import air_to_vac, vac_to_air, voigt, jangstrom, logarange
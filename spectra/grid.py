@@ -0,0 +1,180 @@
+"""
+Immutable wavelength grids, which spectra with identical x values share by
+reference. Grids carry a content hash, so that comparing two grids is O(1),
+and cache quantities derived from the x values (log(x), pixel spacings,
+unit and air/vac conversions), so these are only computed once.
+"""
+import numpy as np
+import weakref
+from .misc import _grid_key, air_to_vac, vac_to_air
+from .units import parse_unit, convert_x
+
+__all__ = [
+  "WavelengthGrid",
+  "get_grid",
+]
+
+class WavelengthGrid(object):
+  """
+  Read-only 1D array of x values, with cached derived quantities.
+
+  Example:
+  >>> G = get_grid(x)
+  >>> G.log #computed once, then cached
+  >>> G.air_to_vac() #WavelengthGrid, also cached
+  >>> G == get_grid(x.copy()) #True, compares content hashes
+
+  .............................................................................
+  Grids obtained via get_grid are interned, i.e. equal grids are the same
+  object, so that derived quantities are shared between all spectra with
+  those x values. Spectrum.grid returns the grid of a spectrum.
+  """
+  __slots__ = ['_x', '_key', '_derived', '__weakref__']
+
+  def __init__(self, x, key=None):
+    """
+    Create grid from a 1D array, which is copied unless it is already a
+    read-only float array that owns its data (a read-only view could still
+    be changed through its base). key is the content hash, if already known
+    (e.g. from a file index), in which case x is trusted and not copied, and
+    is otherwise computed here.
+    """
+    if not isinstance(x, np.ndarray):
+      raise TypeError("x must be an ndarray")
+    if x.ndim != 1:
+      raise ValueError("x arrays must be 1D")
+    trusted = key is not None or x.base is None
+    if x.flags.writeable or x.dtype != float or not trusted:
+      x = x.astype(float)
+      x.flags.writeable = False
+    self._x = x
+    self._key = _grid_key(x) if key is None else tuple(key)
+    self._derived = {}
+
+  @property
+  def x(self):
+    return self._x
+
+  @property
+  def key(self):
+    """
+    Content hash of the grid, (len(x), sha1), used to key cached quantities.
+    """
+    return self._key
+
+  def __len__(self):
+    return len(self._x)
+
+  def __array__(self, dtype=None, copy=None):
+    if dtype is None or np.dtype(dtype) == self._x.dtype:
+      return self._x.copy() if copy else self._x
+    if copy is False:
+      raise ValueError("cannot convert grid to a different dtype without copying")
+    return self._x.astype(dtype)
+
+  def __eq__(self, other):
+    if self is other:
+      return True
+    if not isinstance(other, WavelengthGrid):
+      return NotImplemented
+    return len(self) == len(other) and self.key == other.key
+
+  def __ne__(self, other):
+    eq = self.__eq__(other)
+    return eq if eq is NotImplemented else not eq
+
+  def __hash__(self):
+    return hash(self.key)
+
+  def __repr__(self):
+    return f"WavelengthGrid with {len(self)} pixels from {self._x[0]} to {self._x[-1]}"
+
+  def _cached(self, key, fun):
+    """
+    Return derived quantity key, calculating it with fun() if needed.
+    Arrays are made read-only, as they are shared.
+    """
+    if key not in self._derived:
+      value = fun()
+      if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+      self._derived[key] = value
+    return self._derived[key]
+
+  @property
+  def log(self):
+    """
+    Natural log of x
+    """
+    return self._cached('log', lambda: np.log(self._x))
+
+  @property
+  def dx(self):
+    """
+    Pixel spacings, np.diff(x)
+    """
+    return self._cached('dx', lambda: np.diff(self._x))
+
+  @property
+  def is_sorted(self):
+    """
+    Whether x is strictly increasing
+    """
+    return self._cached('is_sorted', lambda: bool(np.all(self.dx > 0)))
+
+  @property
+  def is_uniform(self):
+    """
+    Whether x is sorted, and uniformly spaced (to a relative tolerance of 1e-6)
+    """
+    def uniform():
+      dx = self.dx
+      return self.is_sorted and bool(np.allclose(dx, dx.mean(), rtol=1e-6, atol=0))
+    return self._cached('is_uniform', uniform)
+
+  @property
+  def is_log_uniform(self):
+    """
+    Whether x is sorted, and uniformly spaced in log(x), e.g. constant R
+    """
+    def uniform():
+      dlx = np.diff(self.log)
+      return self.is_sorted and bool(np.allclose(dlx, dlx.mean(), rtol=1e-6, atol=0))
+    return self._cached('is_log_uniform', uniform)
+
+  def to(self, x_unit, new_unit):
+    """
+    Returns the grid converted from x_unit to new_unit (see units.convert_x)
+    """
+    x_unit, new_unit = parse_unit(x_unit), parse_unit(new_unit)
+    if x_unit == new_unit:
+      return self
+    key = 'to', x_unit, new_unit
+    return self._cached(key, lambda: get_grid(convert_x(self._x, x_unit, new_unit)))
+
+  def air_to_vac(self):
+    """
+    Returns the grid converted from air to vacuum wavelengths (in AA)
+    """
+    return self._cached('air_to_vac', lambda: get_grid(air_to_vac(self._x)))
+
+  def vac_to_air(self):
+    """
+    Returns the grid converted from vacuum to air wavelengths (in AA)
+    """
+    return self._cached('vac_to_air', lambda: get_grid(vac_to_air(self._x)))
+#
+
+#Interned grids, keyed on content hash. Grids are dropped once unused.
+_grids = weakref.WeakValueDictionary()
+
+def get_grid(x):
+  """
+  Returns the WavelengthGrid for the x values x, which is the same object
+  for all equal x arrays (while any are in use).
+  """
+  if isinstance(x, WavelengthGrid):
+    G = x
+  else:
+    G = WavelengthGrid(x)
+  return _grids.setdefault(G.key, G)
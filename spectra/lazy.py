@@ -0,0 +1,235 @@
+"""
+Lazy spectrum arithmetic. Expressions are recorded as a tree and evaluated
+in a single fused pass over chunks of pixels, rather than allocating full
+length arrays for every intermediate result.
+"""
+import numpy as np
+import astropy.units as u
+from .spec_class import Spectrum
+
+__all__ = [
+  "LazySpectrum",
+]
+
+class LazySpectrum(object):
+  """
+  Deferred arithmetic expression of spectra, created via Spectrum.lazy().
+  Arithmetic with other LazySpectrum/Spectrum objects, int/floats, ndarrays
+  or Quantities builds up an expression tree. Nothing is computed until
+  .y, .e or .compute() is accessed, when the whole expression is evaluated
+  in chunks of chunk_size pixels, so that temporaries stay cache-sized.
+
+  Example:
+  >>> L = (S1.lazy() - S2) * k / M + C
+  >>> S = L.compute() #Spectrum
+
+  .............................................................................
+  Error propagation follows the Spectrum class, except that error terms of
+  operands known to have zero errors (int/float/ndarray operands, or spectra
+  with e == 0 everywhere) are skipped. For products and ratios with such
+  operands, e.g. S*M for a model M, this also means pixels where S.y == 0
+  get finite errors rather than nans.
+  """
+  __slots__ = ['_op', '_args', '_yu', '_S0', '_zero_e', '_result']
+  __array_ufunc__ = None
+  chunk_size = 2**14
+
+  def __init__(self, S):
+    """
+    Create a lazy expression from a single Spectrum. Its arrays and info
+    are captured now, so later changes to S (e.g. its units or name) do not
+    affect the expression.
+    """
+    if not isinstance(S, Spectrum):
+      raise TypeError("LazySpectrum must be created from a Spectrum")
+    S = S._spawn(S._shared('_x'), S._shared('_y'), S._shared('_e'))
+    self._op = 'leaf'
+    self._args = (S._x, S._y, S._e)
+    self._yu = S._yu
+    self._S0 = S
+    self._zero_e = not np.any(S._e)
+    self._result = None
+
+  @classmethod
+  def _node(cls, op, args, yu, S0, zero_e):
+    """
+    Create a node of the expression tree.
+    """
+    L = object.__new__(cls)
+    L._op, L._args, L._yu, L._S0, L._zero_e = op, args, yu, S0, zero_e
+    L._result = None
+    return L
+
+  def __len__(self):
+    """
+    Return number of pixels in spectrum
+    """
+    return len(self._S0)
+
+  def __repr__(self):
+    """
+    Return representation of the expression tree
+    """
+    return f"LazySpectrum({self._expr()}) with {len(self)} pixels"
+
+  def _expr(self):
+    """
+    String form of the expression, for __repr__
+    """
+    if self._op == 'leaf':
+      return self._S0.name or "S"
+    elif self._op == 'const':
+      return "a"
+    elif self._op == 'neg':
+      return f"-{self._args[0]._expr()}"
+    elif self._op == 'pow':
+      return f"{self._args[0]._expr()}**{self._args[1]}"
+    symbol = {'add':'+', 'sub':'-', 'mul':'*', 'div':'/'}[self._op]
+    return f"({self._args[0]._expr()} {symbol} {self._args[1]._expr()})"
+
+  def _operand(self, other, dimensionless_y=False):
+    """
+    Convert other to a LazySpectrum node (leaf or constant), after checking
+    that it is compatible with self, in the same way as Spectrum arithmetic
+    (x units, and y units unless dimensionless_y, then x values).
+    """
+    if isinstance(other, (LazySpectrum, Spectrum)):
+      S = other._S0 if isinstance(other, LazySpectrum) else other
+      self._S0._compare_units(S, 'x')
+      if not dimensionless_y and self._yu != other._yu:
+        raise u.UnitsError("y_units differ")
+      self._S0._compare_x(S)
+      return other if isinstance(other, LazySpectrum) else LazySpectrum(other)
+    elif isinstance(other, u.Quantity):
+      y, yu = other.value, other.unit
+    elif isinstance(other, (int, float, np.ndarray)):
+      y = other
+      yu = u.dimensionless_unscaled if dimensionless_y else self._yu
+    else:
+      raise NotImplementedError("Cannot cast object to LazySpectrum")
+
+    if isinstance(y, np.ndarray) and y.shape != (len(self),):
+      raise ValueError("for ndarrays, y must be the same shape as x")
+    return self._node('const', (y,), yu, self._S0, True)
+
+  def _binary(self, op, other, reverse=False):
+    """
+    Build the node for self (op) other, or other (op) self if reverse.
+    """
+    other = self._operand(other, op in ('mul', 'div'))
+    a, b = (other, self) if reverse else (self, other)
+    if op in ('add', 'sub'):
+      if a._yu != b._yu:
+        raise u.UnitsError("y_units differ")
+      yu = a._yu
+    else:
+      yu = a._yu * b._yu if op == 'mul' else a._yu / b._yu
+    return self._node(op, (a, b), yu, self._S0, a._zero_e and b._zero_e)
+
+  def __add__(self, other):
+    return self._binary('add', other)
+
+  def __sub__(self, other):
+    return self._binary('sub', other)
+
+  def __mul__(self, other):
+    return self._binary('mul', other)
+
+  def __truediv__(self, other):
+    return self._binary('div', other)
+
+  def __radd__(self, other):
+    return self._binary('add', other, reverse=True)
+
+  def __rsub__(self, other):
+    return self._binary('sub', other, reverse=True)
+
+  def __rmul__(self, other):
+    return self._binary('mul', other, reverse=True)
+
+  def __rtruediv__(self, other):
+    return self._binary('div', other, reverse=True)
+
+  def __pow__(self, other):
+    if isinstance(other, (int, float)):
+      return self._node('pow', (self, other), self._yu**other, self._S0, self._zero_e)
+    else:
+      raise TypeError("other must be int/float")
+
+  def __neg__(self):
+    return self._node('neg', (self,), self._yu, self._S0, self._zero_e)
+
+  def __pos__(self):
+    return self
+
+  def _eval(self, sl):
+    """
+    Evaluate the expression for the pixels in slice sl. Returns y and e,
+    where e is None if the errors are known to be zero.
+    """
+    op, args = self._op, self._args
+    if op == 'leaf':
+      _, y, e = args
+      return y[sl], (None if self._zero_e else e[sl])
+    elif op == 'const':
+      y = args[0]
+      return (y[sl] if isinstance(y, np.ndarray) else y), None
+    elif op == 'neg':
+      y, e = args[0]._eval(sl)
+      return -y, e
+    elif op == 'pow':
+      (y1, e1), k = args[0]._eval(sl), args[1]
+      y = y1**k
+      return y, (None if e1 is None else np.abs(k*y*e1/y1))
+
+    (y1, e1), (y2, e2) = args[0]._eval(sl), args[1]._eval(sl)
+    if op in ('add', 'sub'):
+      y = y1 + y2 if op == 'add' else y1 - y2
+      if e1 is None or e2 is None:
+        e = e2 if e1 is None else e1
+      else:
+        e = np.hypot(e1, e2)
+    else:
+      y = y1 * y2 if op == 'mul' else y1 / y2
+      if e1 is None and e2 is None:
+        e = None
+      elif e2 is None:
+        e = e1 / np.abs(y2) if op == 'div' else e1 * np.abs(y2)
+      elif e1 is None:
+        e = e2 * np.abs(y/y2)
+      else:
+        e = np.abs(y)*np.hypot(e1/y1, e2/y2)
+    return y, e
+
+  def compute(self, chunk_size=None):
+    """
+    Evaluate the expression, returning a Spectrum. The result is cached.
+    """
+    if self._result is None:
+      N = len(self)
+      chunk_size = self.chunk_size if chunk_size is None else chunk_size
+      y, e = np.empty(N), np.zeros(N)
+      for i0 in range(0, N, chunk_size):
+        sl = slice(i0, i0+chunk_size)
+        yc, ec = self._eval(sl)
+        y[sl] = yc
+        if ec is not None:
+          e[sl] = ec
+      self._result = self._S0._spawn(self._S0._shared('_x'), y, e, self._yu)
+    return self._result
+
+  @property
+  def x(self):
+    return self.compute().x
+
+  @property
+  def y(self):
+    return self.compute().y
+
+  @property
+  def e(self):
+    return self.compute().e
+
+  @property
+  def y_unit(self):
+    return self._yu.to_string()
@@ -1,8 +1,13 @@
 import numpy as np
+import math
 from scipy.interpolate import interp1d
 from scipy.special import wofz
+from scipy.fft import rfft, irfft, next_fast_len
+from scipy.ndimage import convolve1d
 from functools import reduce
+import hashlib
 import operator
+import gzip
 
 __all__ = [
   "jangstrom",
@@ -12,8 +17,12 @@ __all__ = [
   "convolve_gaussian",
   "convolve_gaussian_R",
   "lanczos",
+  "lanczos_weights",
   "logarange",
   "keep_points",
+  "format_columns",
+  "write_columns",
+  "fit_scale",
 ]
 
 jangstrom = \
@@ -51,43 +60,122 @@ def air_to_vac(Wair):
   return Wair*n
 #
 
-def convolve_gaussian(x, y, FWHM):
+def _resample_grid(x):
   """
-  Convolve spectrum with a Gaussian with FWHM by oversampling and
-  using an FFT approach. Wavelengths are assumed to be sorted,
-  but uniform spacing is not required. Will cause wrap-around at
-  the end of the spectrum.
+  Origin and spacing of the uniform grid that convolve_gaussian resamples
+  the (sorted) x values onto, or None if x is already uniform.
   """
-  sigma = FWHM/2.355
+  dx = np.diff(x)
+  if np.ptp(dx) <= 1e-6*np.abs(np.mean(dx)):
+    return None
+  dxi = max(np.min(dx), (x[-1]-x[0])/(10*len(x)))
+  n = int((x[-1]-x[0])/dxi)+1
+  return x[0], (x[-1]-x[0])/(n-1)
+
+def convolve_gaussian(x, y, FWHM, method='auto', truncate=5., chunk_size=None, grid=None):
+  """
+  Convolve spectrum with a Gaussian with FWHM. Wavelengths are assumed to
+  be sorted, but uniform spacing is not required: uniform grids are
+  convolved on their native pixels, otherwise the data are linearly
+  resampled onto a uniform grid (with the spacing of the smallest pixels,
+  but oversampling by no more than 10x) and back again. The kernel is
+  truncated at 'truncate' sigma, and the ends of the spectrum are padded
+  with their edge values rather than wrapping around.
 
-  def next_pow_2(N_in):
-    N_out = 1
-    while N_out < N_in:
-      N_out *= 2
-    return N_out
+  method='fft' uses real FFTs, method='direct' convolves with the truncated
+  kernel directly, and method='auto' picks direct convolution for narrow
+  kernels.
 
-  #oversample data by at least factor 10 (up to 20).
-  xi = np.linspace(x[0], x[-1], next_pow_2(10*len(x)))
-  yi = interp1d(x, y)(xi)
+  y may also be a 2D array with one spectrum per row, all sharing the
+  x-axis. The grid and kernel are then only set up once, and rows are
+  processed chunk_size at a time (default: all at once) to bound memory.
 
-  yg = np.exp(-0.5*((xi-x[0])/sigma)**2) #half gaussian
-  yg += yg[::-1]
-  yg /= np.sum(yg) #Norm kernel
+  grid, an (origin, spacing) pair (see _resample_grid), sets the uniform
+  grid used for non-uniform x, so that pieces of a spectrum are resampled
+  onto points of the grid of the whole spectrum.
+  """
+  sigma = FWHM/2.355
 
-  yiF = np.fft.fft(yi)
-  ygF = np.fft.fft(yg)
-  yic = np.fft.ifft(yiF * ygF).real
+  if grid is None:
+    grid = _resample_grid(x)
+  uniform = grid is None
+  if uniform:
+    xi = x
+  else:
+    x0, dxi = grid
+    k0 = int(np.ceil((x[0]-x0)/dxi - 1e-9))
+    k1 = int(np.floor((x[-1]-x0)/dxi + 1e-9)) + 1
+    xi = x0 + dxi*np.arange(k0, k1)
 
-  return interp1d(xi, yic)(x)
+  sigma_px = sigma / ((xi[-1]-xi[0])/(len(xi)-1))
+  kernel = _GaussianKernel(sigma_px, len(xi), method, truncate)
+
+  def convolve_rows(yc):
+    if uniform:
+      return kernel.convolve(yc)
+    yc = _linear_resample(x, yc, xi)
+    yc = kernel.convolve(yc)
+    return _linear_resample(xi, yc, x)
+
+  if y.ndim == 1 or chunk_size is None:
+    return convolve_rows(y)
+  yc = np.empty(y.shape)
+  for i0 in range(0, len(y), chunk_size):
+    yc[i0:i0+chunk_size] = convolve_rows(y[i0:i0+chunk_size])
+  return yc
 #
 
-def convolve_gaussian_R(x, y, R):
+def _linear_resample(x, y, xnew):
+  """
+  Linearly interpolate y (along its last axis) from sorted x onto xnew.
+  """
+  if y.ndim == 1:
+    return np.interp(xnew, x, y)
+  i = np.clip(np.searchsorted(x, xnew) - 1, 0, len(x)-2)
+  t = (xnew - x[i]) / (x[i+1] - x[i])
+  return y[...,i]*(1-t) + y[...,i+1]*t
+
+class _GaussianKernel(object):
+  """
+  Truncated Gaussian kernel, with a width of sigma pixels, for convolving
+  arrays with N pixels along their last axis. Edges are padded with the
+  values of the end pixels. For method='fft' the kernel FFT is computed
+  once, and reused for every call to convolve.
+  """
+  direct_max = 101
+
+  def __init__(self, sigma, N, method='auto', truncate=5.):
+    self.r = r = max(1, int(math.ceil(truncate*sigma)))
+    k = np.exp(-0.5*(np.arange(-r, r+1)/sigma)**2)
+    self.k = k / np.sum(k)
+    self.N = N
+
+    if method == 'auto':
+      method = 'direct' if len(k) <= self.direct_max else 'fft'
+    if method == 'fft':
+      self.n = next_fast_len(N+2*r)
+      self.kF = rfft(self.k, self.n)
+    elif method != 'direct':
+      raise ValueError("method must be 'auto', 'fft', or 'direct'")
+    self.method = method
+
+  def convolve(self, y):
+    if self.method == 'direct':
+      return convolve1d(y, self.k, axis=-1, mode='nearest')
+    #circular convolution only contaminates the padding, which is discarded
+    r, n, N = self.r, self.n, self.N
+    ypad = np.pad(y, [(0,0)]*(y.ndim-1) + [(r,r)], mode='edge')
+    yF = rfft(ypad, n, axis=-1)
+    return irfft(yF * self.kF, n, axis=-1)[...,2*r:2*r+N]
+
+def convolve_gaussian_R(x, y, R, **kwargs):
   """
   Similar to convolve_gaussian, but convolves to a specified resolution
   rather than a specfied FWHM. Essentially this amounts to convolving
-  along a log-uniform x-axis instead.
+  along a log-uniform x-axis instead. kwargs (including chunk_size for
+  2D y) are passed to convolve_gaussian.
   """
-  return convolve_gaussian(np.log(x), y, 1./R)
+  return convolve_gaussian(np.log(x), y, 1./R, **kwargs)
 #
 
 def black_body(x, T, norm=True):
@@ -122,11 +210,31 @@ def keep_points(x, fname):
   segments = (between(x, *line.split()) for line in lines)
   return reduce(operator.or_, segments)
 
-def lanczos(x, y, xnew):
+def lanczos_weights(x, xnew, a=3):
+  """
+  Returns pixel indices and weights, both with shape (len(xnew), 2a), for
+  Lanczos-a interpolation from x onto xnew, i.e.
+  >>> ynew = np.sum(y[idx]*w, axis=1)
+  Only the 2a nearest pixels contribute to each output point. Positions are
+  measured in (fractional) pixels of x. Weights for pixels beyond the ends
+  of x are zero.
+  """
   n = np.arange(len(x))
   Ni = interp1d(x, n, kind='linear', fill_value='extrapolate')(xnew)
-  ynew = [np.sum(y*np.sinc(ni-n)) for ni in Ni]
-  return np.array(ynew)
+  idx = np.floor(Ni).astype(int)[:,None] + np.arange(1-a, a+1)
+  d = Ni[:,None] - idx
+  w = np.sinc(d) * np.sinc(d/a)
+  outside = (idx < 0) | (idx >= len(x))
+  w[outside] = 0.
+  idx[outside] = 0
+  return idx, w
+
+def lanczos(x, y, xnew, a=3):
+  """
+  Lanczos-a interpolation of y (along its last axis) from x onto xnew.
+  """
+  idx, w = lanczos_weights(x, xnew, a)
+  return np.sum(y[...,idx]*w, axis=-1)
 
 def logarange(x0, x1, R):
   """
@@ -136,3 +244,82 @@ def logarange(x0, x1, R):
   lx0, lx1= np.log(x0), np.log(x1)
   logx = np.arange(lx0, lx1, 1/R)
   return np.exp(logx)
+
+def fit_scale(y1, e1, y2, e2, niter=20, tol=1e-10):
+  """
+  Finds the scale factor, A, minimising
+    chi2(A) = sum((y1 - A*y2)**2 / (e1**2 + A**2 * e2**2))
+  i.e. for scaling y2 to y1 when both have errors. Arrays can be 2D (one
+  problem per row, all solved at once). Pixels where both errors are zero,
+  or either is infinite, are ignored. Returns A and its uncertainty (from the curvature of chi2).
+
+  Starting from the weighted least squares solution (ignoring e2), Newton
+  steps are taken on dchi2/dA. Where the curvature is not positive, the
+  (positive) Gauss-Newton curvature is used instead.
+  """
+  y1, e1, y2, e2 = np.broadcast_arrays(*map(np.asarray, (y1, e1, y2, e2)))
+  u, v = e1**2, e2**2
+  use = ((u > 0) | (v > 0)) & np.isfinite(u) & np.isfinite(v)
+  a, b = np.where(use, y1, 0.), np.where(use, y2, 0.)
+  u = np.where(use, u, 1.)
+  v = np.where(use, v, 0.)
+
+  w = np.where(u > 0, 1/np.where(u > 0, u, 1.), 0.)
+  A = np.sum(a*b*w, axis=-1) / np.sum(b*b*w, axis=-1)
+  A = np.where(np.isfinite(A), A, 1.)
+  for _ in range(niter):
+    Ak = A[...,None]
+    D = u + Ak**2*v
+    r = a - Ak*b
+    g = np.sum(-2*b*r/D - 2*Ak*v*r**2/D**2, axis=-1)
+    h = np.sum(2*b**2/D + 8*Ak*b*v*r/D**2 - 2*v*r**2/D**2 + 8*Ak**2*v**2*r**2/D**3, axis=-1)
+    h = np.where(h > 0, h, np.sum(2*b**2/D, axis=-1))
+    step = g/h
+    A = A - step
+    if np.all(np.abs(step) <= tol*np.abs(A)):
+      break
+
+  Ak = A[...,None]
+  D = u + Ak**2*v
+  r = a - Ak*b
+  h = np.sum(2*b**2/D + 8*Ak*b*v*r/D**2 - 2*v*r**2/D**2 + 8*Ak**2*v**2*r**2/D**3, axis=-1)
+  return A, np.sqrt(2/h)
+
+def format_columns(cols, fmt, chunk_size=2**14):
+  """
+  Generator of text blocks for the columns in cols, with fmt giving the
+  format of one line, e.g. "%9.3f %12.5E\n". Each block of chunk_size
+  lines is formatted with a single % operation, rather than line by line.
+  """
+  data = np.column_stack(cols)
+  for i0 in range(0, len(data), chunk_size):
+    block = data[i0:i0+chunk_size]
+    yield (fmt * len(block)) % tuple(block.ravel().tolist())
+
+def write_columns(fname, cols, fmt, mode='w', chunk_size=2**14, compresslevel=6):
+  """
+  Write the columns in cols to a text file, with fmt giving the format of
+  one line (see format_columns). Files ending in .gz are gzip compressed
+  (with compresslevel) as they are written. fname may also be an open text
+  file.
+  """
+  if not isinstance(fname, str):
+    for text in format_columns(cols, fmt, chunk_size):
+      fname.write(text)
+  elif fname.endswith(".gz"):
+    with gzip.open(fname, mode+'t', compresslevel=compresslevel) as F:
+      write_columns(F, cols, fmt, chunk_size=chunk_size)
+  else:
+    with open(fname, mode) as F:
+      write_columns(F, cols, fmt, chunk_size=chunk_size)
+
+def _grid_key(x):
+  """
+  Content hash of a wavelength grid, used to key cached quantities. x may
+  also be a WavelengthGrid, in which case the cached hash is returned.
+  """
+  key = getattr(x, 'key', None)
+  if key is not None:
+    return key
+  x = np.ascontiguousarray(x, dtype=float)
+  return len(x), hashlib.sha1(x).hexdigest()
@@ -0,0 +1,375 @@
+"""
+Tools for working with grids of DK model spectra.
+"""
+import numpy as np
+import os
+import glob
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .spec_class import Spectrum
+from .spec_io import model_from_dk, _read_dk_header
+from .resample import get_resampler
+
+__all__ = [
+  "ModelCatalogue",
+  "ModelGrid",
+  "GridFit",
+]
+
+class ModelCatalogue(object):
+  """
+  Index of the header parameters (Teff, logg, element abundances) of a
+  directory of DK model files, so that models can be found without reading
+  the files. The index is saved as JSON (by default in the directory, if it
+  is writable), and is updated incrementally: only new or modified files (by
+  mtime and size) are read when the catalogue is opened or update() is
+  called.
+
+  Example:
+  >>> C = ModelCatalogue("models/")
+  >>> fnames = C.query(Teff=(10000, 12000), logg=8, elements=['Ca'])
+  >>> MM = C.load(fnames)
+
+  .............................................................................
+  Query arguments can be a single value (matched to within 1e-6), or a
+  (min, max) tuple (inclusive). Element abundances (log number fractions)
+  can be constrained with keyword arguments, e.g. Ca=(-9, -7).
+  """
+  def __init__(self, directory, pattern="*.dk", index_file=None):
+    self.directory = directory
+    self.pattern = pattern
+    if index_file is None:
+      index_file = os.path.join(directory, ".dk_index.json")
+    self.index_file = index_file
+    try:
+      with open(index_file, 'r') as F:
+        self._index = json.load(F)
+    except (OSError, ValueError):
+      self._index = {}
+    self._arrays = None
+    self.update()
+
+  def __len__(self):
+    return len(self._index)
+
+  def __repr__(self):
+    return f"ModelCatalogue of {len(self)} models in '{self.directory}'"
+
+  def update(self):
+    """
+    Rescan the directory, reading the headers of new or modified files, and
+    dropping any that have been removed. The index file is rewritten if
+    anything changed. Returns the number of files (re)read.
+    """
+    fnames = sorted(glob.glob(os.path.join(self.directory, self.pattern)))
+    current = {os.path.relpath(f, self.directory) for f in fnames}
+    changed = [key for key in self._index if key not in current]
+    for key in changed:
+      del self._index[key]
+
+    nread = 0
+    for key in sorted(current):
+      st = os.stat(os.path.join(self.directory, key))
+      entry = self._index.get(key)
+      if entry is not None and entry['mtime'] == st.st_mtime_ns and entry['size'] == st.st_size:
+        continue
+      with open(os.path.join(self.directory, key), 'r') as Fdk:
+        hdr = _read_dk_header(Fdk)
+      self._index[key] = {
+        'mtime' : st.st_mtime_ns,
+        'size'  : st.st_size,
+        'Teff'  : hdr.get('Teff', np.nan),
+        'logg'  : hdr.get('logg', np.nan),
+        'el'    : hdr['el'],
+      }
+      nread += 1
+
+    if nread or changed:
+      self._arrays = None
+      self.save()
+    return nread
+
+  def save(self):
+    """
+    Write the index file. If it can't be written (e.g. the model directory
+    is read-only), the index is only kept in memory, and False is returned.
+    """
+    tmp = f"{self.index_file}.{os.getpid()}.tmp"
+    try:
+      with open(tmp, 'w') as F:
+        json.dump(self._index, F)
+      os.replace(tmp, self.index_file)
+    except OSError:
+      try:
+        os.remove(tmp)
+      except OSError:
+        pass
+      return False
+    return True
+
+  def _table(self):
+    """
+    The index as arrays (file names, Teff, logg, and a dict of abundance
+    arrays, with nan for elements not in a model), for vectorised queries.
+    """
+    if self._arrays is None:
+      keys = sorted(self._index)
+      entries = [self._index[key] for key in keys]
+      Teff = np.array([entry['Teff'] for entry in entries], dtype=float)
+      logg = np.array([entry['logg'] for entry in entries], dtype=float)
+      elements = sorted({el for entry in entries for el in entry['el']})
+      el = {
+        Z : np.array([entry['el'].get(Z, np.nan) for entry in entries], dtype=float)
+        for Z in elements
+      }
+      self._arrays = keys, Teff, logg, el
+    return self._arrays
+
+  @property
+  def Teff(self):
+    return self._table()[1]
+
+  @property
+  def logg(self):
+    return self._table()[2]
+
+  @property
+  def elements(self):
+    """
+    Elements found in any model of the catalogue
+    """
+    return list(self._table()[3])
+
+  @staticmethod
+  def _match(values, condition):
+    """
+    Mask of values matching a single value or (min, max) range
+    """
+    if isinstance(condition, (tuple, list)):
+      lo, hi = condition
+      return (values >= lo) & (values <= hi)
+    return np.isclose(values, condition, rtol=1e-6, atol=0)
+
+  def query(self, Teff=None, logg=None, elements=None, **abundances):
+    """
+    Returns the (full) file names of the models matching all of the given
+    conditions, in order of increasing Teff then logg. elements is a list of
+    elements that must be present. Other keyword arguments constrain the
+    abundance of an element, e.g. Ca=(-9, -7).
+    """
+    keys, T, g, el = self._table()
+    mask = np.ones(len(keys), dtype=bool)
+    if Teff is not None:
+      mask &= self._match(T, Teff)
+    if logg is not None:
+      mask &= self._match(g, logg)
+    for Z in (elements or []):
+      mask &= ~np.isnan(el[Z]) if Z in el else False
+    for Z, condition in abundances.items():
+      mask &= self._match(el[Z], condition) if Z in el else False
+
+    idx = np.flatnonzero(mask)
+    idx = idx[np.lexsort((g[idx], T[idx]))]
+    return [os.path.join(self.directory, keys[i]) for i in idx]
+
+  def header(self, fname):
+    """
+    Returns the indexed header items (Teff, logg, el) of a model
+    """
+    entry = self._index[os.path.relpath(fname, self.directory)]
+    return {'Teff':entry['Teff'], 'logg':entry['logg'], 'el':dict(entry['el'])}
+
+  def load(self, fnames, x_unit='AA', y_unit='erg/(s cm2 AA)'):
+    """
+    Load models (e.g. from query), see model_from_dk
+    """
+    return [model_from_dk(fname, x_unit, y_unit) for fname in fnames]
+#
+
+class ModelGrid(object):
+  """
+  A grid of model spectra, for fitting data with every model at once.
+  The models are resampled onto the x values of the data once (and cached,
+  per data grid and interpolation kind), then the optimal scale factor and
+  chi2 for each model are computed with matrix products. With the default
+  cubic interpolation, the scale factors are those Spectrum.scale_model
+  would give for every model.
+
+  Example:
+  >>> G = ModelGrid.from_files(C.query(logg=8))
+  >>> fit = G.fit(S)
+  >>> fit.ranked(5) #5 best models
+  >>> M = G[fit.best] * fit.A[fit.best]
+
+  .............................................................................
+  If all models share the same x values (as is typical for DK grids), they
+  are stacked into a single array and resampled with one sparse matrix
+  product. Otherwise each model is interpolated separately.
+  """
+  resample_cache_size = 8
+
+  def __init__(self, models):
+    """
+    Create grid from a list of model Spectra, which must have the same
+    units and wave (air/vac).
+    """
+    models = list(models)
+    if len(models) == 0:
+      raise ValueError("Cannot create a grid from zero models")
+    M0 = models[0]
+    for M in models:
+      if not isinstance(M, Spectrum):
+        raise TypeError('item is not Spectrum')
+      M._compare_units(M0, xy='xy')
+      if M.wave != M0.wave:
+        raise ValueError("models must have the same wavelengths (air/vac)")
+    #with a shared grid, the models are stacked, and self.models are
+    #(read-only, so copy-on-write) views of the rows, not a second copy
+    if all(M.grid is M0.grid for M in models):
+      G = M0.grid
+      self._Y = np.array([M._y for M in models])
+      self._Y.flags.writeable = False
+      models = [M._spawn(G.x, Y, M._shared('_e'), grid=G) for M, Y in zip(models, self._Y)]
+    else:
+      self._Y = None
+    self.models = models
+    self.names = [M.name for M in models]
+    self.heads = [M.head for M in models]
+    self._resampled = OrderedDict()
+
+  @classmethod
+  def from_files(cls, fnames, x_unit='AA', y_unit='erg/(s cm2 AA)'):
+    """
+    Create grid from a list of DK model files (e.g. from ModelCatalogue.query)
+    """
+    return cls([model_from_dk(fname, x_unit, y_unit) for fname in fnames])
+
+  def __len__(self):
+    return len(self.models)
+
+  def __getitem__(self, i):
+    return self.models[i]
+
+  def __repr__(self):
+    return f"ModelGrid of {len(self)} models"
+
+  def params(self, key):
+    """
+    Array of a header item (e.g. 'Teff') for every model (nan if missing)
+    """
+    return np.array([head.get(key, np.nan) for head in self.heads], dtype=float)
+
+  def resample(self, S, kind='cubic'):
+    """
+    Returns the models resampled onto the x values of the Spectrum S, as an
+    (N, len(S)) array, and a mask of the pixels of S covered by all of
+    the models. The result is cached.
+    """
+    M0 = self.models[0]
+    M0._compare_units(S, 'x')
+    if M0.wave != S.wave:
+      raise ValueError("wavelengths differ between models and data")
+    key = S.grid.key, kind
+    if key in self._resampled:
+      self._resampled.move_to_end(key)
+      return self._resampled[key]
+
+    if self._Y is not None:
+      R = get_resampler(M0.grid, S.grid, kind)
+      Y, inside = R(self._Y, 0.), R.inside
+    else:
+      Y = np.array([M.interp(S, kind)._y for M in self.models])
+      x = S._x
+      inside = np.ones(len(x), dtype=bool)
+      for M in self.models:
+        inside &= (x >= M._x.min()) & (x <= M._x.max())
+
+    self._resampled[key] = Y, inside
+    while len(self._resampled) > self.resample_cache_size:
+      self._resampled.popitem(last=False)
+    return Y, inside
+
+  def fit(self, S, kind='cubic', chunk_size=256, workers=1):
+    """
+    Fit every model to the Spectrum S, with an optimal scale factor for each
+    (as in Spectrum.scale_model). Only pixels with e > 0 that are covered
+    by all models are used. scale_model uses all pixels with e > 0, but
+    pixels outside a model are interpolated as zero there, and so do not
+    change the scale factor. The models are interpolated with kind (cubic,
+    as in scale_model). For each model, the scale factor A, and chi2
+    follow from
+      num = sum(Y*y/e**2), den = sum(Y**2/e**2)
+      A = num/den, chi2 = sum(y**2/e**2) - num**2/den
+    where Y is the resampled model. The models are processed in chunks of
+    chunk_size, optionally in parallel with a pool of workers threads.
+    Returns a GridFit.
+    """
+    self.models[0]._compare_units(S, 'xy')
+    Y, inside = self.resample(S, kind)
+    good = inside & (S._e > 0)
+    w = np.zeros(len(S))
+    w[good] = S._e[good]**-2
+    yw = np.where(good, S._y, 0.) * w
+    yyw = np.sum(np.where(good, S._y, 0.) * yw)
+
+    def work(sl):
+      Yc = Y[sl]
+      return Yc @ yw, np.einsum('ij,ij,j->i', Yc, Yc, w)
+
+    chunks = [slice(i0, i0+chunk_size) for i0 in range(0, len(Y), chunk_size)]
+    if workers == 1:
+      results = [work(sl) for sl in chunks]
+    else:
+      with ThreadPoolExecutor(workers) as pool:
+        results = list(pool.map(work, chunks))
+    num = np.concatenate([r[0] for r in results])
+    den = np.concatenate([r[1] for r in results])
+
+    A = num/den
+    chi2 = yyw - num*A
+    return GridFit(self, A, 1/np.sqrt(den), chi2, int(good.sum())-1)
+#
+
+class GridFit(object):
+  """
+  Result of ModelGrid.fit. A, A_err, and chi2 are arrays with one value per
+  model (in the order of the grid), and rank gives the models in order of
+  increasing chi2, i.e. rank[0] (also .best) is the best fitting model.
+  """
+  def __init__(self, grid, A, A_err, chi2, dof):
+    self.grid = grid
+    self.A = A
+    self.A_err = A_err
+    self.chi2 = chi2
+    self.dof = dof
+    self.rank = np.argsort(chi2, kind='stable')
+
+  def __len__(self):
+    return len(self.chi2)
+
+  def __repr__(self):
+    i = self.best
+    return f"GridFit of {len(self)} models, best: {self.grid.names[i]} (chi2 = {self.chi2[i]:.2f}, dof = {self.dof})"
+
+  @property
+  def best(self):
+    return self.rank[0]
+
+  @property
+  def chi2_red(self):
+    return self.chi2 / self.dof
+
+  def ranked(self, n=None):
+    """
+    List of (name, chi2, A) for the n best fitting models (default all)
+    """
+    return [(self.grid.names[i], self.chi2[i], self.A[i]) for i in self.rank[:n]]
+
+  def surface(self, key='Teff'):
+    """
+    Returns the header item key (e.g. 'Teff') of every model, and the
+    corresponding chi2 values, for plotting/interpolating the chi2 surface.
+    """
+    return self.grid.params(key), self.chi2
+#
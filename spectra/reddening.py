@@ -1,20 +1,59 @@
 import numpy as np
+from collections import OrderedDict
+from .misc import _grid_key
 
 __all__ = [
-  "A_curve"
+  "A_curve",
+  "extinction_models",
 ]
 
+#LRU cache of extinction curves, keyed on the grid, R, and model
+_curve_cache = OrderedDict()
+curve_cache_size = 64
+
 def A_curve(x, R=3.1, use_model='CCM89'):
-  extinction_models = {
-    'CCM89' : A_CCM89,
-  }
-  model = extinction_models[use_model]
-  return model(x, R)
+  """
+  Extinction curve A(x)/A(V) for the model use_model (see
+  extinction_models), where x is in units of 1/um. x may be an ndarray or
+  WavelengthGrid. Curves are cached per grid, R, and model, and returned
+  as read-only arrays.
+  """
+  if use_model not in extinction_models:
+    raise ValueError(f"use_model must be one of: {' '.join(extinction_models)}")
+  key = _grid_key(x), float(R), use_model
+  if key in _curve_cache:
+    _curve_cache.move_to_end(key)
+    return _curve_cache[key]
+
+  A = extinction_models[use_model](np.asarray(x, dtype=float), R)
+  A.flags.writeable = False
+  _curve_cache[key] = A
+  while len(_curve_cache) > curve_cache_size:
+    _curve_cache.popitem(last=False)
+  return A
 
 def A_CCM89(x, R):
   """
   Calculate CCM 1989 extinction curve. x is in units of 1/um.
   """
+  poly_a = [1, +0.17699, -0.50447, -0.02427, +0.72085, +0.01979, -0.77530, +0.32999]
+  poly_b = [0, +1.41338, +2.28305, +1.07233, -5.38434, -0.62251, +5.30260, -2.09002]
+  return _A_CCM(x, R, poly_a, poly_b)
+
+def A_OD94(x, R):
+  """
+  Calculate O'Donnell 1994 extinction curve. This is the CCM 1989 curve, but
+  with updated coefficients in the optical. x is in units of 1/um.
+  """
+  poly_a = [1, +0.104, -0.609, +0.701, +1.137, -1.718, -0.827, +1.647, -0.505]
+  poly_b = [0, +1.952, +2.908, -3.989, -7.985, +11.102, +5.491, -10.805, +3.347]
+  return _A_CCM(x, R, poly_a, poly_b)
+
+def _A_CCM(x, R, poly_a, poly_b):
+  """
+  CCM-like extinction curve, where poly_a and poly_b are the coefficients
+  (in increasing order) of the optical polynomials in x-1.82.
+  """
   def Av_IR(x):
     """
     0.3 <= x/um < 1.1
@@ -28,10 +67,8 @@ def A_CCM89(x, R):
     1.1 <= x/um < 3.3
     """
     y = x-1.82
-    poly_a = [1, +0.17699, -0.50447, -0.02427, +0.72085, +0.01979, -0.77530, +0.32999][::-1]
-    poly_b = [0, +1.41338, +2.28305, +1.07233, -5.38434, -0.62251, +5.30260, -2.09002][::-1]
-    a = np.polyval(poly_a, y)
-    b = np.polyval(poly_b, y)
+    a = np.polyval(poly_a[::-1], y)
+    b = np.polyval(poly_b[::-1], y)
     return a, b
 
   def Av_UV(x):
@@ -69,3 +106,8 @@ def A_CCM89(x, R):
   a[FUV], b[FUV] = Av_UV(8.0)
   A = a + b/R
   return A
+
+extinction_models = {
+  'CCM89' : A_CCM89,
+  'OD94'  : A_OD94,
+}
@@ -0,0 +1,121 @@
+"""
+Precomputed interpolation operators, for resampling many flux arrays from
+one wavelength grid onto another without refitting interpolants each time.
+"""
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import splu
+from scipy.interpolate import BSpline
+from collections import OrderedDict
+from .misc import lanczos_weights, _grid_key
+
+__all__ = [
+  "Resampler",
+  "get_resampler",
+]
+
+class Resampler(object):
+  """
+  Linear operator that interpolates arrays from the grid x1 onto the grid
+  x2. The interpolation weights are stored as a sparse matrix, so applying
+  the operator to a flux vector, or a 2D stack of fluxes (one spectrum per
+  row), is a sparse matrix product.
+
+  Supported kinds are:
+    'linear' : linear interpolation (as interp1d)
+    'cubic'  : not-a-knot cubic spline (as interp1d). The spline fit is
+               a banded linear system, which is factorised once.
+    'sinc'   : Lanczos interpolation, with kernel size a (default 3).
+
+  Example:
+  >>> R = Resampler(M.x, S.x, 'cubic')
+  >>> Y2 = R(Y) #Y has shape (N, len(M.x)), Y2 has shape (N, len(S.x))
+  """
+  kinds = ('linear', 'cubic', 'sinc')
+
+  def __init__(self, x1, x2, kind='cubic', a=3):
+    if kind not in self.kinds:
+      raise ValueError(f"kind must be one of: {' '.join(self.kinds)}")
+    self.kind = kind
+    self.shape = len(x2), len(x1)
+
+    if np.all(np.diff(x1) > 0):
+      self._order = None
+    else:
+      self._order = np.argsort(x1, kind='mergesort')
+      x1 = x1[self._order]
+
+    self.inside = (x2 >= x1[0]) & (x2 <= x1[-1])
+    xin = x2[self.inside]
+    self._lu = None
+
+    if kind == 'linear':
+      i = np.clip(np.searchsorted(x1, xin) - 1, 0, len(x1)-2)
+      t = (xin - x1[i]) / (x1[i+1] - x1[i])
+      rows = np.repeat(np.arange(len(xin)), 2)
+      cols = np.column_stack([i, i+1]).ravel()
+      vals = np.column_stack([1-t, t]).ravel()
+      self.W = sparse.csr_matrix((vals, (rows, cols)), shape=(len(xin), len(x1)))
+    elif kind == 'cubic':
+      if len(x1) < 4:
+        raise ValueError("cubic interpolation requires at least 4 points")
+      t = np.r_[(x1[0],)*4, x1[2:-2], (x1[-1],)*4]
+      self._lu = splu(sparse.csc_matrix(BSpline.design_matrix(x1, t, 3)))
+      self.W = sparse.csr_matrix(BSpline.design_matrix(xin, t, 3))
+    else:
+      idx, w = lanczos_weights(x1, xin, a)
+      rows = np.repeat(np.arange(len(xin)), idx.shape[1])
+      self.W = sparse.csr_matrix((w.ravel(), (rows, idx.ravel())), shape=(len(xin), len(x1)))
+
+  def _apply(self, W, y):
+    """
+    Apply W (after the spline solve, if any) along the last axis of y.
+    """
+    if self._order is not None:
+      y = y[...,self._order]
+    yT = y.T
+    if self._lu is not None:
+      yT = self._lu.solve(np.asarray(yT, dtype=float))
+    return (W @ yT).T
+
+  def __call__(self, y, fill_value=0.):
+    """
+    Interpolate y (along its last axis). Points outside the range of the
+    original grid are set to fill_value.
+    """
+    out = np.full(y.shape[:-1] + (self.shape[0],), fill_value, dtype=float)
+    out[...,self.inside] = self._apply(self.W, y)
+    return out
+
+  def errors(self, e, fill_value=np.inf):
+    """
+    Interpolate flux errors. For Lanczos interpolation these are propagated
+    through the weights, i.e. sqrt(W^2 @ e^2). Otherwise the errors are
+    interpolated in the same manner as the fluxes (as in Spectrum.interp).
+    """
+    if self.kind == 'sinc':
+      out = np.full(e.shape[:-1] + (self.shape[0],), fill_value, dtype=float)
+      out[...,self.inside] = np.sqrt(self._apply(self.W.multiply(self.W), e**2))
+      return out
+    return self(e, fill_value)
+#
+
+#LRU cache of resampling operators, keyed on the two grids and kind
+_resampler_cache = OrderedDict()
+resampler_cache_size = 32
+
+def get_resampler(x1, x2, kind='cubic', **kwargs):
+  """
+  Returns a (cached) Resampler from x1 onto x2. Repeated calls with the same
+  grids and kind return the same operator, without rebuilding it. The grids
+  may be ndarrays or WavelengthGrids (whose hashes are cached).
+  """
+  key = _grid_key(x1), _grid_key(x2), kind, tuple(sorted(kwargs.items()))
+  if key in _resampler_cache:
+    _resampler_cache.move_to_end(key)
+    return _resampler_cache[key]
+
+  R = _resampler_cache[key] = Resampler(np.asarray(x1), np.asarray(x2), kind, **kwargs)
+  while len(_resampler_cache) > resampler_cache_size:
+    _resampler_cache.popitem(last=False)
+  return R
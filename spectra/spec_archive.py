@@ -0,0 +1,276 @@
+"""
+Binary archive format for storing large libraries of spectra in one file.
+Spectra are read back as zero-copy views of a memory map, so that opening
+an archive, or loading a few spectra from it, does not read the whole file.
+
+File layout:
+  header : magic (8 bytes), index offset, index length (little endian uint64)
+  data   : concatenated little endian float64 arrays
+  index  : JSON, with the names, wave types, units, header dicts and array
+           offsets of each spectrum
+
+Identical x arrays are stored once, and errors are not stored for spectra
+with zero errors (e.g. models). Data appended after the index has been
+written goes after it, so the file on disk always has a valid header and
+index. The superseded index is left as an unused gap in the data section.
+"""
+import numpy as np
+import os
+import json
+import struct
+import copy
+from .spec_class import Spectrum
+from .grid import WavelengthGrid, get_grid
+from .units import parse_unit
+
+__all__ = [
+  "SpectrumArchive",
+]
+
+_magic = b"SPECARC1"
+_header = struct.Struct("<8sQQ")
+
+def _json_default(obj):
+  """
+  Encode numpy scalars/arrays found in spectrum headers
+  """
+  if isinstance(obj, np.generic):
+    return obj.item()
+  elif isinstance(obj, np.ndarray):
+    return obj.tolist()
+  raise TypeError(f"header item of type {type(obj).__name__} cannot be archived")
+
+class SpectrumArchive(object):
+  """
+  Archive of many spectra in a single file.
+
+  Example:
+  >>> with SpectrumArchive("models.spa", 'w') as A:
+  >>>   A.extend(SS)
+  >>> A = SpectrumArchive("models.spa")
+  >>> S = A[0] #Spectrum
+  >>> S = A["da_10000_800"] #by name
+  >>> SS = A[100:200] #list of spectra
+
+  .............................................................................
+  mode is 'r' (read only), 'a' (append, creating the file if needed) or 'w'
+  (create a new archive, overwriting any existing file). Appended spectra
+  are available immediately, but the index is only written to the file on
+  flush() or close() (or leaving a with block).
+
+  Loaded spectra share memory with the file. Their arrays are read-only, and
+  copied the first time they are modified (see Spectrum), so the archive is
+  never changed by working with its spectra.
+  """
+  def __init__(self, fname, mode='r'):
+    if mode not in ('r', 'a', 'w'):
+      raise ValueError("mode must be 'r', 'a', or 'w'")
+    self.fname = fname
+    self.mode = mode
+    self._mm = None
+    self._grids = {}
+    self._name_map = None
+    self._dirty = False
+
+    if mode == 'w' or (mode == 'a' and not os.path.exists(fname)):
+      self._F = open(fname, 'w+b')
+      self._index = {'grids':[], 'spectra':[]}
+      self._end = _header.size
+      self._index_end = _header.size
+      self._dirty = True
+      self.flush()
+    else:
+      self._F = open(fname, 'rb' if mode == 'r' else 'r+b')
+      magic, offset, length = _header.unpack(self._F.read(_header.size))
+      if magic != _magic:
+        raise ValueError(f"{fname} is not a spectrum archive")
+      self._F.seek(offset)
+      self._index = json.loads(self._F.read(length).decode())
+      self._end = offset
+      self._index_end = offset + length
+    self._grid_ids = {tuple(g['key']):i for i, g in enumerate(self._index['grids'])}
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def __len__(self):
+    return len(self._index['spectra'])
+
+  def __repr__(self):
+    return f"SpectrumArchive '{self.fname}' with {len(self)} spectra"
+
+  @property
+  def names(self):
+    return [rec['name'] for rec in self._index['spectra']]
+
+  @property
+  def index(self):
+    """
+    List of the archive index entries, one dict per spectrum
+    """
+    return self._index['spectra']
+
+  def __contains__(self, name):
+    return name in self._names()
+
+  def _names(self):
+    """
+    Mapping of names to (first) positions in the archive
+    """
+    if self._name_map is None:
+      self._name_map = {}
+      for i, rec in enumerate(self._index['spectra']):
+        self._name_map.setdefault(rec['name'], i)
+    return self._name_map
+
+  def _data(self):
+    """
+    Memory map of the data section of the file, as a read-only float array
+    """
+    N = (self._end - _header.size) // 8
+    if self._mm is None or len(self._mm) != N:
+      if self.mode != 'r':
+        self._F.flush()
+      if N == 0:
+        self._mm = np.empty(0)
+      else:
+        mm = np.memmap(self.fname, '<f8', 'r', offset=_header.size, shape=(N,))
+        self._mm = mm.view(np.ndarray)
+    return self._mm
+
+  def _view(self, offset, n):
+    """
+    Array of n floats at byte offset, as a view of the memory map
+    """
+    i0 = (offset - _header.size) // 8
+    return self._data()[i0:i0+n]
+
+  def _grid(self, gi):
+    """
+    WavelengthGrid for the gi-th stored x array
+    """
+    if gi not in self._grids:
+      g = self._index['grids'][gi]
+      G = WavelengthGrid(self._view(g['offset'], g['n']), g['key'])
+      self._grids[gi] = get_grid(G)
+    return self._grids[gi]
+
+  def _load(self, i):
+    """
+    Load the i-th spectrum
+    """
+    rec = self._index['spectra'][i]
+    G = self._grid(rec['grid'])
+    n = len(G)
+    y = self._view(rec['y'], n)
+    e = np.zeros(n) if rec['e'] is None else self._view(rec['e'], n)
+    xu, yu = parse_unit(rec['x_unit']), parse_unit(rec['y_unit'])
+    head = copy.deepcopy(rec['head'])
+    return Spectrum._fast(G.x, y, e, rec['name'], rec['wave'], xu, yu, head, G)
+
+  def __getitem__(self, key):
+    """
+    Load spectra by position or name. Integers and strings return a single
+    Spectrum, and slices or lists/arrays of positions a list of spectra.
+    """
+    if isinstance(key, (int, np.integer)):
+      if not -len(self) <= key < len(self):
+        raise IndexError("archive index out of range")
+      return self._load(int(key) % len(self))
+    elif isinstance(key, str):
+      if key not in self._names():
+        raise KeyError(f"No spectrum named '{key}'")
+      return self._load(self._names()[key])
+    elif isinstance(key, slice):
+      return [self._load(i) for i in range(len(self))[key]]
+    elif isinstance(key, (list, tuple, np.ndarray)):
+      return [self[k] for k in key]
+    else:
+      raise TypeError("archives must be indexed with int/str/slice/list types")
+
+  def __iter__(self):
+    return (self._load(i) for i in range(len(self)))
+
+  def _write(self, a):
+    """
+    Write array a to the end of the data section, returning its offset.
+    The index on disk is never overwritten, so that the file stays readable
+    until the next flush. If it follows the data, a is written after it
+    (aligned to 8 bytes).
+    """
+    if self._end < self._index_end:
+      self._end = -(-self._index_end // 8) * 8
+    offset = self._end
+    a = np.ascontiguousarray(a, dtype='<f8')
+    self._F.seek(offset)
+    self._F.write(memoryview(a).cast('B'))
+    self._end += a.nbytes
+    return offset
+
+  def append(self, S):
+    """
+    Append a Spectrum to the archive
+    """
+    if self.mode == 'r':
+      raise IOError("archive was opened read-only")
+    if not isinstance(S, Spectrum):
+      raise TypeError("item is not Spectrum")
+
+    head = json.loads(json.dumps(S.head, default=_json_default))
+    G = S.grid
+    if G.key not in self._grid_ids:
+      offset = self._write(G.x)
+      self._grid_ids[G.key] = len(self._index['grids'])
+      self._index['grids'].append({'offset':offset, 'n':len(G), 'key':list(G.key)})
+
+    self._index['spectra'].append({
+      'name'   : S.name,
+      'wave'   : S.wave,
+      'x_unit' : S.x_unit,
+      'y_unit' : S.y_unit,
+      'head'   : head,
+      'grid'   : self._grid_ids[G.key],
+      'y'      : self._write(S._y),
+      'e'      : self._write(S._e) if np.any(S._e) else None,
+    })
+    if self._name_map is not None:
+      self._name_map.setdefault(S.name, len(self)-1)
+    self._dirty = True
+
+  def extend(self, SS):
+    """
+    Append an iterable of spectra to the archive
+    """
+    for S in SS:
+      self.append(S)
+
+  def flush(self):
+    """
+    Write the index (after any new data) and update the file header
+    """
+    if not self._dirty:
+      return
+    index = json.dumps(self._index, separators=(',', ':')).encode()
+    self._F.seek(self._end)
+    self._F.write(index)
+    self._F.truncate()
+    self._F.flush()
+    self._F.seek(0)
+    self._F.write(_header.pack(_magic, self._end, len(index)))
+    self._F.flush()
+    self._index_end = self._end + len(index)
+    self._dirty = False
+
+  def close(self):
+    """
+    Flush any changes and close the file. Loaded spectra remain valid.
+    """
+    if self._F.closed:
+      return
+    if self.mode != 'r':
+      self.flush()
+    self._F.close()
+#
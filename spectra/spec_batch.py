@@ -0,0 +1,610 @@
+"""
+Contains the SpectrumBatch class for working with many spectra that share a
+common wavelength axis.
+"""
+import numpy as np
+import astropy.units as u
+from scipy.interpolate import interp1d, Akima1DInterpolator as Ak_i
+from .spec_class import Spectrum
+from .synphot import mag_calc_AB_batch
+from .reddening import A_curve
+from .resample import Resampler, get_resampler
+from .units import parse_unit, convert_x, convert_y
+from .misc import *
+
+__all__ = [
+  "SpectrumBatch",
+]
+
+class SpectrumBatch(object):
+  """
+  SpectrumBatch stores N spectra on a single shared x-axis, with fluxes and
+  errors held as contiguous (N, Npix) arrays. Arithmetic, interpolation,
+  unit conversion and reddening mirror the Spectrum class, but operate on
+  all spectra at once rather than looping over Spectrum objects.
+
+  Example:
+  >>> B = SpectrumBatch.from_spectra([S1, S2, S3])
+  >>> B2 = (B - S0) * 2
+  >>> B2[0] #Spectrum
+  >>> B2[1:] #SpectrumBatch
+  >>> B2[:, 100:200] #SpectrumBatch with fewer pixels
+
+  .............................................................................
+  Operands may be other batches (with the same number of spectra), a single
+  Spectrum (applied to every row), int/floats, or ndarrays/Quantities that
+  broadcast against the (N, Npix) flux array. Note that a 1D array is
+  interpreted per-pixel (as for Spectrum); use an (N, 1) array to apply one
+  value per spectrum.
+  """
+  __slots__ = ['_x', '_y', '_e', '_names', '_wave', '_xu', '_yu', '_head']
+  #ensures ndarray/Quantity (op) SpectrumBatch defers to SpectrumBatch
+  __array_ufunc__ = None
+
+  def __init__(self, x, y, e, names=None, wave='air', x_unit="AA", y_unit="erg/(s cm^2 AA)", head=None):
+    """
+    Initialise batch. x must be a 1D ndarray, and y a 2D ndarray with shape
+    (N, len(x)). e can be an int/float or any ndarray that broadcasts to the
+    shape of y. names should be a list of N strings (defaults to empty).
+    """
+    self.x = x
+    self.y = y
+    self.e = e
+    self.names = names
+    self.wave = wave
+    self.x_unit = x_unit
+    self.y_unit = y_unit
+    self.head = head
+
+  @classmethod
+  def from_spectra(cls, SS, head=None):
+    """
+    Stack a list/tuple of spectra into a batch. All spectra must have the
+    same units and x values.
+    """
+    if len(SS) == 0:
+      raise ValueError("Cannot create a batch from zero spectra")
+    S0 = SS[0]
+    for S in SS:
+      if not isinstance(S, Spectrum):
+        raise TypeError('item is not Spectrum')
+      S._compare_units(S0, xy='xy')
+      S._compare_x(S0)
+
+    Y = np.array([S.y for S in SS])
+    E = np.array([S.e for S in SS])
+    names = [S.name for S in SS]
+    return cls(S0.x, Y, E, names, S0.wave, S0.x_unit, S0.y_unit, head)
+
+  @property
+  def x(self):
+    return self._x
+
+  @x.setter
+  def x(self, x):
+    if isinstance(x, np.ndarray):
+      if x.ndim == 1:
+        self._x = x.astype(float)
+      else:
+        raise ValueError("x arrays must be 1D")
+    else:
+      raise TypeError("x must be an ndarray")
+
+  @property
+  def y(self):
+    return self._y
+
+  @y.setter
+  def y(self, y):
+    if isinstance(y, np.ndarray):
+      if y.ndim != 2 or y.shape[1] != len(self.x):
+        raise ValueError("y must be a 2D ndarray of shape (N, len(x))")
+      self._y = y.astype(float)
+    else:
+      raise TypeError("y must be of type ndarray")
+
+  @property
+  def e(self):
+    return self._e
+
+  @e.setter
+  def e(self, e):
+    if isinstance(e, (int, float)):
+      if e < 0:
+        raise ValueError("Uncertainties cannot be negative")
+      self._e = np.full(self.y.shape, float(e))
+    elif isinstance(e, np.ndarray):
+      try:
+        e = np.broadcast_to(e, self.y.shape)
+      except ValueError:
+        raise ValueError("e must broadcast to the shape of y")
+      if np.any(e < 0):
+        raise ValueError("Uncertainties cannot be negative")
+      self._e = np.array(e, dtype=float)
+    else:
+      raise TypeError("e must be of type int/float/ndarray")
+
+  @property
+  def names(self):
+    return self._names
+
+  @names.setter
+  def names(self, names):
+    if names is None:
+      self._names = [""]*len(self.y)
+    elif all(isinstance(name, str) for name in names):
+      if len(names) != len(self.y):
+        raise ValueError("names must have one entry per spectrum")
+      self._names = list(names)
+    else:
+      raise TypeError("names must be a list of strings")
+
+  @property
+  def wave(self):
+    return self._wave
+
+  @wave.setter
+  def wave(self, wave):
+    if wave in ('vac', 'air'):
+      self._wave = wave
+    else:
+      raise ValueError("wave must be 'vac' or 'air'")
+
+  @property
+  def x_unit(self):
+    return self._xu.to_string()
+
+  @x_unit.setter
+  def x_unit(self, x_unit):
+    if isinstance(x_unit, (str, u.UnitBase)):
+      self._xu = parse_unit(x_unit)
+    else:
+      raise TypeError("x_unit must be str or Unit type")
+
+  @property
+  def y_unit(self):
+    return self._yu.to_string()
+
+  @y_unit.setter
+  def y_unit(self, y_unit):
+    if isinstance(y_unit, (str, u.UnitBase)):
+      self._yu = parse_unit(y_unit)
+    else:
+      raise TypeError("y_unit must be str or Unit type")
+
+  @property
+  def head(self):
+    return self._head
+
+  @head.setter
+  def head(self, head):
+    if head is None:
+      self._head = {}
+    else:
+      if isinstance(head, dict):
+        self._head = head
+      else:
+        raise ValueError("head must be a dictionary")
+
+  @property
+  def var(self):
+    """
+    Variance attribute from flux errors
+    """
+    return self.e**2
+
+  @var.setter
+  def var(self, value):
+    self.e = np.sqrt(value)
+
+  @property
+  def ivar(self):
+    """
+    Inverse variance attribute from flux errors
+    """
+    return 1.0/self.var
+
+  @ivar.setter
+  def ivar(self, value):
+    self.var = 1.0/value
+
+  @property
+  def SN(self):
+    """
+    Signal to noise ratio
+    """
+    return np.abs(self.y/self.e)
+
+  @property
+  def shape(self):
+    """
+    Shape of the flux array, i.e. (number of spectra, number of pixels)
+    """
+    return self.y.shape
+
+  @property
+  def npix(self):
+    """
+    Number of pixels in each spectrum
+    """
+    return len(self.x)
+
+  @property
+  def data(self):
+    """
+    Returns all three arrays as a tuple. Useful for creating new batches, e.g.
+    >>> SpectrumBatch(*B.data)
+    """
+    return self.x, self.y, self.e
+
+  @property
+  def info(self):
+    """
+    Returns non-array attributes as a dictionary. This can be
+    used to create new batches with the same information, e.g.
+    >>> SpectrumBatch(x, y, e, **B.info)
+    """
+    kwargs = {
+      'names'  : list(self.names),
+      'wave'   : self.wave,
+      'x_unit' : self.x_unit,
+      'y_unit' : self.y_unit,
+      'head'   : self.head,
+    }
+    return kwargs
+
+  def _spectrum_info(self, i):
+    """
+    Info dictionary for creating a Spectrum from row i
+    """
+    return {
+      'name'   : self.names[i],
+      'wave'   : self.wave,
+      'x_unit' : self.x_unit,
+      'y_unit' : self.y_unit,
+      'head'   : self.head,
+    }
+
+  def __len__(self):
+    """
+    Return number of spectra in batch
+    """
+    return len(self.y)
+
+  def __repr__(self):
+    """
+    Return batch representation
+    """
+    ret = "\n".join([
+      f"SpectrumBatch class with {len(self)} spectra of {self.npix} pixels",
+      f"x-unit: {self.x_unit}",
+      f"y-unit: {self.y_unit}",
+      f"wavelengths: {self.wave}",
+      f"header: {self.head}",
+    ])
+
+    return ret
+
+  def __getitem__(self, key):
+    """
+    Return self[key]. The first index selects spectra, and an optional second
+    index selects pixels. Integer spectrum indices return a Spectrum.
+    """
+    if isinstance(key, tuple):
+      if len(key) != 2:
+        raise IndexError("batches support at most two indices")
+      rows, pix = key
+      if isinstance(pix, int):
+        raise TypeError("pixels must be indexed with slice/ndarray types")
+      sub = self[rows]
+      return sub[pix] if isinstance(sub, Spectrum) else sub._pixels(pix)
+
+    if isinstance(key, int):
+      return Spectrum(self.x, self.y[key], self.e[key], **self._spectrum_info(key))
+    elif isinstance(key, (slice, list, np.ndarray)):
+      names = list(np.array(self.names, dtype=object)[key])
+      info = self.info
+      info['names'] = names
+      return SpectrumBatch(self.x, self.y[key], self.e[key], **info)
+    else:
+      raise TypeError("batches must be indexed with int/slice/ndarray types")
+
+  def _pixels(self, key):
+    """
+    Return a new batch with only the pixels selected by key
+    """
+    return SpectrumBatch(self.x[key], self.y[:,key], self.e[:,key], **self.info)
+
+  def __iter__(self):
+    """
+    Return iterator over the spectra in the batch
+    """
+    return (self[i] for i in range(len(self)))
+
+  def _compare_x(self, other):
+    """
+    Check x-axis of another Spectrum/SpectrumBatch matches
+    """
+    if self.wave != other.wave:
+      raise ValueError("Spectra must have same wavelengths (air/vac)")
+    if self._xu != other._xu:
+      raise u.UnitsError("x_units differ")
+    if self._x is other._x:
+      return
+    if len(self._x) != len(other._x) or not np.allclose(self._x, other._x):
+      raise ValueError("Spectra must have same x values")
+
+  def _operand(self, other, dimensionless_y=False):
+    """
+    Convert other (SpectrumBatch/Spectrum/int/float/ndarray/Quantity) to flux
+    and error arrays that broadcast against self.y, plus a y-unit. This is
+    used internally to simplify the arithmetic implementation.
+    """
+    if isinstance(other, SpectrumBatch):
+      self._compare_x(other)
+      if len(other) != len(self):
+        raise ValueError("batches must contain the same number of spectra")
+      return other.y, other.e, other._yu
+    elif isinstance(other, Spectrum):
+      self._compare_x(other)
+      return other._y, other._e, other._yu
+    elif isinstance(other, u.Quantity):
+      y, yu = other.value, other.unit
+    elif isinstance(other, (int, float, np.ndarray)):
+      y = other
+      yu = u.dimensionless_unscaled if dimensionless_y else self._yu
+    else:
+      raise NotImplementedError("Cannot cast object to SpectrumBatch operand")
+
+    try:
+      np.broadcast_to(y, self.shape)
+    except ValueError:
+      raise ValueError(f"operand of shape {np.shape(y)} does not broadcast to {self.shape}")
+    return y, np.float64(0.), yu
+
+  def _new(self, y, e, y_unit=None):
+    """
+    Create a batch with the same x-axis and info as self
+    """
+    info = self.info
+    if y_unit is not None:
+      info['y_unit'] = y_unit
+    return SpectrumBatch(self.x, np.broadcast_to(y, self.shape), e, **info)
+
+  def __add__(self, other):
+    """
+    Return self + other (with standard error propagation)
+    """
+    y2, e2, yu2 = self._operand(other)
+    if yu2 != self._yu:
+      raise u.UnitsError("y_units differ")
+    return self._new(self.y + y2, np.hypot(self.e, e2))
+
+  def __sub__(self, other):
+    """
+    Return self - other (with standard error propagation)
+    """
+    y2, e2, yu2 = self._operand(other)
+    if yu2 != self._yu:
+      raise u.UnitsError("y_units differ")
+    return self._new(self.y - y2, np.hypot(self.e, e2))
+
+  def __mul__(self, other):
+    """
+    Return self * other (with standard error propagation)
+    """
+    y2, e2, yu2 = self._operand(other, True)
+    ynew = self.y * y2
+    enew = np.abs(ynew)*np.hypot(self.e/self.y, e2/y2)
+    return self._new(ynew, enew, self._yu * yu2)
+
+  def __truediv__(self, other):
+    """
+    Return self / other (with standard error propagation)
+    """
+    y2, e2, yu2 = self._operand(other, True)
+    ynew = self.y / y2
+    enew = np.abs(ynew)*np.hypot(self.e/self.y, e2/y2)
+    return self._new(ynew, enew, self._yu / yu2)
+
+  def __radd__(self, other):
+    """
+    Return other + self (with standard error propagation)
+    """
+    return self + other
+
+  def __rsub__(self, other):
+    """
+    Return other - self (with standard error propagation)
+    """
+    y2, e2, yu2 = self._operand(other)
+    if yu2 != self._yu:
+      raise u.UnitsError("y_units differ")
+    return self._new(y2 - self.y, np.hypot(self.e, e2))
+
+  def __rmul__(self, other):
+    """
+    Return other * self (with standard error propagation)
+    """
+    return self * other
+
+  def __rtruediv__(self, other):
+    """
+    Return other / self (with standard error propagation)
+    """
+    y2, e2, yu2 = self._operand(other, True)
+    ynew = y2 / self.y
+    enew = np.abs(ynew)*np.hypot(self.e/self.y, e2/y2)
+    return self._new(ynew, enew, yu2 / self._yu)
+
+  def __pow__(self, other):
+    """
+    Return B**other (with standard error propagation)
+    """
+    if isinstance(other, (int, float)):
+      ynew = self.y**other
+      enew = np.abs(other * ynew * self.e/self.y)
+      return self._new(ynew, enew, self._yu**other)
+    else:
+      raise TypeError("other must be int/float")
+
+  def __neg__(self):
+    """
+    Implements -self
+    """
+    return self._new(-self.y, self.e)
+
+  def __pos__(self):
+    """
+    Implements +self
+    """
+    return self
+
+  def __abs__(self):
+    """
+    Implements abs(self)
+    """
+    return self._new(np.abs(self.y), self.e)
+
+  def copy(self):
+    """
+    Returns a copy of self
+    """
+    return SpectrumBatch(*self.data, **self.info)
+
+  def sect(self, x0, x1):
+    """
+    Returns a truth array for wavelengths between x0 and x1.
+    """
+    return (self.x>x0) & (self.x<x1)
+
+  def clip(self, x0, x1):
+    """
+    Returns SpectrumBatch clipped between x0 and x1.
+    """
+    return self[:, self.sect(x0, x1)]
+
+  def interp(self, X, kind='cubic', **kwargs):
+    """
+    Interpolates all spectra onto the wavelength axis X, if X is a numpy
+    array, or X.x if X is a Spectrum/SpectrumBatch. As with Spectrum.interp,
+    this returns a new batch, and wavelengths outside the range of the
+    original spectra are filled with zeroes.
+    """
+    if isinstance(X, np.ndarray):
+      x2 = 1*X
+    elif isinstance(X, (Spectrum, SpectrumBatch)):
+      if self._xu != X._xu:
+        raise u.UnitsError("x_units differ")
+      if self.wave != X.wave:
+        raise ValueError("wavelengths differ between spectra")
+      x2 = 1*X.x
+    else:
+      raise TypeError("interpolant was not ndarray/Spectrum/SpectrumBatch type")
+
+    if kind == "Akima":
+      y2 = Ak_i(self.x, self.y, axis=1)(x2)
+      e2 = Ak_i(self.x, self.e, axis=1)(x2)
+      nan = np.isnan(y2) | np.isnan(e2)
+      y2[nan] = 0.
+      e2[nan] = 0.
+    elif kind == "sinc" or (kind in Resampler.kinds and not kwargs and self.npix >= 4):
+      R = get_resampler(self.x, x2, kind, **kwargs)
+      y2 = R(self.y, 0.)
+      e2 = R.errors(self.e, np.inf)
+    else:
+      y2 = interp1d(self.x, self.y, kind=kind, axis=1, \
+        bounds_error=False, fill_value=0., **kwargs)(x2)
+      e2 = interp1d(self.x, self.e, kind=kind, axis=1, \
+        bounds_error=False, fill_value=np.inf, **kwargs)(x2)
+
+    e2[e2 < 0] = 0.
+    return SpectrumBatch(x2, y2, e2, **self.info)
+
+  def mag_calc_AB(self, filts, errors=False):
+    """
+    Calculates AB magnitudes of every spectrum in the filter(s) filts, with
+    the result having shape (N, F). See synphot.mag_calc_AB_batch.
+    """
+    return mag_calc_AB_batch(self, filts, errors=errors)
+
+  def convolve_gaussian(self, fwhm, chunk_size=None):
+    """
+    Convolve every spectrum with a Gaussian with FWHM, returning a new batch.
+    chunk_size sets how many spectra are convolved at once.
+    """
+    B = self.copy()
+    B.y = convolve_gaussian(B.x, B.y, fwhm, chunk_size=chunk_size)
+    return B
+
+  def convolve_gaussian_R(self, res, chunk_size=None):
+    """
+    Convolve every spectrum to a resolution R, returning a new batch.
+    chunk_size sets how many spectra are convolved at once.
+    """
+    B = self.copy()
+    B.y = convolve_gaussian_R(B.x, B.y, res, chunk_size=chunk_size)
+    return B
+
+  def norm_percentile(self, pc):
+    """
+    Normalises each spectrum to a certain percentile of its fluxes.
+    """
+    norm = np.percentile(self.y, pc, axis=1, keepdims=True)
+    self.y /= norm
+    self.e /= norm
+
+  def redden(self, E_BV, Rv=3.1, model='CCM89'):
+    """
+    Apply a reddening curve (default CCM89, see reddening.extinction_models)
+    to every spectrum given an E_BV and a value of Rv (default=3.1). E_BV can
+    be a single value, or an array with one value per spectrum.
+    """
+    x = convert_x(self.x, self._xu, u.AA)
+    if self.wave == "air":
+      x = air_to_vac(x)
+    x = convert_x(x, u.AA, "1/um")
+
+    E_BV = np.reshape(E_BV, (-1, 1)) if np.ndim(E_BV) else E_BV
+    A = Rv * E_BV * A_curve(x, Rv, model)
+    extinction = 10**(-0.4*A)
+    self.y *= extinction
+    self.e *= extinction
+
+  def x_unit_to(self, new_unit):
+    """
+    Changes units of the x-data. Supports conversion between wavelength
+    and energy etc. Argument should be a string or Unit.
+    """
+    self.x = convert_x(self.x, self._xu, new_unit)
+    self.x_unit = new_unit
+
+  def y_unit_to(self, new_unit):
+    """
+    Changes units of the y-data. Supports conversion between Fnu
+    and Flambda etc. Argument should be a string or Unit.
+    """
+    y, e = convert_y(self.x, self._xu, self._yu, new_unit, self.y, self.e)
+    self.y = y
+    self.e = e
+    self.y_unit = new_unit
+
+  def air_to_vac(self):
+    """
+    Changes air wavelengths to vaccuum wavelengths in place
+    """
+    if self._xu != u.AA:
+      raise u.UnitsError("x_units differ")
+    if self.wave == 'air':
+      self.x = air_to_vac(self.x)
+      self.wave = 'vac'
+
+  def vac_to_air(self):
+    """
+    Changes vaccuum wavelengths to air wavelengths in place
+    """
+    if self._xu != u.AA:
+      raise u.UnitsError("x_units differ")
+    if self.wave == 'vac':
+      self.x = vac_to_air(self.x)
+      self.wave = 'air'
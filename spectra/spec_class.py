@@ -8,15 +8,37 @@ import astropy.units as u
 import astropy.constants as const
 from astropy.convolution import convolve
 from scipy.interpolate import interp1d, Akima1DInterpolator as Ak_i
-from scipy.optimize import minimize
 from .synphot import mag_calc_AB
 from .reddening import A_curve
+from .resample import Resampler, get_resampler
+from .units import parse_unit, convert_y
+from .grid import get_grid
+from .streaming import map_chunks
 from .misc import *
+from .misc import _resample_grid
 
 __all__ = [
   "Spectrum",
 ]
 
+def _defers(other):
+  """
+  Whether Spectrum arithmetic should defer to the other operand's reflected
+  method. This is true for types that opt out of numpy ufuncs by setting
+  __array_ufunc__ = None, e.g. SpectrumBatch.
+  """
+  return getattr(type(other), '__array_ufunc__', False) is None
+
+def _readonly(a):
+  """
+  Read-only view of an array. Spectrum arrays that are shared with another
+  object are stored like this, and are copied before being written to.
+  """
+  if a.flags.writeable:
+    a = a.view()
+    a.flags.writeable = False
+  return a
+
 class Spectrum(object): 
   """
   spectrum class contains wavelengths, fluxes, and flux errors.  Arithmetic
@@ -48,14 +70,29 @@ class Spectrum(object):
   both rows work as expected if 'a' is an int/float. However if 'a' is an
   ndarray or Quantity object, the second row (__radd__ etc) is overridden
   by undefined behaviour of numpy/astropy implementations.
+
+  .............................................................................
+  Slices (including clip and split) and arithmetic results share memory with
+  the spectra they came from, rather than copying. This is copy-on-write:
+  shared arrays are copied the first time they are accessed via S.x, S.y, or
+  S.e, or modified by a method, so changing one spectrum never changes
+  another. Arrays already handed out via S.x, S.y, or S.e stay the arrays
+  of S (so writing to them changes S), and are copied rather than shared
+  when a new spectrum is made from S.
+
+  Spectra with identical x values can share a WavelengthGrid (S.grid),
+  which makes comparing their x values O(1), and caches derived quantities
+  such as air/vac and unit conversions of the x values.
   """
-  __slots__ = ['_x', '_y', '_e', '_name', '_wave', '_xu', '_yu', '_head']
+  __slots__ = ['_x', '_y', '_e', '_name', '_wave', '_xu', '_yu', '_head', '_grid', '_exposed']
   def __init__(self, x, y, e, name="", wave='air', x_unit="AA", y_unit="erg/(s cm^2 AA)", head=None):
     """
     Initialise spectrum. Arbitrary header items can be added to self.head
     x must be an ndarray. y and e can either by int/floats or ndarrays of
     the same length.
     """
+    self._grid = None
+    self._exposed = None
     self.x = x
     self.y = y
     self.e = e
@@ -67,7 +104,7 @@ class Spectrum(object):
 
   @property
   def x(self):
-    return self._x
+    return self._expose('_x')
 
   @x.setter
   def x(self, x):
@@ -81,14 +118,14 @@ class Spectrum(object):
 
   @property
   def y(self):
-    return self._y
+    return self._expose('_y')
 
   @y.setter
   def y(self, y):
     if isinstance(y, (int, float)):
-      self._y = y*np.ones_like(self.x)
+      self._y = y*np.ones_like(self._x)
     elif isinstance(y, np.ndarray):
-      if(y.shape != self.x.shape):
+      if(y.shape != self._x.shape):
         raise ValueError("for ndarrays, y must be the same shape as x")
       self._y = y.astype(float)
     else:
@@ -96,16 +133,16 @@ class Spectrum(object):
 
   @property
   def e(self):
-    return self._e
+    return self._expose('_e')
   
   @e.setter
   def e(self, e):
     if isinstance(e, (int, float)):
       if e < 0:
         raise ValueError("Uncertainties cannot be negative")
-      self._e = e*np.ones_like(self.x) 
+      self._e = e*np.ones_like(self._x) 
     elif isinstance(e, np.ndarray):
-      if e.shape != self.x.shape:
+      if e.shape != self._x.shape:
         raise ValueError("for ndarrays, e must be the same shape as x")
       if np.any(e < 0):
         raise ValueError("Uncertainties cannot be negative")
@@ -142,7 +179,7 @@ class Spectrum(object):
   @x_unit.setter
   def x_unit(self, x_unit):
     if isinstance(x_unit, (str, u.UnitBase)):
-      self._xu = u.Unit(x_unit)
+      self._xu = parse_unit(x_unit)
     else:
       raise TypeError("x_unit must be str or Unit type")
 
@@ -153,7 +190,7 @@ class Spectrum(object):
   @y_unit.setter
   def y_unit(self, y_unit):
     if isinstance(y_unit, (str, u.UnitBase)):
-      self._yu = u.Unit(y_unit)
+      self._yu = parse_unit(y_unit)
     else:
       raise TypeError("y_unit must be str or Unit type")
 
@@ -171,12 +208,101 @@ class Spectrum(object):
       else:
         raise ValueError("head must be a dictionary")
 
+  @classmethod
+  def _fast(cls, x, y, e, name, wave, xu, yu, head, grid=None):
+    """
+    Trusted constructor for internal use, which skips validation and copying.
+    x, y, and e must be 1D float arrays of the same length (with e >= 0),
+    and xu/yu Unit objects. Arrays that are shared with another object must
+    be read-only (see _shared). If given, grid.x must be x.
+    """
+    S = object.__new__(cls)
+    S._x, S._y, S._e = x, y, e
+    S._name, S._wave, S._xu, S._yu, S._head = name, wave, xu, yu, head
+    S._grid = grid
+    S._exposed = None
+    return S
+
+  def _spawn(self, x, y, e, y_unit=None, grid=None):
+    """
+    Trusted constructor (see _fast) for a spectrum with the same info as self,
+    except optionally the y-unit. The grid of self is passed on if x is
+    the x array of self.
+    """
+    yu = self._yu if y_unit is None else y_unit
+    if grid is None and self._grid is not None and self._grid.x is x:
+      grid = self._grid
+    return self._fast(x, y, e, self._name, self._wave, self._xu, yu, self._head, grid)
+
+  @property
+  def grid(self):
+    """
+    The x values as a (shared, read-only) WavelengthGrid. This is created
+    on first access, and dropped if the x values of self are changed.
+    """
+    G = self._grid
+    if G is not None and G.x is self._x:
+      return G
+    if G is not None and self._is_exposed('_x') and np.array_equal(G.x, self._x):
+      return G
+    x = self._shared('_x')
+    G = self._grid = get_grid(x)
+    if x is self._x:
+      self._x = G.x
+    return G
+
+  def _is_exposed(self, attr):
+    """
+    Whether the current array attr has been handed out via its getter
+    """
+    return self._exposed is not None and self._exposed.get(attr) is getattr(self, attr)
+
+  def _expose(self, attr):
+    """
+    Returns the array attr (e.g. '_x') for the user, copying it first if it
+    is shared, and recording that it has been handed out.
+    """
+    self._own(attr)
+    a = getattr(self, attr)
+    if self._exposed is None:
+      self._exposed = {}
+    self._exposed[attr] = a
+    return a
+
+  def _shared(self, attr):
+    """
+    Returns the array attr (e.g. '_x') as a read-only array for a new owner.
+    It is marked as shared, so that both self and the new owner copy it
+    before writing, unless it has been handed out (and so may be written to
+    at any time), in which case a read-only copy is returned instead.
+    """
+    a = getattr(self, attr)
+    if not a.flags.writeable:
+      return a
+    if self._is_exposed(attr):
+      a = a.copy()
+      a.flags.writeable = False
+      return a
+    a = _readonly(a)
+    setattr(self, attr, a)
+    return a
+
+  def _own(self, *attrs):
+    """
+    Copy-on-write: copies any of the arrays attrs that are shared, so that
+    they can be modified in place.
+    """
+    for attr in attrs:
+      a = getattr(self, attr)
+      if not a.flags.writeable:
+        setattr(self, attr, a.copy())
+
   @property
   def var(self):
     """
     Variance attribute from flux errors
     """
-    return self.e**2
+    return self._e**2
 
   @var.setter
   def var(self, value):
@@ -198,7 +324,7 @@ class Spectrum(object):
     """
     Signal to noise ratio
     """
-    return np.abs(self.y/self.e)
+    return np.abs(self._y/self._e)
 
   @SN.setter
   def SN(self, value):
@@ -253,7 +379,7 @@ class Spectrum(object):
     """
     Return number of pixels in spectrum
     """
-    return len(self.x)
+    return len(self._x)
 
   def __repr__(self):
     """
@@ -272,11 +398,17 @@ class Spectrum(object):
 
   def __getitem__(self, key):
     """
-    Return self[key]
-    """
-    if isinstance(key, (int, slice, np.ndarray)):
-      data_key = self.x[key], self.y[key], self.e[key]
-      return data_key if isinstance(key, int) else Spectrum(*data_key, **self.info)
+    Return self[key]. Slices share memory with self (see class docstring).
+    """
+    if isinstance(key, int):
+      return self._x[key], self._y[key], self._e[key]
+    elif isinstance(key, slice):
+      x, y, e = (self._shared(attr)[key] for attr in ('_x', '_y', '_e'))
+      return self._spawn(x, y, e)
+    elif isinstance(key, np.ndarray):
+      if key.ndim != 1:
+        raise IndexError("spectra must be indexed with 1D arrays")
+      return self._spawn(self._x[key], self._y[key], self._e[key])
     else:
       raise TypeError("spectra must be indexed with int/slice/ndarray types")
 
@@ -290,7 +422,7 @@ class Spectrum(object):
     """
     Return whether value is in the x-range of self
     """
-    return self.x.min() < value < self.x.max()
+    return self._x.min() < value < self._x.max()
 
   def promote_to_spectrum(self, other, dimensionless_y=False):
     """
@@ -299,17 +431,21 @@ class Spectrum(object):
     arithmetic implementation, but also necessary for reverse arithmetic
     operations using ndarrays and quantities, e.g. 1 / Spectrum.
     """
-    info = self.info
     if isinstance(other, u.Quantity):
-      ynew = other.value
-      info['y_unit'] = other.unit
+      ynew, yu = other.value, other.unit
     elif isinstance(other, (int, float, np.ndarray)):
       ynew = other
-      if dimensionless_y:
-        info['y_unit'] = u.dimensionless_unscaled
+      yu = u.dimensionless_unscaled if dimensionless_y else self._yu
     else:
       raise NotImplementedError("Cannot cast object to Spectrum")
-    return Spectrum(self.x, ynew, 0, **info)
+
+    if isinstance(ynew, np.ndarray):
+      if ynew.shape != self._x.shape:
+        raise ValueError("for ndarrays, y must be the same shape as x")
+      ynew = ynew.astype(float)
+    else:
+      ynew = np.full(len(self), float(ynew))
+    return self._spawn(self._shared('_x'), ynew, np.zeros(len(self)), yu)
 
   def __add__(self, other):
     """
@@ -318,9 +454,11 @@ class Spectrum(object):
     if isinstance(other, Spectrum):
       self._compare_units(other, 'xy')
       self._compare_x(other)
-      ynew = self.y + other.y
-      enew = np.hypot(self.e, other.e)
-      return Spectrum(self.x, ynew, enew, **self.info)
+      ynew = self._y + other._y
+      enew = np.hypot(self._e, other._e)
+      return self._spawn(self._shared('_x'), ynew, enew)
+    elif _defers(other):
+      return NotImplemented
     else:
       Sother = self.promote_to_spectrum(other)
       return self + Sother
@@ -332,9 +470,11 @@ class Spectrum(object):
     if isinstance(other, Spectrum):
       self._compare_units(other, 'xy')
       self._compare_x(other)
-      ynew = self.y - other.y
-      enew = np.hypot(self.e, other.e)
-      return Spectrum(self.x, ynew, enew, **self.info)
+      ynew = self._y - other._y
+      enew = np.hypot(self._e, other._e)
+      return self._spawn(self._shared('_x'), ynew, enew)
+    elif _defers(other):
+      return NotImplemented
     else:
       Sother = self.promote_to_spectrum(other)
       return self - Sother
@@ -346,11 +486,11 @@ class Spectrum(object):
     if isinstance(other, Spectrum):
       self._compare_units(other, 'x')
       self._compare_x(other)
-      infonew = self.info
-      infonew['y_unit'] = self._yu * other._yu
-      ynew = self.y * other.y
-      enew = np.abs(ynew)*np.hypot(self.e/self.y, other.e/other.y)
-      return Spectrum(self.x, ynew, enew, **infonew)
+      ynew = self._y * other._y
+      enew = np.abs(ynew)*np.hypot(self._e/self._y, other._e/other._y)
+      return self._spawn(self._shared('_x'), ynew, enew, self._yu * other._yu)
+    elif _defers(other):
+      return NotImplemented
     else:
       Sother = self.promote_to_spectrum(other, True)
       return self * Sother
@@ -362,11 +502,11 @@ class Spectrum(object):
     if isinstance(other, Spectrum):
       self._compare_units(other, 'x')
       self._compare_x(other)
-      infonew = self.info
-      infonew['y_unit'] = self._yu / other._yu
-      ynew = self.y / other.y
-      enew = np.abs(ynew)*np.hypot(self.e/self.y, other.e/other.y)
-      return Spectrum(self.x, ynew, enew, **infonew)
+      ynew = self._y / other._y
+      enew = np.abs(ynew)*np.hypot(self._e/self._y, other._e/other._y)
+      return self._spawn(self._shared('_x'), ynew, enew, self._yu / other._yu)
+    elif _defers(other):
+      return NotImplemented
     else:
       Sother = self.promote_to_spectrum(other, True)
       return self / Sother
@@ -401,11 +541,9 @@ class Spectrum(object):
     Return S**other (with standard error propagation)
     """
     if isinstance(other, (int, float)):
-      infonew = self.info
-      infonew['y_unit'] = self._yu**other
-      ynew = self.y**other
-      enew = np.abs(other * ynew * self.e/self.y)
-      return Spectrum(self.x, ynew, enew, **infonew)
+      ynew = self._y**other
+      enew = np.abs(other * ynew * self._e/self._y)
+      return self._spawn(self._shared('_x'), ynew, enew, self._yu**other)
     else:
       raise TypeError("other must be int/float")
 
@@ -425,9 +563,96 @@ class Spectrum(object):
     """
     Implements abs(self)
     """
-    S = self.copy()
-    S.y = np.abs(S.y)
-    return S
+    return self._spawn(self._shared('_x'), np.abs(self._y), self._shared('_e'))
+
+  def _inplace_operand(self, other, xy):
+    """
+    Convert other (Spectrum/int/float/ndarray/Quantity) to flux and error
+    arrays for in-place arithmetic, plus a y-unit. The error is None for
+    non-Spectrum operands. xy gives the units to check for spectra ('xy' for
+    addition/subtraction, 'x' for multiplication/division).
+    """
+    if isinstance(other, Spectrum):
+      self._compare_units(other, xy)
+      self._compare_x(other)
+      return other._y, other._e, other._yu
+    elif isinstance(other, u.Quantity):
+      y, yu = other.value, other.unit
+    elif isinstance(other, (int, float, np.ndarray)):
+      y = other
+      yu = self._yu if xy == 'xy' else u.dimensionless_unscaled
+    else:
+      raise NotImplementedError("Cannot cast object to Spectrum")
+
+    if isinstance(y, np.ndarray) and y.shape != self._x.shape:
+      raise ValueError("for ndarrays, y must be the same shape as x")
+    if xy == 'xy' and yu != self._yu:
+      raise u.UnitsError("y_units differ")
+    return y, None, yu
+
+  def __iadd__(self, other):
+    """
+    Implements self += other, updating y and e in place
+    """
+    if _defers(other):
+      return NotImplemented
+    y2, e2, _ = self._inplace_operand(other, 'xy')
+    self._own('_y', '_e')
+    np.add(self._y, y2, out=self._y)
+    if e2 is not None:
+      np.hypot(self._e, e2, out=self._e)
+    return self
+
+  def __isub__(self, other):
+    """
+    Implements self -= other, updating y and e in place
+    """
+    if _defers(other):
+      return NotImplemented
+    y2, e2, _ = self._inplace_operand(other, 'xy')
+    self._own('_y', '_e')
+    np.subtract(self._y, y2, out=self._y)
+    if e2 is not None:
+      np.hypot(self._e, e2, out=self._e)
+    return self
+
+  def __imul__(self, other):
+    """
+    Implements self *= other, updating y and e in place. Errors are
+    propagated as e = hypot(e1*y2, e2*y1), which is finite where y1 == 0.
+    """
+    if _defers(other):
+      return NotImplemented
+    y2, e2, yu = self._inplace_operand(other, 'x')
+    self._own('_y', '_e')
+    if e2 is None:
+      np.multiply(self._e, np.abs(y2), out=self._e)
+    else:
+      tmp = np.multiply(e2, self._y)
+      np.multiply(self._e, y2, out=self._e)
+      np.hypot(self._e, tmp, out=self._e)
+    np.multiply(self._y, y2, out=self._y)
+    self._yu = self._yu * yu
+    return self
+
+  def __itruediv__(self, other):
+    """
+    Implements self /= other, updating y and e in place. Errors are
+    propagated as e = hypot(e1, e2*y1/y2)/|y2|, which is finite where y1 == 0.
+    """
+    if _defers(other):
+      return NotImplemented
+    y2, e2, yu = self._inplace_operand(other, 'x')
+    self._own('_y', '_e')
+    if e2 is not None:
+      tmp = np.multiply(e2, self._y)
+      np.divide(tmp, y2, out=tmp)
+      np.hypot(self._e, tmp, out=self._e)
+    np.divide(self._e, y2, out=self._e)
+    np.abs(self._e, out=self._e)
+    np.divide(self._y, y2, out=self._y)
+    self._yu = self._yu / yu
+    return self
 
   def _compare_units(self, other, xy):
     """
@@ -464,11 +689,32 @@ class Spectrum(object):
       raise TypeError("other was not Spectrum or interpretable as a unit")
 
   def _compare_x(self, other):
+    """
+    Check x values of another spectrum match. Spectra sharing x arrays are
+    compared by identity, and spectra that already have grids by content
+    hash, before falling back to np.allclose. No grids are created here.
+    """
     if self.wave != other.wave:
       raise ValueError("Spectra must have same wavelengths (air/vac)")
-    if not np.allclose(self.x, other.x):
+    if self._x is other._x:
+      return
+    if len(self._x) != len(other._x):
+      raise ValueError("Spectra must have same x values")
+    G1, G2 = self._grid, other._grid
+    if G1 is not None and G2 is not None and G1.x is self._x and G2.x is other._x and G1 == G2:
+      return
+    if not np.allclose(self._x, other._x):
       raise ValueError("Spectra must have same x values")
 
+  def lazy(self):
+    """
+    Returns a LazySpectrum, for which arithmetic is deferred and evaluated
+    in a single fused pass, e.g.
+    >>> S = ((S1.lazy() - S2) * k / M + C).compute()
+    """
+    from .lazy import LazySpectrum
+    return LazySpectrum(self)
+
   def apply_mask(self, mask):
     """
     Apply a mask to the spectral fluxes
@@ -485,22 +731,23 @@ class Spectrum(object):
     self.y = np.array(self.y)
     self.e = np.array(self.e)
 
-  def mag_calc_AB(self, filt, NMONTE=1000):
+  def mag_calc_AB(self, filt, NMONTE=1000, errors='mc'):
     """
     Calculates the AB magnitude of a filter called 'filt'. Errors
-    are calculated in Monte-Carlo fashion, and assume all fluxes
-    are statistically independent (not that realistic). See the
-    definition of 'mag_calc_AB' for valid filter names.
+    are calculated in Monte-Carlo fashion (or analytically with
+    errors='analytic'), and assume all fluxes are statistically
+    independent (not that realistic). See the definition of
+    'mag_calc_AB' for valid filter names.
     """
     S = self.copy()
     S.x_unit_to("AA")
     S.y_unit_to("erg/(s cm2 AA)")
 
-    if np.all(self.e == 0):
+    if np.all(self._e == 0):
       NMONTE = 0 
-    return mag_calc_AB(S, filt, NMONTE)
+    return mag_calc_AB(S, filt, NMONTE, errors=errors)
 
-  def interp(self, X, kind='cubic', **kwargs):
+  def interp(self, X, kind='cubic', chunk_size=None, cache=True, **kwargs):
     """
     Interpolates a spectrum onto the wavlength axis X, if X is a numpy array,
     or X.x if X is Spectrum type. This returns a new spectrum rather than
@@ -509,57 +756,98 @@ class Spectrum(object):
     >>> S1 = S1.interp(X)
 
     Wavelengths outside the range of the original spectrum are filled with
-    zeroes.
+    zeroes. kind="sinc" uses Lanczos interpolation (the kernel size, a,
+    may be given as a keyword argument). For 'linear', 'cubic' and 'sinc',
+    the interpolation operator is cached (see resample.get_resampler), so
+    repeat interpolations between the same grids are cheap. cache=False
+    builds it without caching, for one-off interpolations.
+
+    If chunk_size is given, the output is computed chunk_size pixels at a
+    time, from the (sorted) input pixels around each chunk, bounding the
+    memory used.
     """
     if isinstance(X, np.ndarray):
-      x2 = 1*X
+      x2 = X.astype(float)
     elif isinstance(X, Spectrum):
       self._compare_units(X, 'x')
       if self.wave != X.wave:
         raise ValueError("wavelengths differ between spectra")
-      x2 = 1*X.x
+      x2 = X.grid.x
     else:
       raise TypeError("interpolant was not ndarray/Spectrum type")
 
+    if chunk_size is not None and len(x2) > chunk_size:
+      return self._interp_chunked(x2, X, kind, chunk_size, **kwargs)
+
+    x, y, e = self._x, self._y, self._e
     if kind == "Akima":
-      y2 = Ak_i(self.x, self.y)(x2)
-      e2 = Ak_i(self.x, self.e)(x2)
+      y2 = Ak_i(x, y)(x2)
+      e2 = Ak_i(x, e)(x2)
       nan = np.isnan(y2) | np.isnan(e2)
       y2[nan] = 0.
       e2[nan] = 0.
-    elif kind == "sinc":
-      y2 = lanczos(self.x, self.y, x2)
-      e2 = lanczos(self.x, np.log(self.e+1E-300), x2)
-      extrap = (x2<self.x.min()) | (x2>self.x.max())
-      y2[extrap] = 0.
-      e2[extrap] = np.inf
+    elif kind == "sinc" or (kind in Resampler.kinds and not kwargs and len(self) >= 4):
+      #operator cached (unless cache=False) for repeat calls with the same grids
+      if cache:
+        G2 = X.grid if isinstance(X, Spectrum) else x2
+        R = get_resampler(self.grid, G2, kind, **kwargs)
+      else:
+        R = Resampler(x, x2, kind, **kwargs)
+      y2 = R(y, 0.)
+      e2 = R.errors(e, np.inf)
     else:
-      extrap_y, extrap_e = (self.y[0],self.y[-1]), (self.e[0],self.e[-1])
-      y2 = interp1d(self.x, self.y, kind=kind, \
+      y2 = interp1d(x, y, kind=kind, \
         bounds_error=False, fill_value=0., **kwargs)(x2)
-      e2 = interp1d(self.x, self.e, kind=kind, \
+      e2 = interp1d(x, e, kind=kind, \
         bounds_error=False, fill_value=np.inf, **kwargs)(x2)
 
     e2[e2 < 0] = 0.
-    return Spectrum(x2, y2, e2, **self.info)
+    return self._spawn(x2, y2, e2, grid=X._grid if isinstance(X, Spectrum) else None)
+
+  def _interp_chunked(self, x2, X, kind, chunk_size, pad=16, **kwargs):
+    """
+    interp onto x2, chunk_size output pixels at a time. Each chunk uses the
+    input pixels spanning it, plus pad pixels either side. Away from the
+    chunk edges, the interpolants are local (or for cubic splines, decay
+    quickly), so this matches the unchunked result. The operator for each
+    chunk is used once, so is not cached.
+    """
+    x = self._x
+    if not self.grid.is_sorted:
+      raise ValueError("x values must be sorted for chunked interpolation")
+    y2, e2 = np.empty(len(x2)), np.empty(len(x2))
+    for i0 in range(0, len(x2), chunk_size):
+      xc = x2[i0:i0+chunk_size]
+      j0 = max(np.searchsorted(x, xc.min()) - pad, 0)
+      j1 = min(np.searchsorted(x, xc.max()) + pad, len(x))
+      j0, j1 = max(0, min(j0, len(x)-2*pad)), min(len(x), max(j1, 2*pad))
+      Sc = self[j0:j1].interp(xc, kind, cache=False, **kwargs)
+      y2[i0:i0+chunk_size] = Sc._y
+      e2[i0:i0+chunk_size] = Sc._e
+    return self._spawn(x2, y2, e2, grid=X._grid if isinstance(X, Spectrum) else None)
 
   def copy(self):
     """
     Returns a copy of self
     """
-    return Spectrum(*self.data, **self.info)
+    return self._spawn(self._x.copy(), self._y.copy(), self._e.copy())
 
   def sect(self, x0, x1):
     """
     Returns a truth array for wavelengths between x0 and x1.
     """
-    return (self.x>x0) & (self.x<x1)
+    return (self._x>x0) & (self._x<x1)
 
   def clip(self, x0, x1): 
     """
-    Returns Spectrum clipped between x0 and x1.
+    Returns Spectrum clipped between x0 and x1. If the selected pixels are
+    contiguous, the result shares memory with self (see class docstring).
     """
-    return self[self.sect(x0, x1)]
+    mask = self.sect(x0, x1)
+    idx = np.flatnonzero(mask)
+    if len(idx) and idx[-1]-idx[0]+1 == len(idx):
+      return self[idx[0]:idx[-1]+1]
+    return self[mask]
 
   def norm_percentile(self, pc):
     """
@@ -567,26 +855,32 @@ class Spectrum(object):
     
     E.g. S.norm_percentile(99)
     """
-    norm = np.percentile(self.y, pc)
-    self.y /= norm
-    self.e /= norm
+    norm = np.percentile(self._y, pc)
+    self._own('_y', '_e')
+    self._y /= norm
+    self._e /= norm
 
   def write(self, fname, errors=True):
     """
-    Saves Spectrum to a text file.
+    Saves Spectrum to a text file (.txt/.dat, optionally .gz compressed)
+    or .npy file. fname may also be an open file, which is written to as
+    text.
     """
-    if fname.endswith((".txt", ".dat")):
-      #C style formatting faster here than .format or f-strings
-      with open(fname, 'w') as F:
-        if errors:
-          for px in self: F.write("%9.3f %12.5E %11.5E\n" %px)
-        else:
-          for px in self: F.write("%9.3f %12.5E\n" %px[:2])
+    if not isinstance(fname, str) or fname.endswith((".txt", ".dat", ".txt.gz", ".dat.gz")):
+      if errors:
+        write_columns(fname, (self._x, self._y, self._e), "%9.3f %12.5E %11.5E\n")
+      else:
+        write_columns(fname, (self._x, self._y), "%9.3f %12.5E\n")
     elif fname.endswith(".npy"):
-      data = [*self.data] if errors else [self.x, self.y]
-      np.save(fname, np.array(data))
+      #write rows directly, rather than stacking into a new array first
+      data = [self._x, self._y, self._e] if errors else [self._x, self._y]
+      out = np.lib.format.open_memmap(fname, 'w+', float, (len(data), len(self)))
+      for row, arr in zip(out, data):
+        row[:] = arr
+      out.flush()
+      del out
     else:
-      raise ValueError("file name must be of type .txt/.dat/.npy")
+      raise ValueError("file name must be of type .txt/.dat(.gz)/.npy")
 
   def air_to_vac(self):
     """
@@ -594,7 +888,8 @@ class Spectrum(object):
     """
     self._compare_units("AA", 'x')
     if self.wave == 'air':
-      self.x = air_to_vac(self.x) 
+      self._grid = self.grid.air_to_vac()
+      self._x = self._grid.x
       self.wave = 'vac'
 
   def vac_to_air(self):
@@ -603,33 +898,50 @@ class Spectrum(object):
     """
     self._compare_units("AA", 'x')
     if self.wave == 'vac':
-      self.x = vac_to_air(self.x) 
+      self._grid = self.grid.vac_to_air()
+      self._x = self._grid.x
       self.wave = 'air'
 
-  def redden(self, E_BV, Rv=3.1):
+  def _A_curve(self, Rv, model):
     """
-    Apply the CCM reddening curve to the spectrum given an E_BV
-    and a value of Rv (default=3.1).
+    Extinction curve A(x)/A(V) on the x values of self. Both the conversion
+    to vacuum wavenumbers, and the curve itself, are cached per grid.
     """
-    S = self.copy()
-    if S.wave == "air":
-      S.x_unit_to("AA")
-      S.air_to_vac()
-    S.x_unit_to("1/um")
+    G = self.grid.to(self._xu, u.AA)
+    if self.wave == "air":
+      G = G.air_to_vac()
+    return A_curve(G.to(u.AA, "1/um"), Rv, model)
 
-    A = Rv * E_BV * A_curve(S.x, Rv)
+  def redden(self, E_BV, Rv=3.1, model='CCM89'):
+    """
+    Apply a reddening curve (default CCM89, see reddening.extinction_models)
+    to the spectrum given an E_BV and a value of Rv (default=3.1).
+    """
+    A = Rv * E_BV * self._A_curve(Rv, model)
     extinction = 10**(-0.4*A)
-    self.y *= extinction
-    self.e *= extinction
+    self._own('_y', '_e')
+    self._y *= extinction
+    self._e *= extinction
+
+  def redden_batch(self, E_BV, Rv=3.1, model='CCM89'):
+    """
+    Returns a SpectrumBatch of copies of self reddened by each of the values
+    in the array E_BV, computed in a single broadcast.
+    """
+    from .spec_batch import SpectrumBatch
+    E_BV = np.asarray(E_BV, dtype=float).reshape(-1, 1)
+    extinction = np.exp((-0.4*np.log(10)*Rv) * E_BV * self._A_curve(Rv, model))
+    Y, E = self._y * extinction, self._e * extinction
+    names = [f"{self.name} E(B-V)={E:g}".lstrip() for E in E_BV.ravel()]
+    return SpectrumBatch(self._x, Y, E, names, self.wave, self.x_unit, self.y_unit, self.head)
 
   def x_unit_to(self, new_unit):
     """
     Changes units of the x-data. Supports conversion between wavelength
     and energy etc. Argument should be a string or Unit.
     """
-    x = self.x * self._xu
-    x2 = x.to(new_unit, u.spectral())
-    self.x = x2.value
+    self._grid = self.grid.to(self._xu, new_unit)
+    self._x = self._grid.x
     self.x_unit = new_unit
     
   def y_unit_to(self, new_unit):
@@ -637,13 +949,7 @@ class Spectrum(object):
     Changes units of the y-data. Supports conversion between Fnu
     and Flambda etc. Argument should be a string or Unit.
     """
-    x = self.x * self._xu
-    y = self.y * self._yu
-    e = self.e * self._yu
-    y = y.to(new_unit, u.spectral_density(x))
-    e = e.to(new_unit, u.spectral_density(x))
-    self.y = y.value
-    self.e = e.value
+    self._y, self._e = convert_y(self._x, self._xu, self._yu, new_unit, self._y, self._e)
     self.y_unit = new_unit
     
   def apply_redshift(self, v, v_unit="km/s"):
@@ -657,11 +963,9 @@ class Spectrum(object):
     beta = beta.decompose().value
     factor = math.sqrt((1+beta)/(1-beta))
     if self.wave == "air":
-      self.x = air_to_vac(self.x) 
-      self.x *= factor
-      self.x = vac_to_air(self.x) 
+      self._x = vac_to_air(air_to_vac(self._x) * factor)
     else:
-      self.x *= factor
+      self._x = self._x * factor
 
   def scale_model(self, other, return_scaling_factor=False):
     """
@@ -678,7 +982,7 @@ class Spectrum(object):
     self._compare_units(other, 'xy')
 
     #if M and S already have same x-axis, this won't do much.
-    S = other[other.e>0]
+    S = other[other._e>0]
     M = self.interp(S)
 
     A = np.sum(S.y*M.y*S.ivar)/np.sum(M.y**2*S.ivar)
@@ -704,24 +1008,20 @@ class Spectrum(object):
 
   def scale_spectrum_to_spectrum(self, other, return_scaling_factor=False):
     """
-    Scales self to best fit other in their mutually overlapping region.
+    Scales self to best fit other in their mutually overlapping region,
+    accounting for the errors of both (see misc.fit_scale).
     """
     if not isinstance(other, Spectrum):
       raise TypeError
     self._compare_units(other, 'xy')
 
-    x0 = max(S.x.min() for S in (self, other))
-    x1 = min(S.x.max() for S in (self, other))
+    x0 = max(S._x.min() for S in (self, other))
+    x1 = min(S._x.max() for S in (self, other))
     Soc = other.clip(x0, x1)
     Ssi = self.interp(Soc, kind='cubic')
 
-    def chi2(A, S1, S2):
-      top = (S1.y - A*S2.y)**2
-      bot = (S1.e**2 + (A*S2.e)**2)
-      return np.sum(top / bot)
-
-    res = minimize(chi2, (1.0), args=(Soc, Ssi))  
-    A = float(res['x'][0])
+    A, _ = fit_scale(Soc._y, Soc._e, Ssi._y, Ssi._e)
+    A = float(A)
 
     return (self*A, A) if return_scaling_factor else self*A
 
@@ -729,27 +1029,71 @@ class Spectrum(object):
     mag0 = self.mag_calc_AB(filt, NMONTE=0)
     return self * 10**(0.4*(mag0-mag))
     
-  def convolve_gaussian(self, fwhm):
+  def convolve_gaussian(self, fwhm, chunk_size=None):
+    """
+    Convolve with a Gaussian of width fwhm (in units of x). If chunk_size is
+    given, the spectrum is processed in overlapping chunks of chunk_size
+    pixels to bound memory (see streaming.map_chunks).
+    """
+    if chunk_size is not None:
+      #chunks of non-uniform spectra share the resampling grid of the whole
+      grid = _resample_grid(self._x)
+      fun = lambda S: S._convolve_gaussian(fwhm, grid)
+      return map_chunks(self, fun, chunk_size, 3*fwhm)
+    return self._convolve_gaussian(fwhm)
+
+  def _convolve_gaussian(self, fwhm, grid=None):
     S = self.copy()
-    S.y = convolve_gaussian(S.x, S.y, fwhm)
+    S.y = convolve_gaussian(S.x, S.y, fwhm, grid=grid)
     return S
 
-  def convolve_gaussian_R(self, res):
+  def convolve_gaussian_R(self, res, chunk_size=None):
+    """
+    Convolve with a Gaussian to a resolution res. If chunk_size is given,
+    the spectrum is processed in overlapping chunks of chunk_size pixels to
+    bound memory (see streaming.map_chunks).
+    """
+    if chunk_size is not None:
+      grid = _resample_grid(np.log(self._x))
+      fun = lambda S: S._convolve_gaussian_R(res, grid)
+      return map_chunks(self, fun, chunk_size, 3/res, logx=True)
+    return self._convolve_gaussian_R(res)
+
+  def _convolve_gaussian_R(self, res, grid=None):
     S = self.copy()
-    S.y = convolve_gaussian_R(S.x, S.y, res)
+    S.y = convolve_gaussian_R(S.x, S.y, res, grid=grid)
     return S
 
-  def rot_broaden(self, vsini, dv=1.0):
+  def rot_broaden(self, vsini, dv=1.0, chunk_size=None):
     """
     Apply rotational broadening in km/s. The dv parameter sets the resolution
-    that convolution is performed at.
+    that convolution is performed at. If chunk_size is given, the spectrum is
+    processed in overlapping chunks of chunk_size pixels, which bounds the
+    size of the oversampled arrays (see streaming.map_chunks).
+    """
+    if chunk_size is not None:
+      #chunks share the log(x) grid of the whole spectrum
+      logx0 = np.log(self.grid.to(self._xu, u.AA).x[0])
+      overlap = (2*vsini + 100*dv)/3e5
+      fun = lambda S: S._rot_broaden(vsini, dv, logx0)
+      return map_chunks(self, fun, chunk_size, overlap, logx=True)
+    return self._rot_broaden(vsini, dv)
+
+  def _rot_broaden(self, vsini, dv, logx0=None):
+    """
+    rot_broaden, convolving on the points of the uniform log(x) grid
+    starting at logx0 (by default log(x[0]) in AA) that lie within self.
     """
     xu, yu = self.x_unit, self.y_unit
     S = self.copy()
     S.x_unit_to(u.AA)
     S.y_unit_to("erg/(s cm2)")
     logx = np.log(S.x)
-    logx = np.arange(logx[0], logx[-1], dv/3e5)
+    step = dv/3e5
+    if logx0 is None:
+      logx0 = logx[0]
+    k0 = max(0, int(np.ceil((logx[0]-logx0)/step)))
+    logx = logx0 + step*np.arange(k0, int(np.ceil((logx[-1]-logx0)/step)))
     xnew = np.exp(logx) #0.1km/s resolution
     S = S.interp(xnew, kind='cubic')
     kxR = np.arange(0, vsini, dv)
@@ -766,9 +1110,9 @@ class Spectrum(object):
     """
     Fits a polynomial to a spectrum object.
     """
-    x = np.log(self.x) if logx else self.x
-    y = np.log(np.abs(self.y)) if logy else self.y
-    e = np.abs(self.e/self.y) if logy else self.e
+    x = np.log(self._x) if logx else self._x
+    y = np.log(np.abs(self._y)) if logy else self._y
+    e = np.abs(self._e/self._y) if logy else self._e
     poly = np.polyfit(x, y, deg, w=1/e) if weighted else np.polyfit(x, y, deg)
     return poly, logx, logy, self.y_unit
 
@@ -778,12 +1122,10 @@ class Spectrum(object):
     polyres should be: poly, logx, logy, y_unit
     """
     poly, logx, logy, y_unit = polyres
-    x = np.log(self.x) if logx else self.x
+    x = np.log(self._x) if logx else self._x
     y = np.polyval(poly, x)
     y = np.exp(y) if logy else y
-    infonew = self.info
-    infonew['y_unit'] = y_unit
-    return Spectrum(self.x, y, 0, **infonew)
+    return self._spawn(self._shared('_x'), y, np.zeros(len(self)), parse_unit(y_unit))
 
   def split(self, W):
     """
@@ -817,19 +1159,19 @@ class Spectrum(object):
     """
     Returns the pixel index closest in wavelength to x0
     """
-    return np.argmin(np.abs(self.x-x0))
+    return np.argmin(np.abs(self._x-x0))
 
   def isnan(self):
     """
     Returns truth-array showing pixels with nans (either x, y, or e)
     """
-    return np.isnan(self.x) | np.isnan(self.y) | np.isnan(self.e)
+    return np.isnan(self._x) | np.isnan(self._y) | np.isnan(self._e)
 
   def isinf(self):
     """
     Returns truth-array showing pixels with infs (either x, y, or e)
     """
-    return np.isinf(self.x) | np.isinf(self.y) | np.isinf(self.e)
+    return np.isinf(self._x) | np.isinf(self._y) | np.isinf(self._e)
 
   def plot(self, *args, kind='y', **kwargs):
     """
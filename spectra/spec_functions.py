@@ -2,14 +2,24 @@
 Contains functions for generating spectra or operating on spectra
 """
 import numpy as np
+import itertools
+import heapq
+import astropy.units as u
 from scipy.optimize import leastsq
 from .spec_class import Spectrum
-from .misc import black_body
+from .spec_batch import SpectrumBatch
+from .grid import get_grid
+from .misc import black_body, fit_scale
 
 __all__ = [
   "Black_body",
   "join_spectra",
+  "stitch_orders",
   "spectra_mean",
+  "SpectrumAccumulator",
+  "spectra_mean_online",
+  "scale_spectra_to_spectrum",
+  "sky_lines_fwhm",
 ]
 
 def Black_body(x, T, wave='air', x_unit="AA", y_unit="erg/(s cm2 AA)", norm=True):
@@ -56,6 +66,92 @@ def join_spectra(SS, sort=False, name=None):
 
   return S
 
+def stitch_orders(SS, kind='linear', name=None):
+  """
+  Stitches echelle orders (or any overlapping spectra) into one spectrum,
+  sorted by wavelength. Where only one order covers a region, its pixels
+  are used directly. Where orders overlap, they are interpolated (with kind)
+  onto the pixels of the order best sampling that region, and combined by
+  inverse variance weighting (pixels with zero or infinite errors get no
+  weight, unless no order has a usable error). Orders too short for kind
+  are interpolated linearly. Orders are swept in order of their start
+  wavelengths, keeping a set of the orders covering the current region, so
+  the work is linear in the total number of pixels for a fixed number of
+  orders overlapping at any one wavelength.
+  The name of the first spectrum is used unless name is given.
+  """
+  S0 = SS[0]
+  for S in SS:
+    if not isinstance(S, Spectrum):
+      raise TypeError('item is not Spectrum')
+    if S.wave != S0.wave:
+      raise ValueError("Spectra must have same wavelengths")
+    S._compare_units(S0, xy='xy')
+
+  orders = [S if S.grid.is_sorted else S[np.argsort(S._x, kind='stable')] for S in SS if len(S)]
+  orders.sort(key=lambda S: S._x[0])
+  start = np.array([S._x[0] for S in orders])
+  end = np.array([np.nextafter(S._x[-1], np.inf) for S in orders])
+  bounds = np.unique(np.concatenate([start, end]))
+
+  #orders enter the active set at their start, and leave it (via a heap
+  #keyed by their end) once the sweep passes their end
+  xs, ys, es = [], [], []
+  nxt, ends, live = 0, [], set()
+  for b0, b1 in zip(bounds[:-1], bounds[1:]):
+    while nxt < len(orders) and start[nxt] <= b0:
+      heapq.heappush(ends, (end[nxt], nxt))
+      live.add(nxt)
+      nxt += 1
+    while ends and ends[0][0] <= b0:
+      live.discard(heapq.heappop(ends)[1])
+    if not live:
+      continue
+    active = sorted(live)
+    pieces = []
+    for k in active:
+      x = orders[k]._x
+      pieces.append((k, np.searchsorted(x, b0), np.searchsorted(x, b1)))
+    k, i0, i1 = max(pieces, key=lambda p: p[2]-p[1])
+    if i1 == i0:
+      continue
+    if len(active) == 1:
+      S = orders[k]
+      xs.append(S._x[i0:i1])
+      ys.append(S._y[i0:i1])
+      es.append(S._e[i0:i1])
+      continue
+
+    #resample the other overlapping orders onto the best sampled one
+    xg = orders[k]._x[i0:i1]
+    Y, E = [orders[k]._y[i0:i1]], [orders[k]._e[i0:i1]]
+    for k2, j0, j1 in pieces:
+      if k2 == k:
+        continue
+      #pad the slice, to at least the 4 pixels needed by cubic interpolation
+      S = orders[k2]
+      if len(S) < 2:
+        continue
+      j0, j1 = max(j0-2, 0), min(j1+2, len(S))
+      j0 = max(min(j0, j1-4), 0)
+      j1 = min(max(j1, j0+4), len(S))
+      Si = S[j0:j1].interp(xg, kind if j1-j0 >= 4 else 'linear')
+      Y.append(Si._y)
+      E.append(Si._e)
+    Y, E = np.array(Y), np.array(E)
+    W = np.zeros_like(E)
+    np.divide(1, E**2, out=W, where=(E > 0) & np.isfinite(E))
+    Wsum = np.sum(W, axis=0)
+    ok = Wsum > 0
+    xs.append(xg)
+    ys.append(np.where(ok, np.sum(W*Y, axis=0) / np.where(ok, Wsum, 1), Y[0]))
+    es.append(np.where(ok, 1 / np.sqrt(np.where(ok, Wsum, 1)), E[0]))
+
+  S = Spectrum(np.concatenate(xs), np.concatenate(ys), np.concatenate(es), **S0.info)
+  if name is not None:
+    S.name = name
+  return S
+
 def spectra_mean(SS):
   """
   Calculate the weighted mean spectrum of a list/tuple of spectra.
@@ -77,6 +173,274 @@ def spectra_mean(SS):
 
   return Spectrum(S0.x, Ybar, Ebar, **S0.info)
 
+class SpectrumAccumulator(object):
+  """
+  Running inverse variance weighted mean of spectra, resampled onto a fixed
+  target grid as they are added, so that memory use is independent of the
+  number of spectra.
+
+  Example:
+  >>> acc = SpectrumAccumulator(S0)
+  >>> for S in spec_iter_from_molly("data.mol"):
+  >>>   acc.add(S)
+  >>> Smean = acc.spectrum()
+
+  .............................................................................
+  The target x may be a Spectrum (whose units and wave are then required of
+  all added spectra), or an array/WavelengthGrid, in which case they are
+  taken from the first spectrum added. Target pixels outside an added
+  spectrum, or where its errors are zero/infinite, receive no weight from it.
+
+  Outliers can be rejected with clip (in sigma). If ref (an array on the
+  target grid, e.g. the mean from a previous pass) is given to add, pixels
+  are compared to it. Otherwise, the first min_count values at each pixel
+  are buffered, then compared to their median, and later values to the
+  running mean of the accepted values (or, if none were accepted, the next
+  value is accepted unclipped).
+  """
+  def __init__(self, x, kind='linear', clip=None, min_count=5):
+    if isinstance(x, Spectrum):
+      self.grid = x.grid
+      self.info = x.info
+      self._S0 = x
+    else:
+      self.grid = get_grid(x)
+      self.info = None
+      self._S0 = None
+    self.kind = kind
+    self.clip = clip
+    self.min_count = min_count
+    self.reset()
+
+  def reset(self):
+    """
+    Discard all accumulated spectra
+    """
+    N = len(self.grid)
+    self.N = 0
+    self.nclipped = np.zeros(N, dtype=int)
+    self._syw = np.zeros(N)
+    self._sw = np.zeros(N)
+    self._nbuf = np.zeros(N, dtype=int)
+    self._ybuf = None
+    self._wbuf = None
+
+  def __len__(self):
+    return self.N
+
+  def __repr__(self):
+    return f"SpectrumAccumulator of {self.N} spectra on {len(self.grid)} pixels"
+
+  def _resample(self, S):
+    """
+    Values and weights (inverse variances) of S on the target grid
+    """
+    if not isinstance(S, Spectrum):
+      raise TypeError('item is not Spectrum')
+    if self._S0 is None:
+      N = len(self.grid)
+      self.info = S.info
+      self._S0 = Spectrum._fast(self.grid.x, np.zeros(N), np.zeros(N), \
+        S.name, S.wave, S._xu, S._yu, {}, self.grid)
+    S._compare_units(self._S0, xy='xy')
+    if S.wave != self._S0.wave:
+      raise ValueError("wavelengths differ between spectra")
+
+    if S.grid is self.grid:
+      y, e = S._y, S._e
+    else:
+      Si = S.interp(self._S0, self.kind, cache=False)
+      y, e = Si._y, Si._e
+    w = np.zeros(len(y))
+    np.divide(1, e**2, out=w, where=(e > 0) & np.isfinite(e))
+    return y, w
+
+  def _accept(self, y, w, ref, idx=slice(None)):
+    """
+    Add values/weights at pixels idx to the sums, rejecting those more than
+    clip sigma from ref. Pixels where ref is nan are not clipped. Returns the
+    number rejected.
+    """
+    ref = np.broadcast_to(ref, np.shape(y))
+    bad = (w > 0) & ~np.isnan(ref)
+    bad[bad] = np.abs(y[bad]-ref[bad])*np.sqrt(w[bad]) > self.clip
+    w = np.where(bad, 0., w)
+    self.nclipped[idx] += bad
+    self._syw[idx] += w*y
+    self._sw[idx] += w
+    return int(bad.sum())
+
+  def add(self, S, ref=None):
+    """
+    Resample the Spectrum S onto the target grid and add it to the sums.
+    Returns the number of pixels rejected by clipping.
+    """
+    y, w = self._resample(S)
+    self.N += 1
+    if self.clip is None:
+      self._syw += w*y
+      self._sw += w
+      return 0
+    if ref is not None:
+      return self._accept(y, w, ref)
+
+    if self._ybuf is None:
+      self._ybuf = np.zeros((self.min_count, len(y)))
+      self._wbuf = np.zeros((self.min_count, len(y)))
+    good = w > 0
+    full = self._nbuf >= self.min_count
+    nclip = 0
+
+    #pixels past their buffer are compared to the running mean, unless
+    #every value so far was clipped
+    idx = np.flatnonzero(good & full)
+    if len(idx):
+      sw = self._sw[idx]
+      mean = np.divide(self._syw[idx], sw, out=np.full(len(idx), np.nan), where=sw > 0)
+      nclip += self._accept(y[idx], w[idx], mean, idx)
+
+    #otherwise buffer, then flush against the median once full
+    idx = np.flatnonzero(good & ~full)
+    if len(idx):
+      slot = self._nbuf[idx]
+      self._ybuf[slot, idx] = y[idx]
+      self._wbuf[slot, idx] = w[idx]
+      self._nbuf[idx] += 1
+      idx = idx[self._nbuf[idx] == self.min_count]
+      if len(idx):
+        yb, wb = self._ybuf[:, idx], self._wbuf[:, idx]
+        med = np.median(yb, axis=0)
+        for k in range(self.min_count):
+          nclip += self._accept(yb[k], wb[k], med, idx)
+    return nclip
+
+  def _sums(self):
+    """
+    Sums of w*y and w, including values still buffered (unclipped)
+    """
+    syw, sw = self._syw, self._sw
+    if self._ybuf is not None:
+      part = self._nbuf < self.min_count
+      syw = syw + np.where(part, np.sum(self._ybuf*self._wbuf, axis=0), 0.)
+      sw = sw + np.where(part, np.sum(self._wbuf, axis=0), 0.)
+    return syw, sw
+
+  @property
+  def mean(self):
+    """
+    Current mean flux on the target grid (zero where nothing was added)
+    """
+    syw, sw = self._sums()
+    return np.divide(syw, sw, out=np.zeros_like(syw), where=sw > 0)
+
+  @property
+  def error(self):
+    """
+    Current error of the mean on the target grid (inf where nothing was added)
+    """
+    _, sw = self._sums()
+    return np.divide(1, np.sqrt(sw), out=np.full_like(sw, np.inf), where=sw > 0)
+
+  def spectrum(self, name=None):
+    """
+    The mean spectrum, as a Spectrum on the target grid
+    """
+    if self.info is None:
+      raise ValueError("no spectra have been added")
+    S = Spectrum(self.grid.x, self.mean, self.error, **self.info)
+    if name is not None:
+      S.name = name
+    return S
+#
+
+def spectra_mean_online(SS, x=None, kind='linear', clip=None, niter=5, min_count=5):
+  """
+  Weighted mean spectrum like spectra_mean, but accumulated one spectrum at
+  a time (see SpectrumAccumulator), so that SS can be a generator, and the
+  spectra need not share x values: each is resampled (with kind) onto x
+  (a Spectrum, array or WavelengthGrid), which defaults to the x values of
+  the first spectrum.
+
+  clip sets a sigma-clipping threshold. A one-shot iterator (e.g. a
+  generator) is read once, clipping against running statistics (see
+  SpectrumAccumulator). If SS is a list/tuple (or any re-iterable
+  collection), or a callable returning a new iterable of the spectra each
+  time, further passes reject pixels more than clip sigma from the previous
+  pass's mean, for up to niter passes or until the rejections stop changing.
+  """
+  if callable(SS):
+    get_spectra = SS
+  elif iter(SS) is not SS:
+    get_spectra = lambda: SS
+  else:
+    get_spectra = None
+  spectra = iter(SS if get_spectra is None else get_spectra())
+
+  if x is None:
+    try:
+      S0 = next(spectra)
+    except StopIteration:
+      raise ValueError("no spectra to average")
+    if not isinstance(S0, Spectrum):
+      raise TypeError('item is not Spectrum')
+    x = S0.grid
+    spectra = itertools.chain([S0], spectra)
+
+  acc = SpectrumAccumulator(x, kind, clip, min_count)
+  for S in spectra:
+    acc.add(S)
+  if acc.N == 0:
+    raise ValueError("no spectra to average")
+  if clip is None or get_spectra is None:
+    return acc.spectrum()
+
+  nclipped = acc.nclipped
+  for _ in range(niter-1):
+    ref = acc.mean
+    acc.reset()
+    for S in get_spectra():
+      acc.add(S, ref)
+    if np.array_equal(acc.nclipped, nclipped):
+      break
+    nclipped = acc.nclipped
+  return acc.spectrum()
+
+def scale_spectra_to_spectrum(SS, S0, kind='cubic'):
+  """
+  Finds the scale factors that best fit each of the spectra in SS (a list of
+  spectra, or a SpectrumBatch) to the reference spectrum S0, in their
+  mutually overlapping regions, accounting for the errors of both, i.e. the
+  batched equivalent of Spectrum.scale_spectrum_to_spectrum. The spectra are
+  interpolated onto the x values of S0, and all factors solved for at once.
+  Returns arrays of the scale factors and their uncertainties.
+  """
+  if isinstance(SS, SpectrumBatch):
+    if SS.y_unit != S0.y_unit:
+      raise u.UnitsError("y_units differ")
+    B = SS.interp(S0, kind)
+    x1 = np.full(len(SS), SS.x.min())
+    x2 = np.full(len(SS), SS.x.max())
+    Y, E = B.y, B.e
+  else:
+    for S in SS:
+      if not isinstance(S, Spectrum):
+        raise TypeError('item is not Spectrum')
+      S._compare_units(S0, 'xy')
+    Y, E = map(np.array, zip(*((Si._y, Si._e) for Si in (S.interp(S0, kind) for S in SS))))
+    x1 = np.array([S._x.min() for S in SS])
+    x2 = np.array([S._x.max() for S in SS])
+
+  #pixels outside the overlap with S0 have zero weight (as Spectrum.clip)
+  x = S0._x
+  x1 = np.maximum(x1, x.min())
+  x2 = np.minimum(x2, x.max())
+  inside = (x > x1[:,None]) & (x < x2[:,None])
+  Y0 = np.where(inside, S0._y, 0.)
+  E0 = np.where(inside, S0._e, 0.)
+  Y = np.where(inside, Y, 0.)
+  E = np.where(inside, E, 0.)
+  return fit_scale(Y0, E0, Y, E)
+
 def sky_line_fwhm(S, x0, dx=5.):
   """
   Given a sky spectrum, this fits a Gaussian to a
@@ -96,3 +460,107 @@ def sky_line_fwhm(S, x0, dx=5.):
   return vec[0], vec[2]+vec[3], (vec[1], err[1])
 #
 
+def sky_lines_fwhm(S, x0, dx=5., niter=100, tol=1e-8, deg=None):
+  """
+  Given a sky spectrum, fits Gaussians to the sky lines near each of the
+  wavelengths x0 at once, i.e. the batched equivalent of sky_line_fwhm.
+  The pixels within dx of each line are gathered into a padded
+  (Nlines, window) array, and all lines are fitted simultaneously by
+  Levenberg-Marquardt with analytic derivatives, until the chi2 of every
+  line changes by less than tol (relative), or niter iterations.
+
+  Returns arrays of the fitted line centres, FWHMs and FWHM errors (nan for
+  lines with fewer than 4 usable pixels, or whose fit is singular). If deg is given, a polynomial of
+  that degree is also fitted to the resolution, R = x/FWHM, as a function
+  of wavelength, and returned as an np.poly1d.
+  """
+  x0 = np.atleast_1d(np.asarray(x0, dtype=float))
+  if not S.grid.is_sorted:
+    S = S[np.argsort(S._x, kind='stable')]
+  x, y, e = S._x, S._y, S._e
+
+  #padded windows, masking pixels beyond each window or with no error
+  i0 = np.searchsorted(x, x0-dx, 'right')
+  i1 = np.searchsorted(x, x0+dx, 'left')
+  n = i1 - i0
+  W = max(int(n.max()), 1)
+  idx = np.minimum(i0[:,None] + np.arange(W), len(x)-1)
+  X, Y, E = x[idx], y[idx], e[idx]
+  mask = (np.arange(W) < n[:,None]) & (E > 0)
+  iE = np.zeros_like(E)
+  np.divide(1, E, out=iE, where=mask)
+  ok = mask.sum(axis=1) >= 4
+
+  def model(p):
+    xc, fwhm, A, C = (p[:,i,None] for i in range(4))
+    xw = fwhm / 2.355
+    z = (X-xc) / xw
+    g = np.exp(-0.5*z**2)
+    return A*g + C, xw, z, g
+
+  def chi2(p):
+    return np.sum(((Y - model(p)[0])*iE)**2, axis=1)
+
+  def jacobian(p):
+    f, xw, z, g = model(p)
+    A = p[:,2,None]
+    J = np.stack([A*g*z/xw, A*g*z**2/(2.355*xw), g, np.ones_like(g)], axis=1)
+    return J * iE[:,None,:], (Y - f) * iE
+
+  #initial guesses, as in sky_line_fwhm
+  last = X[np.arange(len(x0)), np.maximum(n-1, 0)]
+  dxmean = np.where(n > 1, (last - X[:,0]) / np.maximum(n-1, 1), 1.)
+  Ymask = np.where(mask & ok[:,None], Y, np.nan)
+  Ymask[~ok] = 0.
+  p = np.column_stack([x0, 2*dxmean, np.nanmax(Ymask, axis=1), np.nanmin(Ymask, axis=1)])
+
+  lam = np.full(len(x0), 1e-3)
+  c2 = chi2(p)
+  active = ok.copy()
+  for _ in range(niter):
+    if not np.any(active):
+      break
+    J, r = jacobian(p)
+    H = np.einsum('nkw,nlw->nkl', J, J)
+    b = np.einsum('nkw,nw->nk', J, r)
+    Hd = H + lam[:,None,None]*(np.eye(4)*np.diagonal(H, axis1=1, axis2=2)[:,:,None])
+
+    #solved line by line, so that one degenerate window fails on its own
+    step = np.zeros_like(b)
+    for i in np.flatnonzero(active):
+      try:
+        step[i] = np.linalg.solve(Hd[i], b[i])
+      except np.linalg.LinAlgError:
+        ok[i] = active[i] = False
+
+    p_new = p + step
+    c2_new = chi2(p_new)
+    better = active & (c2_new <= c2)
+    conv = better & (c2 - c2_new <= tol*c2)
+    p[better] = p_new[better]
+    lam = np.where(better, lam/10, lam*10)
+    c2 = np.where(better, c2_new, c2)
+    active &= ~conv & (lam < 1e10)
+
+  #covariance from the final Jacobian (as leastsq's cov_x)
+  J, _ = jacobian(p)
+  H = np.einsum('nkw,nlw->nkl', J, J)
+  cov = np.full_like(H, np.nan)
+  for i in np.flatnonzero(ok):
+    try:
+      cov[i] = np.linalg.pinv(H[i])
+    except np.linalg.LinAlgError:
+      ok[i] = False
+
+  xc, fwhm = p[:,0], np.abs(p[:,1])
+  fwhm_err = np.sqrt(np.abs(cov[:,1,1]))
+  xc[~ok], fwhm[~ok], fwhm_err[~ok] = np.nan, np.nan, np.nan
+  if deg is None:
+    return xc, fwhm, fwhm_err
+
+  good = ok & (fwhm_err > 0) & np.isfinite(fwhm_err)
+  R, R_err = xc/fwhm, xc*fwhm_err/fwhm**2
+  poly = np.poly1d(np.polyfit(xc[good], R[good], deg, w=1/R_err[good]))
+  return xc, fwhm, fwhm_err, poly
+#
+
@@ -4,10 +4,19 @@ Spectrum class.
 """
 import numpy as np
 import os
+import io
+import glob
+import gzip
+import json
+import hashlib
+import tempfile
+import warnings
 from sys import exit
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from trm import molly
 from astropy.io import fits
 from .spec_class import Spectrum
+from .spec_batch import SpectrumBatch
 
 __all__ = [
   "spec_from_txt",
@@ -16,6 +25,9 @@ __all__ = [
   "model_from_dk",
   "spec_from_sdss_fits",
   "spec_list_from_molly",
+  "spec_iter_from_molly",
+  "write_spectra",
+  "load_many",
 ]
 
 #element dict for dk headers
@@ -27,12 +39,100 @@ el_dict = {
   31:'Ga', 32:'Ge', 38:'Sr', 56:'Ba',
 }
 
+#Directory for binary sidecar copies of parsed text files, keyed on the
+#path, mtime, and size of the original. Set to a path to enable caching.
+text_cache_dir = None
+
+def _parse_columns(text, usecols):
+  """
+  Parse a block of whitespace separated numbers (one row per line) in a
+  single pass, returning the columns usecols. Falls back on np.loadtxt if
+  the block is not a simple table (e.g. comments or ragged rows).
+  """
+  text = text.strip()
+  if not text:
+    return np.loadtxt(io.StringIO(text), unpack=True, usecols=usecols, ndmin=2)
+  nl = text.find('\n')
+  ncols = len(text[:nl if nl >= 0 else None].split())
+  nrows = text.count('\n') + 1
+  try:
+    with warnings.catch_warnings():
+      warnings.simplefilter('error', DeprecationWarning)
+      data = np.fromstring(text, sep=' ')
+  except (DeprecationWarning, ValueError):
+    data = None
+  if data is None or data.size != nrows*ncols or max(usecols) >= ncols:
+    return np.loadtxt(io.StringIO(text), unpack=True, usecols=usecols, ndmin=2)
+  return data.reshape(nrows, ncols).T[list(usecols)]
+
+def _cached_read(fname, tag, reader):
+  """
+  Returns reader(fname), a 2D array and a JSON-able dict, via a binary
+  sidecar in text_cache_dir (if set). The cache entry is keyed on the path,
+  mtime, and size of fname, and tag (identifying the reader and options),
+  so modified files are re-read.
+  """
+  if text_cache_dir is None:
+    return reader(fname)
+
+  st = os.stat(fname)
+  key = f"{os.path.abspath(fname)}|{st.st_mtime_ns}|{st.st_size}|{tag}"
+  base = os.path.join(text_cache_dir, hashlib.sha1(key.encode()).hexdigest())
+  try:
+    data = np.load(base+'.npy', mmap_mode='r')
+    with open(base+'.json', 'r') as F:
+      meta = json.load(F)
+    return data, meta
+  except (OSError, ValueError):
+    pass
+
+  #failing to write the cache (e.g. an unwritable text_cache_dir) is not an
+  #error, as the data have already been read
+  data, meta = reader(fname)
+  tmps = []
+  try:
+    os.makedirs(text_cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=text_cache_dir)
+    tmps.append(tmp)
+    with os.fdopen(fd, 'w') as F:
+      json.dump(meta, F)
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=text_cache_dir)
+    tmps.append(tmp)
+    with os.fdopen(fd, 'wb') as F:
+      np.save(F, data)
+    os.replace(tmps[0], base+'.json')
+    os.replace(tmps[1], base+'.npy')
+  except OSError:
+    for tmp in tmps:
+      try:
+        os.remove(tmp)
+      except OSError:
+        pass
+  return data, meta
+
+def _read_txt(fname, usecols, skiprows=0):
+  """
+  Read the columns usecols from a text file, skipping the first skiprows
+  lines (see _parse_columns).
+  """
+  def reader(fname):
+    opener = gzip.open if fname.endswith(".gz") else open
+    with opener(fname, 'rt') as F:
+      for _ in range(skiprows):
+        F.readline()
+      return _parse_columns(F.read(), usecols), {}
+  return _cached_read(fname, f"txt{usecols}{skiprows}", reader)[0]
+
 def spec_from_txt(fname, wave='air', x_unit='AA', y_unit='erg/(s cm2 AA)', **kwargs):
   """
   Loads a text file with the first 3 columns as wavelengths, fluxes, errors.
-  kwargs are passed to np.loadtxt.
+  kwargs are passed to np.loadtxt. Without kwargs (other than skiprows),
+  a faster parser is used, and the result is cached if text_cache_dir is set.
   """
-  x, y, e = np.loadtxt(fname, unpack=True, usecols=(0,1,2), **kwargs)
+  if set(kwargs) <= {'skiprows'}:
+    x, y, e = _read_txt(fname, (0,1,2), **kwargs)
+  else:
+    x, y, e = np.loadtxt(fname, unpack=True, usecols=(0,1,2), **kwargs)
   name = os.path.splitext(os.path.basename(fname))[0]
   return Spectrum(x, y, e, name, wave, x_unit, y_unit)
     
@@ -41,41 +141,64 @@ def model_from_txt(fname, wave='vac', x_unit='AA', y_unit='erg/(s cm2 AA)', **kw
   Loads a text file with the first 2 columns as wavelengths and fluxes.
   This produces a spectrum object where the errors are just set to zero.
   This is therefore good to use for models. kwargs are passed to np.loadtxt.
+  Without kwargs (other than skiprows), a faster parser is used, and the
+  result is cached if text_cache_dir is set.
   """
-  x, y = np.loadtxt(fname, unpack=True, usecols=(0,1), **kwargs)
+  if set(kwargs) <= {'skiprows'}:
+    x, y = _read_txt(fname, (0,1), **kwargs)
+  else:
+    x, y = np.loadtxt(fname, unpack=True, usecols=(0,1), **kwargs)
   name = os.path.splitext(os.path.basename(fname))[0]
   return Spectrum(x, y, 0, name, wave, x_unit, y_unit)
 
 def model_from_dk(fname, x_unit='AA', y_unit='erg/(s cm2 AA)'):
   """
   Similar to model_from_txt, but will autoskip past the DK header.
-  Units are converted to those specified.
+  Units are converted to those specified. The file is read once, and the
+  result cached if text_cache_dir is set.
   """
-  #extract header first
-  hdr = {'el':{}}
-  with open(fname, 'r') as Fdk:
-    for skip, line in enumerate(Fdk, 1):
-      if line.startswith("TEFF"):
-        hdr['Teff'] = float(line.split()[2])
-      elif line.startswith("LOG_G"):
-        hdr['logg'] = float(line.split()[2])
-      elif line.startswith("COMMENT   el"):
-        *_, Z, logZ = line.split() 
-        Z = int(Z)
-        if Z >= 100: #compatability with older dk files
-          Z //= 100
-        logZ = float(logZ)
-        hdr['el'][el_dict[Z]] = logZ
-      elif line.startswith("END"):
-        break
-      else:
-        continue
-  M = model_from_txt(fname, 'vac', 'AA', 'erg/(s cm3)', skiprows=skip)
+  (x, y), hdr = _cached_read(fname, "dk", _read_dk)
+  name = os.path.splitext(os.path.basename(fname))[0]
+  M = Spectrum(x, y, 0, name, 'vac', 'AA', 'erg/(s cm3)')
   M.x_unit_to(x_unit)
   M.y_unit_to(y_unit)
   M.head.update(hdr)
   return M
 
+def _read_dk_header(Fdk):
+  """
+  Reads the header of an open DK model file, up to and including the END
+  line, returning the header items.
+  """
+  hdr = {'el':{}}
+  for line in Fdk:
+    if line.startswith("TEFF"):
+      hdr['Teff'] = float(line.split()[2])
+    elif line.startswith("LOG_G"):
+      hdr['logg'] = float(line.split()[2])
+    elif line.startswith("COMMENT   el"):
+      *_, Z, logZ = line.split() 
+      Z = int(Z)
+      if Z >= 100: #compatability with older dk files
+        Z //= 100
+      logZ = float(logZ)
+      hdr['el'][el_dict[Z]] = logZ
+    elif line.startswith("END"):
+      break
+    else:
+      continue
+  return hdr
+
+def _read_dk(fname):
+  """
+  Reads a DK model file in a single pass, returning the wavelength and flux
+  columns, and the header items.
+  """
+  with open(fname, 'r') as Fdk:
+    hdr = _read_dk_header(Fdk)
+    text = Fdk.read()
+  return _parse_columns(text, (0,1)), hdr
+
 def spec_from_npy(fname, wave='air', x_unit='AA', y_unit='erg/(s cm2 AA)'):
   """
   Loads a npy file with 2 or 3 columns as wavelengths, fluxes(, errors).
@@ -110,12 +233,127 @@ def spec_list_from_molly(fname):
   """
   Returns a list of spectra read in from a TRM molly file.
   """
-  def convert_mol(molsp):
+  return list(spec_iter_from_molly(fname))
+
+def spec_iter_from_molly(fname):
+  """
+  Generator of the spectra in a TRM molly file, read one at a time, e.g.
+  for spectra_mean_online.
+  """
+  for molsp in molly.gmolly(fname):
     x, y, e = molsp.wave, molsp.f, molsp.fe
     name = molsp.head['Object']
     S = Spectrum(x, y, np.abs(e), name, y_unit="mJy")
     S.head = molsp.head
-    return S
-  
-  return [convert_mol(molsp) for molsp in molly.gmolly(fname)]
+    yield S
+
+
+def _pool_map(fun, items, workers=None, executor='process'):
+  """
+  Generator of fun(item) for the list items, in order, evaluated by a pool
+  of workers (a 'thread' or 'process' executor), or serially if workers
+  is 1. workers defaults to the number of CPUs.
+  """
+  if executor not in ('thread', 'process'):
+    raise ValueError("executor must be 'thread' or 'process'")
+  if workers == 1:
+    yield from map(fun, items)
+    return
+  nworkers = workers or os.cpu_count() or 1
+  if executor == 'thread':
+    with ThreadPoolExecutor(nworkers) as pool:
+      yield from pool.map(fun, items)
+  else:
+    chunksize = max(1, len(items) // (4*nworkers))
+    with ProcessPoolExecutor(nworkers) as pool:
+      yield from pool.map(fun, items, chunksize=chunksize)
+
+def _write_spectrum(args):
+  """
+  Write one spectrum to its own file (worker for write_spectra)
+  """
+  S, fname, errors = args
+  S.write(fname, errors)
+
+def _format_spectrum(args):
+  """
+  Format one spectrum as text, preceded by a '# name' line (worker for
+  write_spectra)
+  """
+  S, errors = args
+  F = io.StringIO()
+  F.write(f"# {S.name}\n")
+  S.write(F, errors)
+  return F.getvalue()
+
+def write_spectra(SS, path, errors=True, workers=None, executor='process', ext=".txt"):
+  """
+  Write many spectra as text, formatting them in parallel with a pool of
+  workers (see _pool_map). If path is a directory, each spectrum is written
+  to path/{name}{ext} (ext may include .gz). Otherwise all spectra are
+  written to the single file path (gzipped if it ends in .gz), in order,
+  each preceded by a '# name' comment line.
+  """
+  SS = list(SS)
+  if os.path.isdir(path):
+    fnames = [os.path.join(path, S.name + ext) for S in SS]
+    if len(set(fnames)) != len(fnames):
+      raise ValueError("spectra must have unique names to be written to a directory")
+    items = [(S, fname, errors) for S, fname in zip(SS, fnames)]
+    for _ in _pool_map(_write_spectrum, items, workers, executor):
+      pass
+  else:
+    texts = _pool_map(_format_spectrum, [(S, errors) for S in SS], workers, executor)
+    if path.endswith(".gz"):
+      F = gzip.open(path, 'wt', compresslevel=6)
+    else:
+      F = open(path, 'w')
+    with F:
+      for text in texts:
+        F.write(text)
+
+def _load_one(args):
+  """
+  Read one file, optionally interpolating onto x (worker for load_many).
+  Returns the spectrum and None, or None and an error message on failure.
+  """
+  reader, path, kwargs, x, kind = args
+  try:
+    S = reader(path, **kwargs)
+    if x is not None:
+      S = S.interp(x, kind)
+    return S, None
+  except (Exception, SystemExit) as err:
+    return None, f"{type(err).__name__}: {err}"
+
+def load_many(paths, reader=spec_from_txt, workers=None, executor='process', stack=False, x=None, kind='linear', **kwargs):
+  """
+  Read many files with reader (e.g. spec_from_sdss_fits or model_from_dk),
+  using a pool of workers (see _pool_map). paths is a list of file names, or
+  a glob pattern. kwargs are passed to reader.
+
+  Returns the spectra (in the same order as paths) and a list of
+  (path, error message) pairs for any files that could not be read, so
+  that one bad file does not stop the others being read. If x is given,
+  each spectrum is interpolated onto x (with kind) by the workers. With
+  stack=True, the spectra are returned as a SpectrumBatch, which requires
+  them to share the same x values (e.g. by giving x).
+
+  Example:
+  >>> SS, failed = load_many("data/*.fits", spec_from_sdss_fits, workers=8)
+  """
+  if isinstance(paths, str):
+    paths = sorted(glob.glob(paths))
+  paths = list(paths)
+
+  items = [(reader, path, kwargs, x, kind) for path in paths]
+  SS, failed = [], []
+  for path, (S, err) in zip(paths, _pool_map(_load_one, items, workers, executor)):
+    if err is None:
+      SS.append(S)
+    else:
+      failed.append((path, err))
 
+  if stack and SS:
+    SS = SpectrumBatch.from_spectra(SS)
+  return SS, failed
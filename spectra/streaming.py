@@ -0,0 +1,55 @@
+"""
+Streaming (chunked) processing of long spectra. Operations are applied to
+overlapping pieces of a spectrum, and the results stitched together, so
+that peak memory is set by the chunk size rather than the spectrum length.
+"""
+import numpy as np
+
+__all__ = [
+  "map_chunks",
+]
+
+def map_chunks(S, fun, chunk_size, overlap=0., logx=False):
+  """
+  Apply fun to the Spectrum S in chunks of chunk_size pixels, returning the
+  stitched result as a new Spectrum. fun must take a Spectrum and return a
+  Spectrum with the same x values (e.g. a convolution).
+
+  Each chunk is extended by overlap (in units of x, or of log(x) if logx is
+  True) on either side before fun is applied, and only the central part of
+  the output is kept (overlap-save). For operations with a kernel, this
+  reproduces the result of fun(S) as long as overlap is at least as wide
+  as the kernel. Operations that resample onto a new grid internally must
+  use a grid that does not depend on the chunk for this to hold; the
+  chunked convolve_gaussian, convolve_gaussian_R and rot_broaden methods
+  of Spectrum resample each chunk onto points of the grid of the whole
+  spectrum, so agree with the in-memory result to rounding error. x must
+  be sorted, and fun must preserve the number of pixels.
+
+  Example:
+  >>> S2 = map_chunks(S, lambda Sc: Sc.convolve_gaussian(2.), 10**5, 10.)
+  """
+  x = S._x
+  if not S.grid.is_sorted:
+    raise ValueError("x values must be sorted for chunked processing")
+  if chunk_size < 1:
+    raise ValueError("chunk_size must be positive")
+
+  N = len(S)
+  y, e, yu = np.empty(N), np.empty(N), None
+  for i0 in range(0, N, chunk_size):
+    i1 = min(i0+chunk_size, N)
+    if logx:
+      lo, hi = x[i0]*np.exp(-overlap), x[i1-1]*np.exp(overlap)
+    else:
+      lo, hi = x[i0]-overlap, x[i1-1]+overlap
+    j0 = min(np.searchsorted(x, lo, 'left'), i0)
+    j1 = max(np.searchsorted(x, hi, 'right'), i1)
+
+    out = fun(S[j0:j1])
+    if len(out) != j1-j0:
+      raise ValueError("fun must return a spectrum with the same x values as its input")
+    y[i0:i1] = out._y[i0-j0:i1-j0]
+    e[i0:i1] = out._e[i0-j0:i1-j0]
+    yu = out._yu
+  return S._spawn(S._shared('_x'), y, e, yu)
@@ -1,13 +1,25 @@
 import numpy as np
 from scipy.integrate import trapz as Itrapz, simps as Isimps
+from scipy.interpolate import interp1d
+from collections import OrderedDict
+import astropy.units as u
 import os.path
+from .misc import _grid_key
 
 __all__ = [
   "load_transmission_curve",
+  "register_filter",
+  "write_filter_pack",
+  "load_filter_pack",
+  "clear_filter_cache",
+  "integration_weights",
   "mag_calc_AB",
+  "filter_weights",
+  "mag_calc_AB_batch",
 ]
 
 filters_dir = "{}/filt_profiles".format(os.path.dirname(__file__))
+filters_pack = "{}/filters.npz".format(filters_dir)
 
 GaiaDict = {'G':'G', 'Bp':'Gbp', 'Rp':'Grp'}
 filter_paths = {
@@ -25,32 +37,199 @@ filter_paths = {
   **{f"W{b}"    : f"WISE_WISE.W{b}.dat" for b in "12"}, #Wise
 }
 
-def load_transmission_curve(filt):
+#Filters registered at runtime (name -> path or (x, y) arrays), filters read
+#from a packed archive, and an LRU cache of curves parsed from text files.
+_registered_filters = {}
+_packed_filters = {}
+_filter_cache = OrderedDict()
+filter_cache_size = 64
+
+def register_filter(name, x=None, y=None, fname=None):
   """
-  Loads the filter curves obtained from VOSA (SVO).
+  Register an additional filter so that it can be used by name, without
+  editing filter_paths. Either give the transmission curve directly via x
+  (wavelengths in AA) and y, or give fname, a two column text file in the
+  same format as the VOSA curves. Registering an existing name replaces it.
   """
-  from .spec_io import model_from_txt
+  if fname is not None:
+    if x is not None or y is not None:
+      raise ValueError("Give either fname or x/y, not both")
+    _registered_filters[name] = fname
+  else:
+    if not (isinstance(x, np.ndarray) and isinstance(y, np.ndarray)):
+      raise TypeError("x and y must be ndarrays")
+    if x.ndim != 1 or x.shape != y.shape:
+      raise ValueError("x and y must be 1D arrays of the same shape")
+    _registered_filters[name] = x.astype(float), y.astype(float)
+  _packed_filters.pop(name, None)
+  _filter_cache.pop(name, None)
+  for key in [key for key in _weights_cache if key[0] == name]:
+    del _weights_cache[key]
 
+def clear_filter_cache():
+  """
+  Empty the cache of parsed filter curves, including any loaded pack.
+  """
+  _filter_cache.clear()
+  _packed_filters.clear()
+  _weights_cache.clear()
+  load_filter_pack.loaded = False
+
+def _filter_source(filt):
+  """
+  Path of the text file a filter is read from, or None for filters
+  registered as arrays.
+  """
+  source = _registered_filters.get(filt)
+  if isinstance(source, tuple):
+    return None
+  if source is not None:
+    return source
+  return "{}/{}".format(filters_dir, filter_paths[filt])
+
+def _source_stat(path):
+  """
+  (mtime, size) of a filter source file, or (-1, -1) if there is no file
+  """
   try:
-    full_path = "{}/{}".format(filters_dir, filter_paths[filt])
-  except KeyError:
-    print('Invalid filter name: {}'.format(filt))
-    exit()
+    st = os.stat(path)
+  except OSError:
+    return -1, -1
+  return st.st_mtime_ns, st.st_size
+
+def write_filter_pack(fname=filters_pack, filts=None):
+  """
+  Write filter curves (default: everything in filter_paths, plus registered
+  filters) to a single .npz archive. If written to the default location,
+  the pack is used automatically, so all filters are loaded in a single read.
+  The mtime and size of each source file are stored, so that curves whose
+  files are later modified are read from the files instead.
+  """
+  if filts is None:
+    filts = [*filter_paths, *_registered_filters]
+  curves = [_filter_arrays(filt) for filt in filts]
+  paths = [_filter_source(filt) or "" for filt in filts]
+  stats = np.array([_source_stat(path) if path else (-1, -1) for path in paths], dtype=np.int64)
+  offsets = np.cumsum([0] + [len(x) for x, _ in curves])
+  np.savez(fname,
+    names   = np.array(filts),
+    offsets = offsets,
+    x       = np.hstack([x for x, _ in curves]),
+    y       = np.hstack([y for _, y in curves]),
+    paths   = np.array(paths),
+    stats   = stats.reshape(-1, 2),
+  )
+
+def load_filter_pack(fname=filters_pack):
+  """
+  Load all filter curves from a pack written by write_filter_pack. Filters
+  registered at runtime take precedence over those in the pack. Curves
+  whose source files have changed (by mtime or size) since the pack was
+  written are skipped, and so read from the files. Returns the names of
+  the skipped filters.
+  """
+  with np.load(fname) as pack:
+    names, offsets, x, y, paths, stats = \
+      (pack[key] for key in ('names','offsets','x','y','paths','stats'))
+  stale = []
+  for name, i0, i1, path, stat in zip(names, offsets[:-1], offsets[1:], paths, stats):
+    name, path = str(name), str(path)
+    if path and _source_stat(path) != tuple(stat):
+      stale.append(name)
+      continue
+    _packed_filters[name] = x[i0:i1], y[i0:i1]
+  load_filter_pack.loaded = True
+  return stale
+load_filter_pack.loaded = False
+
+def _filter_arrays(filt):
+  """
+  Return wavelength (AA) and transmission arrays for a filter, avoiding
+  parsing the text files wherever possible.
+  """
+  if filt in _registered_filters:
+    source = _registered_filters[filt]
+    if isinstance(source, tuple):
+      return source
+    full_path = source
+  else:
+    if not load_filter_pack.loaded and os.path.isfile(filters_pack):
+      load_filter_pack()
+    if filt in _packed_filters:
+      return _packed_filters[filt]
+    try:
+      full_path = "{}/{}".format(filters_dir, filter_paths[filt])
+    except KeyError:
+      print('Invalid filter name: {}'.format(filt))
+      exit()
+
+  if filt in _filter_cache:
+    _filter_cache.move_to_end(filt)
+    return _filter_cache[filt]
+
+  curve = tuple(np.loadtxt(full_path, unpack=True, usecols=(0,1)))
+  _filter_cache[filt] = curve
+  while len(_filter_cache) > filter_cache_size:
+    _filter_cache.popitem(last=False)
+  return curve
+
+def load_transmission_curve(filt):
+  """
+  Loads the filter curves obtained from VOSA (SVO). Parsed curves are kept
+  in a process-wide cache, so repeated calls do not re-read the files.
+  """
+  from .spec_class import Spectrum
 
-  return model_from_txt(full_path, x_unit="AA", y_unit="")
+  x, y = _filter_arrays(filt)
+  return Spectrum(x, y, 0, filt, 'vac', "AA", "")
 #
 
+def integration_weights(X, Ifun=Itrapz, chunk_size=256):
+  """
+  Returns weights, w, such that Ifun(Y, X) == w @ Y for any Y on the grid X.
+  The trapezium rule weights are computed directly. Other integration rules
+  are linear in Y, so their weights are found by integrating rows of the
+  identity matrix (chunk_size rows at a time).
+  """
+  N = len(X)
+  if Ifun is Itrapz:
+    dx = np.diff(X)
+    w = np.zeros(N)
+    w[:-1] += 0.5*dx
+    w[1:] += 0.5*dx
+    return w
+
+  w = np.empty(N)
+  for i0 in range(0, N, chunk_size):
+    n = min(chunk_size, N-i0)
+    I = np.zeros((n, N))
+    I[np.arange(n), np.arange(i0, i0+n)] = 1.
+    w[i0:i0+n] = Ifun(I, X, axis=-1)
+  return w
+
 def m_AB_int(X, Y, R, Ifun):
   y_nu = Ifun(Y*R/X, X)/Ifun(R/X, X) 
   m = -2.5 * np.log10(y_nu) + 8.90
   return m
 
-def mag_calc_AB(S, filt, NMONTE=1000, Ifun=Itrapz):
+def mag_calc_AB(S, filt, NMONTE=1000, Ifun=Itrapz, errors='mc', chunk_size=None):
   """
   Calculates the synthetic AB magnitude of a spectrum for a given filter.
-  If NMONTE is > 0, monte-carlo error propagation is performed outputting
-  both a synthetic-mag and error. For model-spectra, i.e. no errors,
-  use e=np.ones_like(f) and NMONTE=0. List of currently supported filters:
+  If NMONTE is > 0, error propagation is performed outputting both a
+  synthetic-mag and error. For model-spectra, i.e. no errors, use
+  e=np.ones_like(f) and NMONTE=0. Both error methods assume that all fluxes
+  are statistically independent:
+
+  errors='mc':       NMONTE monte-carlo realisations are drawn as a single
+                     (NMONTE, Npix) matrix and integrated with one
+                     matrix-vector product. chunk_size limits the number of
+                     realisations held in memory at once (default: chunks of
+                     ~1e6 fluxes).
+
+  errors='analytic': linear error propagation, which is exact in the limit
+                     of small errors and requires only a single pass.
+
+  List of currently supported filters:
 
   2Mass:     ['2mJ','2mH','2mK']
 
@@ -73,6 +252,8 @@ def mag_calc_AB(S, filt, NMONTE=1000, Ifun=Itrapz):
   Swift:     ['sw(U,UVW1,UVW2,UVM1)']
 
   WISE:      ['W1','W2']
+
+  Further filters can be added with register_filter.
   """
 
   #load filter
@@ -89,10 +270,97 @@ def mag_calc_AB(S, filt, NMONTE=1000, Ifun=Itrapz):
   R = R.interp(S)
 
   #Calculate AB magnitudes, potentially including flux errors
+  x, y, e = S._x, S._y, S._e
   if NMONTE == 0:
-    return m_AB_int(S.x, S.y, R.y, Ifun)
-  else:
-    y_mc = lambda S: np.random.normal(S.y, S.e)
-    m = np.array([m_AB_int(S.x, y_mc(S), R.y, Ifun) for i in range(NMONTE)])
+    return m_AB_int(x, y, R._y, Ifun)
+
+  #fluxes are integrated as w @ y_nu / norm
+  w = integration_weights(x, Ifun) * R._y/x
+  norm = np.sum(w)
+  if errors == 'analytic':
+    flux = np.dot(w, y)
+    flux_e = np.sqrt(np.dot(w**2, e**2))
+    m = -2.5 * np.log10(flux/norm) + 8.90
+    return m, 2.5/np.log(10) * flux_e/np.abs(flux)
+  elif errors == 'mc':
+    if chunk_size is None:
+      chunk_size = max(1, 2**20 // max(1, len(S)))
+    m = np.empty(NMONTE)
+    for i0 in range(0, NMONTE, chunk_size):
+      n = min(chunk_size, NMONTE-i0)
+      y_mc = np.random.normal(y, e, size=(n, len(S)))
+      m[i0:i0+n] = -2.5 * np.log10(np.dot(y_mc, w)/norm) + 8.90
     return np.mean(m), np.std(m)
+  else:
+    raise ValueError("errors must be 'mc' or 'analytic'")
+#
+
+#LRU cache of per-filter weight vectors, keyed on filter and grid
+_weights_cache = OrderedDict()
+weights_cache_size = 256
+
+def _filter_weights_1(x, filt, x_unit, y_unit, Ifun):
+  """
+  Weight vector for a single filter. Mirrors the steps of mag_calc_AB: the
+  grid is converted to Hz, clipped to the filter range, and the filter is
+  interpolated onto it. The conversion of fluxes to Jy is folded in.
+  """
+  xq = x * u.Unit(x_unit)
+  nu = xq.to("Hz", u.spectral()).value
+  to_Jy = (np.ones_like(x) * u.Unit(y_unit)).to("Jy", u.spectral_density(xq)).value
+
+  xR, yR = _filter_arrays(filt)
+  nuR = (xR * u.AA).to("Hz", u.spectral()).value
+  mask = (nu > nuR.min()) & (nu < nuR.max())
+  R = interp1d(nuR, yR, kind='cubic', bounds_error=False, fill_value=0.)(nu[mask])
+
+  w_int = integration_weights(nu[mask], Ifun) * R/nu[mask]
+  w = np.zeros_like(x)
+  w[mask] = to_Jy[mask] * w_int / np.sum(w_int)
+  return w
+
+def filter_weights(x, filts, x_unit="AA", y_unit="erg/(s cm2 AA)", Ifun=Itrapz):
+  """
+  Returns an (Npix, F) matrix of integration weights for the filters in
+  filts on the grid x (ndarray or WavelengthGrid, with units x_unit), such
+  that for fluxes Y in y_unit, the AB magnitudes are -2.5*log10(Y @ W) + 8.90.
+  The weights include the conversion to Fnu, the filter curve, and the
+  integration rule. Weights are cached per filter and grid so that repeat
+  calls are almost free.
+  """
+  if isinstance(filts, str):
+    filts = [filts]
+  xu, yu = u.Unit(x_unit), u.Unit(y_unit)
+  gkey = _grid_key(x)
+  x = np.asarray(x)
+
+  W = np.empty((len(x), len(filts)))
+  for j, filt in enumerate(filts):
+    key = filt, gkey, xu, yu, Ifun
+    if key in _weights_cache:
+      _weights_cache.move_to_end(key)
+    else:
+      _weights_cache[key] = _filter_weights_1(x, filt, xu, yu, Ifun)
+      while len(_weights_cache) > weights_cache_size:
+        _weights_cache.popitem(last=False)
+    W[:,j] = _weights_cache[key]
+  return W
+
+def mag_calc_AB_batch(S, filts, Ifun=Itrapz, errors=False):
+  """
+  Calculates synthetic AB magnitudes for many spectra in many filters at
+  once. S can be a Spectrum or SpectrumBatch, and filts a filter name or
+  list of names (see mag_calc_AB). The result has shape (N, F) for a batch,
+  or (F,) for a single Spectrum (the filter axis is dropped if filts is a
+  str). With errors=True, analytic magnitude errors are also returned,
+  assuming independent pixels.
+  """
+  W = filter_weights(S.x, filts, S._xu, S._yu, Ifun)
+  flux = np.dot(S.y, W)
+  m = -2.5 * np.log10(flux) + 8.90
+  if errors:
+    flux_e = np.sqrt(np.dot(S.e**2, W**2))
+    m_e = 2.5/np.log(10) * flux_e/np.abs(flux)
+    return (m[...,0], m_e[...,0]) if isinstance(filts, str) else (m, m_e)
+  return m[...,0] if isinstance(filts, str) else m
 #
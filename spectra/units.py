@@ -0,0 +1,100 @@
+"""
+Fast unit conversion for spectral axes and flux densities. Conversions are
+planned once per pair of units with astropy, and thereafter applied as
+plain numpy operations.
+"""
+import numpy as np
+import astropy.units as u
+from functools import lru_cache
+
+__all__ = [
+  "parse_unit",
+  "convert_x",
+  "convert_y",
+]
+
+@lru_cache(maxsize=256)
+def parse_unit(unit):
+  """
+  Cached equivalent of astropy.units.Unit(), as parsing strings is slow.
+  """
+  return u.Unit(unit)
+
+def _power_law(x, f):
+  """
+  Given probe values x = 1, 2, 3 and f = f(x), returns (a, p) if f is
+  exactly a*x**p for integer p, and otherwise None.
+  """
+  a = f[0]
+  if not (np.isfinite(a) and a != 0 and f[1]/a > 0):
+    return None
+  p = np.log2(f[1]/a)
+  if abs(p - round(p)) > 1e-9:
+    return None
+  p = int(round(p))
+  if not np.allclose(f, a*x**p, rtol=1e-10, atol=0):
+    return None
+  return a, p
+
+@lru_cache(maxsize=256)
+def _x_plan(x_unit, new_unit):
+  """
+  Plan for converting spectral axis values, i.e. (a, p) such that
+  x_new = a * x**p, or None if there is no such simple relation.
+  """
+  probe = np.array([1., 2., 3.])
+  try:
+    f = (probe * x_unit).to(new_unit, u.spectral()).value
+  except u.UnitsError:
+    return None
+  return _power_law(probe, f)
+
+@lru_cache(maxsize=256)
+def _y_plan(x_unit, y_unit, new_unit):
+  """
+  Plan for converting flux densities on an x-axis in x_unit, i.e. (a, p)
+  such that y_new = y * a * x**p, or None if there is no such relation
+  (e.g. for logarithmic units).
+  """
+  probe_x = np.array([1., 2., 3., 1.]) * x_unit
+  probe_y = np.array([1., 1., 1., 2.]) * y_unit
+  try:
+    f = probe_y.to(new_unit, u.spectral_density(probe_x)).value
+  except u.UnitsError:
+    return None
+  if not np.isclose(f[3], 2*f[0], rtol=1e-10, atol=0):
+    return None
+  return _power_law(probe_x.value[:3], f[:3])
+
+def convert_x(x, x_unit, new_unit):
+  """
+  Convert spectral axis values x from x_unit to new_unit (both str or Unit),
+  supporting conversion between wavelength, frequency, energy etc.
+  """
+  x_unit, new_unit = parse_unit(x_unit), parse_unit(new_unit)
+  plan = _x_plan(x_unit, new_unit)
+  if plan is None:
+    return (x * x_unit).to(new_unit, u.spectral()).value
+  a, p = plan
+  if p == 1:
+    return a * x
+  elif p == -1:
+    return a / x
+  else:
+    return a * x**p
+
+def convert_y(x, x_unit, y_unit, new_unit, *ys):
+  """
+  Convert one or more flux-density arrays, ys, defined on the axis x (in
+  x_unit), from y_unit to new_unit. Supports conversion between Fnu and
+  Flambda etc. Returns a list with one converted array per input.
+  """
+  x_unit = parse_unit(x_unit)
+  y_unit, new_unit = parse_unit(y_unit), parse_unit(new_unit)
+  plan = _y_plan(x_unit, y_unit, new_unit)
+  if plan is None:
+    xq = x * x_unit
+    return [(y * y_unit).to(new_unit, u.spectral_density(xq)).value for y in ys]
+  a, p = plan
+  factor = a if p == 0 else a * x**p
+  return [y * factor for y in ys]
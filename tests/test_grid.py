@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from spectra import Spectrum, WavelengthGrid
+from spectra.grid import get_grid
+
+def test_array_copy_keyword():
+  G = get_grid(np.linspace(4000, 5000, 11))
+  assert np.asarray(G) is G.x
+  assert G.__array__(copy=False) is G.x
+  a = G.__array__(copy=True)
+  assert a is not G.x and np.array_equal(a, G.x)
+  assert np.array(G, copy=True) is not G.x
+  assert np.asarray(G, dtype=np.float32).dtype == np.float32
+  with pytest.raises(ValueError):
+    G.__array__(np.float32, copy=False)
+
+def test_key_computed_at_construction():
+  x = np.linspace(4000, 5000, 11)
+  G = WavelengthGrid(x)
+  assert G._key is not None
+  assert G == get_grid(x.copy())
+
+def test_compare_x_does_not_create_grids():
+  x = np.linspace(4000, 5000, 11)
+  S1, S2 = Spectrum(x, 1., 0.1), Spectrum(x.copy(), 2., 0.1)
+  S1._compare_x(S2)
+  assert S1._grid is None and S2._grid is None
+  S1.grid, S2.grid
+  S1._compare_x(S2)
+  with pytest.raises(ValueError):
+    S1._compare_x(Spectrum(x + 1, 1., 0.1))
+
+def test_readonly_view_is_copied():
+  a = np.linspace(1, 10, 10)
+  v = a.view()
+  v.flags.writeable = False
+  G = get_grid(v)
+  a[0] = 100
+  assert G.x[0] == 1.
+  assert get_grid(np.linspace(1, 10, 10)) is G
+
+def test_readonly_owner_is_not_copied():
+  x = np.linspace(1, 10, 10).copy()
+  x.flags.writeable = False
+  assert WavelengthGrid(x).x is x
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+import astropy.units as u
+from spectra import Spectrum
+
+def make_spectrum(x_unit="AA", y_unit="erg/(s cm^2 AA)", n=100):
+  x = np.linspace(4000, 5000, n)
+  return Spectrum(x, np.ones(n), np.full(n, 0.1), x_unit=x_unit, y_unit=y_unit)
+
+@pytest.mark.parametrize("other, error", [
+  (make_spectrum(x_unit="nm"), u.UnitsError),
+  (make_spectrum(y_unit="mJy"), u.UnitsError),
+  (make_spectrum(n=101), ValueError),
+])
+def test_lazy_raises_like_eager(other, error):
+  S = make_spectrum()
+  for op in (lambda A, B: A + B, lambda A, B: A - B):
+    with pytest.raises(error):
+      op(S, other)
+    with pytest.raises(error):
+      op(S.lazy(), other)
+    with pytest.raises(error):
+      op(S.lazy(), other.lazy())
+
+def test_lazy_mul_checks_x_units():
+  S, M = make_spectrum(), make_spectrum(x_unit="nm", y_unit="")
+  with pytest.raises(u.UnitsError):
+    S * M
+  with pytest.raises(u.UnitsError):
+    S.lazy() * M
+
+def test_lazy_matches_eager():
+  S1, S2 = make_spectrum(), make_spectrum() * 3
+  S = ((S1.lazy() - S2) * 2 + S1).compute()
+  E = (S1 - S2) * 2 + S1
+  assert np.allclose(S.y, E.y) and np.allclose(S.e, E.e)
+
+def test_lazy_unaffected_by_later_changes():
+  S, T = make_spectrum(), make_spectrum()
+  L = S.lazy() + T
+  S.x_unit_to("nm")
+  S.name = "changed"
+  S += 1
+  R = L.compute()
+  assert R.x_unit == "Angstrom" and R.x[0] == 4000.
+  assert R.name != "changed"
+  assert np.allclose(R.y, 2.)
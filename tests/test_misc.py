@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+from scipy.interpolate import interp1d
+from scipy.optimize import minimize, minimize_scalar
+from spectra.misc import convolve_gaussian, convolve_gaussian_R, lanczos, fit_scale
+
+def convolve_gaussian_old(x, y, FWHM):
+  """
+  Original 10x oversampled FFT convolution, which wraps around at the ends
+  """
+  sigma = FWHM/2.355
+  N = 1
+  while N < 10*len(x):
+    N *= 2
+  xi = np.linspace(x[0], x[-1], N)
+  yi = interp1d(x, y)(xi)
+  yg = np.exp(-0.5*((xi-x[0])/sigma)**2)
+  yg += yg[::-1]
+  yg /= np.sum(yg)
+  yic = np.fft.ifft(np.fft.fft(yi) * np.fft.fft(yg)).real
+  return interp1d(xi, yic)(x)
+
+LINES = np.random.default_rng(4).uniform(4000, 5000, 50)
+
+def make_lines(x, sigma=0.):
+  """
+  Continuum and Gaussian absorption lines, analytically convolved with a
+  Gaussian of width sigma
+  """
+  y = 1 + 0.1*np.sin(x/300)*np.exp(-0.5*(sigma/300)**2)
+  s = np.hypot(2., sigma)
+  for x0 in LINES:
+    y -= 0.5*(2./s)*np.exp(-0.5*((x-x0)/s)**2)
+  return y
+
+@pytest.mark.parametrize("x", [
+  np.linspace(4000, 5000, 5001),
+  4000 + 1000*np.linspace(0, 1, 5001)**1.5,
+])
+@pytest.mark.parametrize("fwhm", [0.5, 3., 20.])
+def test_convolve_gaussian_matches_old(x, fwhm):
+  y, y_true = make_lines(x), make_lines(x, fwhm/2.355)
+  edge = (x > 4100) & (x < 4900) #old version wraps around at the ends
+  err_new = np.abs(convolve_gaussian(x, y, fwhm) - y_true)[edge].max()
+  err_old = np.abs(convolve_gaussian_old(x, y, fwhm) - y_true)[edge].max()
+  assert err_new <= err_old and err_old < 3e-3
+
+def test_convolve_gaussian_methods_agree():
+  x = np.linspace(4000, 5000, 2001)
+  y = make_lines(x)
+  for fwhm in (1., 20.):
+    y1 = convolve_gaussian(x, y, fwhm, method='direct')
+    y2 = convolve_gaussian(x, y, fwhm, method='fft')
+    assert np.allclose(y1, y2, rtol=0, atol=1e-12)
+  with pytest.raises(ValueError):
+    convolve_gaussian(x, y, 1., method='other')
+
+def test_convolve_gaussian_no_wraparound():
+  x = np.linspace(4000, 5000, 1001)
+  y = np.where(x < 4500, 1., 2.)
+  yc = convolve_gaussian(x, y, 50.)
+  assert np.allclose(yc[:100], 1.) and np.allclose(yc[-100:], 2.)
+
+def test_convolve_gaussian_R_matches_old():
+  x = np.exp(np.linspace(np.log(4000), np.log(5000), 5001))
+  y = make_lines(x)
+  edge = (x > 4100) & (x < 4900)
+  #each line is broadened to a FWHM of x0/R (as sigma << x0)
+  y_true = 1 + 0.1*np.sin(x/300)
+  for x0 in LINES:
+    s = np.hypot(2., x0/(2.355*2000))
+    y_true -= 0.5*(2./s)*np.exp(-0.5*((x-x0)/s)**2)
+  err_new = np.abs(convolve_gaussian_R(x, y, 2000) - y_true)[edge].max()
+  err_old = np.abs(convolve_gaussian_old(np.log(x), y, 1/2000) - y_true)[edge].max()
+  assert err_new <= err_old and err_old < 3e-3
+
+@pytest.mark.parametrize("x", [
+  np.linspace(4000, 5000, 2001),
+  4000 + 1000*np.linspace(0, 1, 2001)**1.5,
+])
+@pytest.mark.parametrize("chunk_size", [None, 3])
+def test_convolve_gaussian_rows_match_1d(x, chunk_size):
+  Y = np.array([make_lines(x) * (1 + 0.1*i) + 0.01*i*x/5000 for i in range(7)])
+  for fun, width in ((convolve_gaussian, 5.), (convolve_gaussian_R, 3000)):
+    Yc = fun(x, Y, width, chunk_size=chunk_size)
+    for y, yc in zip(Y, Yc):
+      assert np.allclose(yc, fun(x, y, width), rtol=0, atol=1e-12)
+
+def lanczos_brute(x, y, xnew, a):
+  """
+  Lanczos-a interpolation summed over every input pixel, O(N*M)
+  """
+  n = np.arange(len(x))
+  Ni = interp1d(x, n, kind='linear', fill_value='extrapolate')(xnew)
+  d = Ni[:,None] - n
+  w = np.where(np.abs(d) < a, np.sinc(d)*np.sinc(d/a), 0.)
+  return w @ y
+
+@pytest.mark.parametrize("a", [2, 3, 5])
+def test_lanczos_matches_brute_force(a):
+  rng = np.random.default_rng(7)
+  x = np.sort(rng.uniform(4000, 5000, 300))
+  y = rng.normal(size=300)
+  xnew = np.linspace(3990, 5010, 777)
+  assert np.allclose(lanczos(x, y, xnew, a), lanczos_brute(x, y, xnew, a), rtol=0, atol=1e-12)
+
+def test_lanczos_matches_unwindowed_sinc():
+  x = np.linspace(0, 100, 1001)
+  y = np.sin(x/3) + 0.5*np.cos(x/1.7)
+  xnew = np.linspace(20, 80, 997)
+  n = np.arange(len(x))
+  Ni = np.interp(xnew, x, n)
+  y_old = np.array([np.sum(y*np.sinc(ni-n)) for ni in Ni])
+  y_true = np.sin(xnew/3) + 0.5*np.cos(xnew/1.7)
+  #the window costs some accuracy against the full sinc, falling with a
+  for a, tol in ((3, 1e-2), (5, 3e-3)):
+    assert np.allclose(lanczos(x, y, xnew, a), y_true, rtol=0, atol=tol)
+    assert np.allclose(lanczos(x, y, xnew, a), y_old, rtol=0, atol=tol)
+
+def chi2_scale(A, y1, e1, y2, e2):
+  return np.sum((y1 - A*y2)**2 / (e1**2 + (A*e2)**2))
+
+def test_fit_scale_matches_minimize():
+  rng = np.random.default_rng(9)
+  y2 = 1 + 0.5*np.sin(np.linspace(0, 20, 500))
+  e1, e2 = np.full(500, 0.05), np.full(500, 0.03)
+  y1 = 2.7*y2 + rng.normal(0, 0.05, 500)
+  y2n = y2 + rng.normal(0, 0.03, 500)
+  A, A_err = fit_scale(y1, e1, y2n, e2)
+  res = minimize(chi2_scale, 1.0, args=(y1, e1, y2n, e2))
+  assert np.isclose(A, res['x'][0], rtol=1e-6)
+  assert np.isclose(A, minimize_scalar(chi2_scale, args=(y1, e1, y2n, e2), bracket=(1, 5), tol=1e-12).x, rtol=1e-9)
+  #error from the curvature, chi2(A +- A_err) = chi2_min + 1
+  dA = 1e-4*A
+  h = (chi2_scale(A+dA, y1, e1, y2n, e2) - 2*chi2_scale(A, y1, e1, y2n, e2) + chi2_scale(A-dA, y1, e1, y2n, e2))/dA**2
+  assert np.isclose(A_err, np.sqrt(2/h), rtol=1e-5)
+
+def test_fit_scale_rows():
+  rng = np.random.default_rng(10)
+  Y2 = 1 + rng.random((6, 200))
+  E1, E2 = 0.05 + 0.05*rng.random((6, 200)), 0.02*rng.random((6, 200))
+  Y1 = np.arange(1, 7)[:,None]*Y2 + rng.normal(0, E1)
+  A, A_err = fit_scale(Y1, E1, Y2, E2)
+  for i in range(6):
+    Ai, Ai_err = fit_scale(Y1[i], E1[i], Y2[i], E2[i])
+    assert np.isclose(A[i], Ai, rtol=1e-12) and np.isclose(A_err[i], Ai_err, rtol=1e-12)
@@ -0,0 +1,41 @@
+import numpy as np
+from spectra import Spectrum, ModelGrid, ModelCatalogue
+
+def test_fit_matches_scale_model():
+  rng = np.random.default_rng(1)
+  xm = np.linspace(3900, 5100, 800)
+  models = [Spectrum(xm, 1 + 0.3*np.sin(xm/(20+5*i)), 0., f"M{i}") for i in range(6)]
+  x = np.linspace(3850, 5000, 1500) #partly outside the models
+  e = np.full(len(x), 0.05)
+  e[::50] = 0.
+  S = Spectrum(x, 2 + rng.normal(0, 0.05, len(x)), e)
+
+  fit = ModelGrid(models).fit(S)
+  for M, A in zip(models, fit.A):
+    _, A0 = M.scale_model(S, return_scaling_factor=True)
+    assert np.isclose(A, A0, rtol=1e-10)
+
+def write_dk(fname, Teff, logg):
+  with open(fname, 'w') as F:
+    F.write(f"TEFF    = {Teff}\nLOG_G   = {logg}\nCOMMENT   el  20  -8.0\nEND\n")
+    F.write("4000. 1.\n4001. 2.\n")
+
+def test_catalogue_with_unwritable_index(tmp_path):
+  for i, Teff in enumerate([10000., 11000., 12000.]):
+    write_dk(tmp_path / f"m{i}.dk", Teff, 8.)
+  C = ModelCatalogue(tmp_path, index_file=tmp_path / "missing" / "index.json")
+  assert len(C) == 3
+  assert C.query(Teff=(10500, 12500), elements=['Ca']) == [str(tmp_path / "m1.dk"), str(tmp_path / "m2.dk")]
+  assert not C.save()
+  assert sorted(p.name for p in tmp_path.iterdir()) == ["m0.dk", "m1.dk", "m2.dk"]
+
+def test_stacked_models_are_views():
+  x = np.linspace(4000, 5000, 101)
+  models = [Spectrum(x, np.full(101, i+1.), 0., f"M{i}") for i in range(3)]
+  G = ModelGrid(models)
+  for i, M in enumerate(G):
+    assert np.shares_memory(M._y, G._Y[i])
+    assert M.name == f"M{i}" and M.grid is models[0].grid
+  M = G[1]
+  M *= 2
+  assert np.all(M.y == 4.) and np.all(G._Y[1] == 2.)
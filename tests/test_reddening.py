@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from spectra import Spectrum
+from spectra.misc import air_to_vac
+from spectra.reddening import A_curve
+
+def A_CCM89_old(x, R):
+  """
+  The original CCM89 curve, evaluated piecewise
+  """
+  pa = [1, +0.17699, -0.50447, -0.02427, +0.72085, +0.01979, -0.77530, +0.32999][::-1]
+  pb = [0, +1.41338, +2.28305, +1.07233, -5.38434, -0.62251, +5.30260, -2.09002][::-1]
+  def UV(x):
+    x = np.asarray(x, dtype=float)
+    Fa = np.where(x < 5.9, 0., np.polyval([-0.009779, -0.04473, 0, 0], x-5.9))
+    Fb = np.where(x < 5.9, 0., np.polyval([+0.120700, +0.21300, 0, 0], x-5.9))
+    a =  1.752 - 0.316*x - 0.104/((x-4.67)**2 + 0.341) + Fa
+    b = -3.090 + 1.825*x + 1.206/((x-4.62)**2 + 0.263) + Fb
+    return a, b
+  a, b = np.zeros_like(x), np.zeros_like(x)
+  for i, xi in enumerate(x):
+    if xi < 0.3:
+      a[i], b[i] = 0.574*0.3**1.61, -0.527*0.3**1.61
+    elif xi < 1.1:
+      a[i], b[i] = 0.574*xi**1.61, -0.527*xi**1.61
+    elif xi < 3.3:
+      a[i], b[i] = np.polyval(pa, xi-1.82), np.polyval(pb, xi-1.82)
+    elif xi < 8.0:
+      a[i], b[i] = UV(xi)
+    else:
+      a[i], b[i] = UV(8.0)
+  return a + b/R
+
+@pytest.mark.parametrize("R", [2.5, 3.1, 5.0])
+def test_A_curve_matches_old(R):
+  x = np.linspace(0.1, 10, 1000)
+  A = A_curve(x, R)
+  assert np.allclose(A, A_CCM89_old(x, R), rtol=1e-12, atol=1e-14)
+  assert A_curve(x.copy(), R) is A and not A.flags.writeable
+  with pytest.raises(ValueError):
+    A_curve(x, R, 'other')
+
+@pytest.mark.parametrize("wave, x_unit", [("air", "AA"), ("vac", "AA"), ("air", "nm")])
+def test_redden_matches_old(wave, x_unit):
+  x = np.linspace(1500, 25000, 2000)
+  S = Spectrum(x, np.ones(2000), np.full(2000, 0.1), wave=wave)
+  S.x_unit_to(x_unit)
+  xv = air_to_vac(x) if wave == "air" else x
+  extinction = 10**(-0.4*3.1*0.3*A_CCM89_old(1e4/xv, 3.1))
+  S.redden(0.3)
+  assert np.allclose(S.y, extinction, rtol=1e-10) and np.allclose(S.e, 0.1*extinction, rtol=1e-10)
+
+def test_redden_batch_matches_redden():
+  x = np.linspace(3000, 10000, 500)
+  S = Spectrum(x, 1 + 0.1*np.sin(x/100), np.full(500, 0.05), "S")
+  E_BV = np.linspace(0, 1, 7)
+  B = S.redden_batch(E_BV, model='OD94')
+  for E, y, e in zip(E_BV, B.y, B.e):
+    T = S.copy()
+    T.redden(E, model='OD94')
+    assert np.allclose(y, T.y, rtol=1e-12) and np.allclose(e, T.e, rtol=1e-12)
+  assert B.names[2] == f"S E(B-V)={E_BV[2]:g}"
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from scipy.interpolate import interp1d
+from spectra import Spectrum, resample
+from spectra.resample import Resampler, get_resampler
+
+def interp_old(S, x2, kind):
+  """
+  Spectrum.interp before the cached operators, via interp1d
+  """
+  y2 = interp1d(S.x, S.y, kind=kind, bounds_error=False, fill_value=0.)(x2)
+  e2 = interp1d(S.x, S.e, kind=kind, bounds_error=False, fill_value=np.inf)(x2)
+  e2[e2 < 0] = 0.
+  return y2, e2
+
+@pytest.mark.parametrize("kind", ['linear', 'cubic'])
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_interp_matches_interp1d(kind, shuffle):
+  rng = np.random.default_rng(8)
+  x = np.sort(rng.uniform(4000, 5000, 400))
+  S = Spectrum(x, np.sin(x/20), 0.1 + 0.05*np.cos(x/30))
+  if shuffle:
+    S = S[rng.permutation(len(S))]
+  x2 = np.linspace(3990, 5010, 911)
+  T = S.interp(x2, kind)
+  y2, e2 = interp_old(S, x2, kind)
+  assert np.allclose(T.y, y2, rtol=0, atol=1e-10)
+  assert np.array_equal(np.isinf(T.e), np.isinf(e2))
+  assert np.allclose(T.e[np.isfinite(e2)], e2[np.isfinite(e2)], rtol=0, atol=1e-10)
+
+def test_resampler_rows():
+  x1, x2 = np.linspace(0, 10, 50), np.linspace(-1, 11, 77)
+  Y = np.array([np.sin(x1*(i+1)) for i in range(5)])
+  for kind in Resampler.kinds:
+    R = Resampler(x1, x2, kind)
+    Y2 = R(Y, np.nan)
+    for y, y2 in zip(Y, Y2):
+      assert np.allclose(y2, R(y, np.nan), rtol=0, atol=1e-12, equal_nan=True)
+    assert np.all(np.isnan(Y2[:, ~R.inside]))
+
+def test_resampler_is_cached():
+  x = np.linspace(4000, 5000, 100)
+  S = Spectrum(x, np.ones(100), np.full(100, 0.1))
+  resample._resampler_cache.clear()
+  x2 = np.linspace(4100, 4900, 30)
+  S.interp(x2)
+  R = get_resampler(S.grid, x2.copy(), 'cubic')
+  assert len(resample._resampler_cache) == 1
+  assert get_resampler(x.copy(), x2, 'cubic') is R
+  assert get_resampler(x, x2, 'linear') is not R
@@ -0,0 +1,41 @@
+import numpy as np
+from spectra import Spectrum, SpectrumArchive
+
+def make_spectra(n, x0=4000.):
+  x = np.linspace(x0, x0+1000, 501)
+  return [Spectrum(x, np.full(501, i+1.), np.full(501, 0.1), f"S{i}") for i in range(n)]
+
+def test_roundtrip(tmp_path):
+  fname = tmp_path / "test.spa"
+  with SpectrumArchive(fname, 'w') as A:
+    A.extend(make_spectra(3))
+  A = SpectrumArchive(fname)
+  assert A.names == ["S0", "S1", "S2"]
+  assert np.all(A["S1"].y == 2.)
+  assert np.all(A[2].e == 0.1)
+
+def test_append_without_flush_keeps_archive_readable(tmp_path):
+  fname = tmp_path / "test.spa"
+  with SpectrumArchive(fname, 'w') as A:
+    A.extend(make_spectra(3))
+
+  A = SpectrumArchive(fname, 'a')
+  A.extend(make_spectra(2, x0=5000.))
+  A._F.close() #simulate dying before flush/close
+
+  A = SpectrumArchive(fname)
+  assert len(A) == 3
+  assert np.all(A[2].y == 3.)
+
+def test_append_after_reopen(tmp_path):
+  fname = tmp_path / "test.spa"
+  with SpectrumArchive(fname, 'w') as A:
+    A.extend(make_spectra(2))
+  with SpectrumArchive(fname, 'a') as A:
+    A.extend(make_spectra(2, x0=5000.))
+    A.flush()
+    A.append(make_spectra(5)[4])
+  A = SpectrumArchive(fname)
+  assert len(A) == 5
+  assert [S.y[0] for S in A] == [1., 2., 1., 2., 5.]
+  assert A[3].x[0] == 5000.
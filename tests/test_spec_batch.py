@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from spectra import Spectrum, SpectrumBatch
+
+def make_spectra(n=4, npix=300):
+  rng = np.random.default_rng(2)
+  x = np.linspace(4000, 5000, npix)
+  return [Spectrum(x, 2 + np.sin(x/(30+i)), 0.05 + 0.01*rng.random(npix), f"S{i}") for i in range(n)]
+
+def assert_matches(B, SS):
+  assert len(B) == len(SS)
+  for i, S in enumerate(SS):
+    assert np.allclose(B.x, S.x, rtol=1e-12)
+    assert np.allclose(B.y[i], S.y, rtol=1e-12, atol=1e-12)
+    assert np.allclose(B.e[i], S.e, rtol=1e-12, atol=1e-12)
+    assert B.y_unit == S.y_unit and B.x_unit == S.x_unit
+
+def test_rows_are_spectra():
+  SS = make_spectra()
+  B = SpectrumBatch.from_spectra(SS)
+  assert_matches(B, SS)
+  assert B[2].name == "S2" and isinstance(B[1:], SpectrumBatch)
+  assert_matches(B[:, 10:20], [S[10:20] for S in SS])
+
+@pytest.mark.parametrize("op", [
+  lambda A, B: A + B,
+  lambda A, B: A - B,
+  lambda A, B: A * B,
+  lambda A, B: A / B,
+])
+def test_arithmetic_matches_spectrum(op):
+  SS, TT = make_spectra(), make_spectra()[::-1]
+  B, C = SpectrumBatch.from_spectra(SS), SpectrumBatch.from_spectra(TT)
+  assert_matches(op(B, C), [op(S, T) for S, T in zip(SS, TT)])
+  assert_matches(op(B, TT[0]), [op(S, TT[0]) for S in SS])
+  assert_matches(op(TT[0], B), [op(TT[0], S) for S in SS])
+  assert_matches(op(B, 3.), [op(S, 3.) for S in SS])
+  assert_matches(op(3., B), [op(3., S) for S in SS])
+
+def test_pow_neg_abs_match_spectrum():
+  SS = make_spectra()
+  B = SpectrumBatch.from_spectra(SS)
+  assert_matches(B**2, [S**2 for S in SS])
+  assert_matches(-B, [-S for S in SS])
+  assert_matches(abs(-B), [abs(-S) for S in SS])
+
+@pytest.mark.parametrize("kind", ['linear', 'cubic', 'Akima'])
+def test_interp_matches_spectrum(kind):
+  SS = make_spectra()
+  x2 = np.linspace(3990, 5010, 457)
+  B = SpectrumBatch.from_spectra(SS)
+  assert_matches(B.interp(x2, kind), [S.interp(x2, kind) for S in SS])
+
+def test_units_and_redden_match_spectrum():
+  SS = make_spectra()
+  B = SpectrumBatch.from_spectra(SS)
+  B.x_unit_to("nm")
+  B.y_unit_to("mJy")
+  B.redden(np.array([0.1, 0.2, 0.3, 0.4]))
+  for S, E_BV in zip(SS, [0.1, 0.2, 0.3, 0.4]):
+    S.x_unit_to("nm")
+    S.y_unit_to("mJy")
+    S.redden(E_BV)
+  assert_matches(B, SS)
+
+def test_convolve_gaussian_matches_spectrum():
+  SS = make_spectra(5)
+  B = SpectrumBatch.from_spectra(SS)
+  assert_matches(B.convolve_gaussian(4., chunk_size=2), [S.convolve_gaussian(4.) for S in SS])
+  assert_matches(B.convolve_gaussian_R(2000), [S.convolve_gaussian_R(2000) for S in SS])
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+import astropy.units as u
+from spectra import Spectrum
+from spectra.misc import lanczos, lanczos_weights
+
+def make_spectrum():
+  x = np.linspace(4000, 5000, 1001)
+  return Spectrum(x, np.ones(1001), np.full(1001, 0.1))
+
+def test_clip_not_changed_by_exposed_array():
+  S = make_spectrum()
+  y = S.y
+  T = S.clip(4100, 4500)
+  y[:] = 7
+  assert T.y[0] == 1.
+  assert S.y[0] == 7.
+
+def test_slice_of_arithmetic_result_not_changed():
+  S3 = make_spectrum() + 1
+  y3 = S3.y
+  T3 = S3[:5]
+  y3[0] = -5
+  assert T3.y[0] == 2.
+  assert S3.y[0] == -5.
+
+def test_exposed_array_stays_aliased_after_slicing():
+  S = make_spectrum()
+  a = S.y
+  S[:10]
+  assert S.y is a
+  a[0] = 3.
+  assert S.y[0] == 3.
+
+def test_slice_not_changed_by_inplace_operator():
+  S = make_spectrum()
+  T = S[:10]
+  S += 1
+  assert np.all(T.y == 1.)
+  assert np.all(S.y == 2.)
+
+def test_sinc_interp_errors():
+  x = np.linspace(4000, 5000, 201)
+  S = Spectrum(x, np.sin(x/50), np.linspace(0.1, 0.2, 201))
+  x2 = np.linspace(3990, 5010, 333)
+  idx, w = lanczos_weights(x, x2, 3)
+  T = S.interp(x2, 'sinc')
+  inside = (x2 >= 4000) & (x2 <= 5000)
+  assert np.allclose(T.y[inside], lanczos(x, S.y, x2)[inside], rtol=0, atol=1e-12)
+  assert np.allclose(T.e[inside], np.sqrt(np.sum((w*S.e[idx])**2, axis=1))[inside], rtol=1e-12)
+  assert np.all(T.y[~inside] == 0) and np.all(T.e[~inside] == np.inf)
+
+@pytest.mark.parametrize("op, iop, qunit", [
+  (lambda A, B: A + B, lambda A, B: A.__iadd__(B), "erg/(s cm^2 AA)"),
+  (lambda A, B: A - B, lambda A, B: A.__isub__(B), "erg/(s cm^2 AA)"),
+  (lambda A, B: A * B, lambda A, B: A.__imul__(B), "s"),
+  (lambda A, B: A / B, lambda A, B: A.__itruediv__(B), "s"),
+])
+def test_inplace_matches_binary(op, iop, qunit):
+  x = np.linspace(4000, 5000, 1001)
+  S = Spectrum(x, 2 + np.sin(x/30), 0.1 + 0.05*np.cos(x/20))
+  T = Spectrum(x, 3 + np.cos(x/40), np.full(1001, 0.2))
+  for other in (T, 2.5, np.linspace(1, 2, 1001), 2.5*u.Unit(qunit)):
+    R, E = S.copy(), op(S, other)
+    assert iop(R, other) is R
+    assert np.allclose(R.y, E.y, rtol=1e-14) and np.allclose(R.e, E.e, rtol=1e-14)
+    assert R.y_unit == E.y_unit
+
+def test_inplace_checks_units():
+  S = make_spectrum()
+  T = Spectrum(S.x, 1., 0.1, y_unit="mJy")
+  with pytest.raises(u.UnitsError):
+    S += T
+  with pytest.raises(ValueError):
+    S *= np.ones(10)
+  assert np.all(S.y == 1.)
@@ -0,0 +1,189 @@
+import warnings
+import numpy as np
+import pytest
+from spectra import Spectrum, SpectrumBatch, resample
+from spectra.spec_functions import stitch_orders, sky_line_fwhm, sky_lines_fwhm
+from spectra.spec_functions import spectra_mean, SpectrumAccumulator, spectra_mean_online
+from spectra.spec_functions import scale_spectra_to_spectrum
+
+def test_stitch_orders_inverse_variance():
+  A = Spectrum(np.linspace(0, 10, 101), 1., 0.1)
+  B = Spectrum(np.linspace(5, 15, 101), 1., 0.1)
+  S = stitch_orders([B, A])
+  assert np.all(np.diff(S.x) > 0)
+  assert S.x[0] == 0 and S.x[-1] == 15
+  assert np.allclose(S.y, 1.)
+  assert np.allclose(S.e[(S.x > 5.5) & (S.x < 9.5)], 0.1/np.sqrt(2))
+
+@pytest.mark.parametrize("kind", ['linear', 'cubic'])
+def test_stitch_orders_narrow_overlap(kind):
+  A = Spectrum(np.linspace(0, 10, 101), 1., 0.1)
+  B = Spectrum(np.linspace(9.95, 20, 101), 1., 0.1)
+  C = Spectrum(np.array([19.93, 19.97, 20.01]), 1., 0.1)
+  S = stitch_orders([A, B, C], kind)
+  assert np.all(np.diff(S.x) > 0)
+  assert np.allclose(S.y, 1.)
+
+def lattice_orders(n, rng):
+  """
+  n orders on a common lattice (so interpolation between them is exact),
+  each with its own offset and error level, shuffled and some unsorted.
+  """
+  SS = []
+  for k in range(n):
+    i0 = rng.integers(0, 2000)
+    x = 0.125*np.arange(i0, i0+rng.integers(50, 300))
+    if k % 7 == 0:
+      x = x[::-1]
+    SS.append(Spectrum(x, 1 + 0.01*x + rng.normal(0, 0.1), rng.uniform(0.05, 0.2)))
+  rng.shuffle(SS)
+  return SS
+
+@pytest.mark.parametrize("kind", ['linear', 'cubic'])
+def test_stitch_orders_many_orders_brute_force(kind):
+  SS = lattice_orders(60, np.random.default_rng(4))
+  S = stitch_orders(SS, kind)
+
+  xall = np.unique(np.concatenate([Si.x for Si in SS]))
+  assert np.array_equal(S.x, xall)
+  W, WY = np.zeros(len(xall)), np.zeros(len(xall))
+  depth = np.zeros(len(xall), dtype=int)
+  for Si in SS:
+    i = np.searchsorted(xall, Si.x)
+    W[i] += 1/Si.e**2
+    WY[i] += Si.y/Si.e**2
+    depth[i] += 1
+  assert depth.max() >= 3
+  assert np.allclose(S.y, WY/W, rtol=0, atol=1e-9)
+  assert np.allclose(S.e, 1/np.sqrt(W), rtol=0, atol=1e-9)
+
+def test_stitch_orders_three_way_overlap():
+  x = np.linspace(0, 10, 101)
+  A = Spectrum(x, 1., 0.1)
+  B = Spectrum(x[20:], 2., 0.2)
+  C = Spectrum(x[40:70], 3., 0.1)
+  S = stitch_orders([C, A, B])
+  assert np.array_equal(S.x, x)
+  w = np.array([1/0.1**2, 1/0.2**2, 1/0.1**2])
+  y3 = np.sum(w*[1, 2, 3])/np.sum(w)
+  assert np.allclose(S.y[40:70], y3)
+  assert np.allclose(S.e[40:70], 1/np.sqrt(np.sum(w)))
+  assert np.allclose(S.y[20:40], (100+2*25)/125)
+  assert np.allclose(S.y[:20], 1.)
+
+def test_stitch_orders_no_usable_error():
+  x = np.linspace(0, 10, 101)
+  eA = np.full(len(x), 0.1)
+  eB = np.full(61, 0.1)
+  eA[50] = eB[10] = 0.
+  A = Spectrum(x, 1., eA)
+  B = Spectrum(x[40:], 3., eB)
+  S = stitch_orders([B, A])
+  assert np.array_equal(S.x, x)
+  #the best sampled order (A) is used where no order has a usable error
+  assert S.y[50] == 1. and S.e[50] == 0.
+  assert np.allclose(np.delete(S.y[40:], 10), 2.)
+  assert np.allclose(np.delete(S.e[40:], 10), 0.1/np.sqrt(2))
+
+def make_sky(lines, A=50.):
+  x = np.linspace(5000, 6000, 4001)
+  y = np.full(len(x), 2.)
+  for x0, fwhm in lines:
+    y += A*np.exp(-0.5*((x-x0)/(fwhm/2.355))**2)
+  rng = np.random.default_rng(3)
+  return Spectrum(x, y + rng.normal(0, 0.1, len(x)), np.full(len(x), 0.1))
+
+def test_sky_lines_fwhm_matches_sky_line_fwhm():
+  lines = [(5200., 1.2), (5500., 1.5), (5800., 1.9)]
+  S = make_sky(lines)
+  xc, fwhm, fwhm_err = sky_lines_fwhm(S, [x0 for x0, _ in lines])
+  for i, (x0, _) in enumerate(lines):
+    xc0, _, (fwhm0, err0) = sky_line_fwhm(S, x0)
+    assert np.isclose(xc[i], xc0, rtol=1e-7)
+    assert np.isclose(fwhm[i], fwhm0, rtol=1e-7)
+    assert np.isclose(fwhm_err[i], err0, rtol=1e-5)
+
+def test_sky_lines_fwhm_degenerate_window():
+  lines = [(5200., 1.2), (5500., 1.5), (5800., 1.9)]
+  S = make_sky(lines)
+  S.y[(S.x > 5890) & (S.x < 5910)] = 0. #no line and no flux
+  xc, fwhm, fwhm_err = sky_lines_fwhm(S, [5200., 5500., 5800., 5900.])
+  assert np.all(np.isnan([xc[3], fwhm[3], fwhm_err[3]]))
+  assert np.all(np.isfinite(fwhm[:3]))
+  _, fwhm0, _ = sky_lines_fwhm(S, [5200., 5500., 5800.])
+  assert np.allclose(fwhm[:3], fwhm0, rtol=1e-12)
+
+def make_epochs(n, outliers=()):
+  x = np.linspace(4000, 5000, 11)
+  SS = [Spectrum(x, np.full(11, 1.), np.full(11, 0.1)) for _ in range(n)]
+  for i, j, y in outliers:
+    SS[i].y[j] = y
+  return SS
+
+def test_accumulator_matches_spectra_mean():
+  SS = make_epochs(4)
+  for i, S in enumerate(SS):
+    S.y[:] = i
+    S.e[:] = 0.1*(i+1)
+  acc = SpectrumAccumulator(SS[0])
+  for S in SS:
+    acc.add(S)
+  S, S0 = acc.spectrum(), spectra_mean(SS)
+  assert len(acc) == 4
+  assert np.allclose(S.y, S0.y) and np.allclose(S.e, S0.e)
+
+def test_accumulator_clips_buffered_and_running():
+  SS = make_epochs(6, [(1, 5, 100.), (4, 7, 100.)])
+  acc = SpectrumAccumulator(SS[0], clip=5, min_count=3)
+  assert [acc.add(S) for S in SS] == [0, 0, 1, 0, 1, 0]
+  assert np.allclose(acc.mean, 1.)
+  assert acc.nclipped[5] == 1 and acc.nclipped[7] == 1 and acc.nclipped.sum() == 2
+
+def test_accumulator_partial_buffer_included():
+  SS = make_epochs(2)
+  acc = SpectrumAccumulator(SS[0], clip=5, min_count=3)
+  for S in SS:
+    acc.add(S)
+  assert np.allclose(acc.mean, 1.) and np.allclose(acc.error, 0.1/np.sqrt(2))
+
+def test_accumulator_all_buffered_clipped():
+  SS = make_epochs(4, [(0, 3, 0.), (1, 3, 10.), (3, 3, 20.)])
+  acc = SpectrumAccumulator(SS[0], clip=0.1, min_count=2)
+  with warnings.catch_warnings():
+    warnings.simplefilter('error')
+    nclip = [acc.add(S) for S in SS]
+  assert nclip == [0, 2, 0, 1]
+  assert acc.mean[3] == 1. and acc.nclipped[3] == 3
+
+def test_accumulator_does_not_cache_resamplers():
+  S0 = make_epochs(1)[0]
+  acc = SpectrumAccumulator(S0)
+  resample._resampler_cache.clear()
+  for dx in (1., 2., 3.):
+    x = np.linspace(3990+dx, 5010, 50)
+    acc.add(Spectrum(x, np.ones(50), np.full(50, 0.1)))
+  assert len(resample._resampler_cache) == 0
+  assert np.allclose(acc.mean, 1.)
+
+def test_spectra_mean_online_multipass_clip():
+  SS = make_epochs(6, [(1, 5, 100.), (4, 7, 100.)])
+  S = spectra_mean_online(SS, clip=5, min_count=3)
+  assert np.allclose(S.y, 1.)
+  assert np.allclose(S.e[[5, 7]], 0.1/np.sqrt(5))
+
+def test_scale_spectra_to_spectrum_matches_single():
+  rng = np.random.default_rng(11)
+  x0 = np.linspace(4000, 5000, 400)
+  S0 = Spectrum(x0, 2 + np.sin(x0/40) + rng.normal(0, 0.05, 400), np.full(400, 0.05))
+  SS = []
+  for i in range(4):
+    x = np.linspace(4100 + 20*i, 5100 - 30*i, 350)
+    SS.append(Spectrum(x, (2 + np.sin(x/40))/(i+1) + rng.normal(0, 0.02, 350), np.full(350, 0.02)))
+  A, A_err = scale_spectra_to_spectrum(SS, S0)
+  for i, S in enumerate(SS):
+    _, A0 = S.scale_spectrum_to_spectrum(S0, return_scaling_factor=True)
+    assert np.isclose(A[i], A0, rtol=1e-10)
+    assert np.isclose(A[i], i+1, rtol=0.01)
+  B = SpectrumBatch.from_spectra([SS[0]]*3)
+  A_b, _ = scale_spectra_to_spectrum(B, S0)
+  assert np.allclose(A_b, A[0], rtol=1e-10)
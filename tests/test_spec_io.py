@@ -0,0 +1,151 @@
+import os
+import io
+import gzip
+import numpy as np
+import pytest
+from spectra import Spectrum, spec_io
+from spectra.spec_io import spec_from_txt, model_from_txt, model_from_dk, load_many, write_spectra
+from spectra.misc import format_columns
+from spectra.spec_io import _parse_columns
+
+def write_txt(fname, n=200):
+  x = np.linspace(4000, 5000, n)
+  np.savetxt(fname, np.column_stack([x, np.sin(x), np.full(n, 0.1)]))
+  return x
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+  path = tmp_path / "cache"
+  monkeypatch.setattr(spec_io, "text_cache_dir", str(path))
+  return path
+
+def test_text_cache_roundtrip(tmp_path, cache_dir):
+  fname = str(tmp_path / "S.txt")
+  x = write_txt(fname)
+  S1 = spec_from_txt(fname)
+  S2 = spec_from_txt(fname)
+  assert np.array_equal(S1.x, x) and np.array_equal(S2.y, S1.y)
+  assert sorted(os.path.splitext(f)[1] for f in os.listdir(cache_dir)) == ['.json', '.npy']
+
+def test_text_cache_unwritable(tmp_path, monkeypatch):
+  fname = str(tmp_path / "S.txt")
+  x = write_txt(fname)
+  blocker = tmp_path / "file"
+  blocker.write_text("")
+  monkeypatch.setattr(spec_io, "text_cache_dir", str(blocker / "cache"))
+  assert np.array_equal(spec_from_txt(fname).x, x)
+
+def test_text_cache_threads(tmp_path, cache_dir):
+  fname = str(tmp_path / "S.txt")
+  x = write_txt(fname)
+  SS, failed = load_many([fname]*16, workers=8, executor='thread')
+  assert not failed and all(np.array_equal(S.x, x) for S in SS)
+  assert not [f for f in os.listdir(cache_dir) if f.endswith('.tmp')]
+
+@pytest.mark.parametrize("text", [
+  "1 2 3\n4 5 6\n7 8 9\n",
+  "1.5e3 -2 3E-4\n4 5 6\n",
+  "# comment\n1 2 3\n4 5 6 # trailing\n",
+  "1 2 3\n",
+  "  1   2  3  \n\n 4 5 6\n\n",
+])
+def test_parse_columns_matches_loadtxt(text):
+  data = _parse_columns(text, (0, 2))
+  ref = np.loadtxt(io.StringIO(text), unpack=True, usecols=(0, 2), ndmin=2)
+  assert np.array_equal(data, ref)
+
+@pytest.mark.parametrize("gz", [False, True])
+def test_spec_from_txt_matches_loadtxt(tmp_path, gz):
+  fname = str(tmp_path / ("S.txt.gz" if gz else "S.txt"))
+  x = np.linspace(4000, 5000, 50)
+  data = np.column_stack([x, np.sin(x), np.full(50, 0.1), np.ones(50)])
+  header = "name\nanother line"
+  np.savetxt(fname, data, header=header, comments='')
+  S = spec_from_txt(fname, skiprows=2)
+  x0, y0, e0 = np.loadtxt(fname, unpack=True, usecols=(0,1,2), skiprows=2)
+  assert np.array_equal(S.x, x0) and np.array_equal(S.y, y0) and np.array_equal(S.e, e0)
+  M = model_from_txt(fname, skiprows=2)
+  assert np.array_equal(M.y, y0) and np.all(M.e == 0)
+
+def test_model_from_dk_matches_two_pass_read(tmp_path):
+  fname = str(tmp_path / "da10000_800.dk")
+  x = np.linspace(3000, 9000, 100)
+  with open(fname, 'w') as F:
+    F.write("TEFF    = 10000.0\nLOG_G   = 8.00\nCOMMENT   el  2  -4.0\nCOMMENT   el  2000  -8.0\nEND\n")
+    np.savetxt(F, np.column_stack([x, 1e8*np.exp(-x/5000), np.zeros(100)]))
+  M = model_from_dk(fname, y_unit="mJy")
+  x0, y0 = np.loadtxt(fname, unpack=True, usecols=(0,1), skiprows=5)
+  M0 = Spectrum(x0, y0, 0, wave='vac', x_unit='AA', y_unit='erg/(s cm3)')
+  M0.y_unit_to("mJy")
+  assert np.array_equal(M.x, x0) and np.allclose(M.y, M0.y, rtol=1e-14)
+  assert M.head['Teff'] == 10000. and M.head['logg'] == 8.
+  assert M.head['el'] == {'He':-4., 'Ca':-8.}
+  assert M.name == "da10000_800" and M.wave == 'vac'
+
+def write_old(S, errors=True):
+  """
+  Per-pixel text formatting of the original Spectrum.write
+  """
+  if errors:
+    return "".join("%9.3f %12.5E %11.5E\n" % (x, y, e) for x, y, e in zip(S.x, S.y, S.e))
+  return "".join("%9.3f %12.5E\n" % (x, y) for x, y in zip(S.x, S.y))
+
+def make_awkward_spectrum():
+  x = np.linspace(4000, 5000, 1001)
+  y = np.sin(x) * 10.**np.linspace(-20, 20, 1001)
+  y[[3, 10, 500]] = np.nan, np.inf, -np.inf
+  y[7] = 0.
+  return Spectrum(x, y, np.abs(y)*0.01 + 1e-30, "awkward")
+
+@pytest.mark.parametrize("errors", [True, False])
+def test_write_matches_old(tmp_path, errors):
+  S = make_awkward_spectrum()
+  S.write(str(tmp_path / "S.txt"), errors)
+  S.write(str(tmp_path / "S.txt.gz"), errors)
+  assert (tmp_path / "S.txt").read_text() == write_old(S, errors)
+  with gzip.open(tmp_path / "S.txt.gz", 'rt') as F:
+    assert F.read() == write_old(S, errors)
+
+def test_format_columns_chunks():
+  S = make_awkward_spectrum()
+  text = "".join(format_columns((S.x, S.y, S.e), "%9.3f %12.5E %11.5E\n", chunk_size=7))
+  assert text == write_old(S)
+
+def test_write_npy_matches_np_save(tmp_path):
+  S = make_awkward_spectrum()
+  S.write(str(tmp_path / "S.npy"))
+  assert np.array_equal(np.load(tmp_path / "S.npy"), np.array([S.x, S.y, S.e]), equal_nan=True)
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_write_spectra(tmp_path, workers):
+  S0 = make_awkward_spectrum()
+  SS = [Spectrum(S0.x, S0.y*(i+1), S0.e, f"S{i}") for i in range(3)]
+  write_spectra(SS, str(tmp_path / "all.txt"), workers=workers, executor='thread')
+  assert (tmp_path / "all.txt").read_text() == "".join(f"# S{i}\n" + write_old(S) for i, S in enumerate(SS))
+  (tmp_path / "dir").mkdir()
+  write_spectra(SS, str(tmp_path / "dir"), workers=workers, executor='thread')
+  for i, S in enumerate(SS):
+    assert (tmp_path / "dir" / f"S{i}.txt").read_text() == write_old(S)
+
+@pytest.mark.parametrize("executor, workers", [('thread', 4), ('process', 2), ('thread', 1)])
+def test_load_many_matches_serial(tmp_path, executor, workers):
+  for i in range(6):
+    write_txt(str(tmp_path / f"S{i}.txt"), n=100+i)
+  (tmp_path / "S9.txt").write_text("not a spectrum\n")
+  pattern = str(tmp_path / "S*.txt")
+  SS, failed = load_many(pattern, workers=workers, executor=executor)
+  assert [S.name for S in SS] == [f"S{i}" for i in range(6)]
+  for i, S in enumerate(SS):
+    S0 = spec_from_txt(str(tmp_path / f"S{i}.txt"))
+    assert np.array_equal(S.x, S0.x) and np.array_equal(S.y, S0.y) and np.array_equal(S.e, S0.e)
+  assert len(failed) == 1 and failed[0][0].endswith("S9.txt")
+
+def test_load_many_stacked(tmp_path):
+  fnames = [str(tmp_path / f"S{i}.txt") for i in range(4)]
+  for i, fname in enumerate(fnames):
+    write_txt(fname, n=100+i)
+  x = np.linspace(4100, 4900, 50)
+  B, failed = load_many(fnames, workers=2, executor='thread', stack=True, x=x)
+  assert not failed and B.y.shape == (4, 50)
+  for fname, y in zip(fnames, B.y):
+    assert np.allclose(y, spec_from_txt(fname).interp(x, 'linear').y, rtol=0, atol=1e-14)
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from spectra import Spectrum
+from spectra import resample
+from spectra.streaming import map_chunks
+
+def test_chunked_interp_matches_and_is_not_cached():
+  x = np.linspace(4000, 5000, 5000)
+  S = Spectrum(x, 1 + 0.2*np.sin(x/7), np.full(len(x), 0.1))
+  x2 = np.linspace(4001, 4999, 7001)
+  resample._resampler_cache.clear()
+  S1 = S.interp(x2, 'cubic')
+  S2 = S.interp(x2, 'cubic', chunk_size=500)
+  assert len(resample._resampler_cache) == 1
+  assert np.allclose(S1.y, S2.y, rtol=0, atol=1e-8)
+  assert np.allclose(S1.e, S2.e, rtol=0, atol=1e-8)
+
+def _line_spectrum(x):
+  rng = np.random.default_rng(1)
+  y = 1 + 0.1*np.sin(x/30)
+  for c in rng.uniform(x[0], x[-1], 40):
+    y -= 0.5*np.exp(-0.5*((x-c)/0.5)**2)
+  return Spectrum(x, y, np.full(len(x), 0.01))
+
+_grids = {
+  'uniform' : np.linspace(4000, 6000, 20001),
+  'nonuniform' : 4000 + 2000*np.linspace(0, 1, 20001)**1.5,
+}
+
+_methods = {
+  'convolve_gaussian' : lambda S, **kw: S.convolve_gaussian(2., **kw),
+  'convolve_gaussian_R' : lambda S, **kw: S.convolve_gaussian_R(3000, **kw),
+  'rot_broaden' : lambda S, **kw: S.rot_broaden(30, **kw),
+}
+
+@pytest.mark.parametrize("grid", sorted(_grids))
+@pytest.mark.parametrize("method", sorted(_methods))
+def test_chunked_methods_match_in_memory(grid, method):
+  S = _line_spectrum(_grids[grid])
+  fun = _methods[method]
+  S1 = fun(S)
+  S2 = fun(S, chunk_size=3000)
+  assert np.array_equal(S1.x, S2.x)
+  assert np.allclose(S1.y, S2.y, rtol=0, atol=1e-12)
+  assert np.allclose(S1.e, S2.e, rtol=0, atol=1e-12, equal_nan=True)
+
+def test_map_chunks_matches_whole_spectrum():
+  S = _line_spectrum(_grids['uniform'])
+  fun = lambda Sc: Sc.convolve_gaussian(2.)
+  S1 = fun(S)
+  for chunk_size in [1000, 7777, 10**6]:
+    S2 = map_chunks(S, fun, chunk_size, 6.)
+    assert np.allclose(S1.y, S2.y, rtol=0, atol=1e-12)
+    assert np.array_equal(S1.e, S2.e)
+
+def test_map_chunks_rejects_unsorted():
+  x = np.linspace(4000, 5000, 1000)
+  x[[10, 20]] = x[[20, 10]]
+  S = Spectrum(x, np.ones(len(x)), np.ones(len(x)))
+  with pytest.raises(ValueError):
+    map_chunks(S, lambda Sc: Sc, 100)
+
+def test_map_chunks_rejects_length_change():
+  x = np.linspace(4000, 5000, 1000)
+  S = Spectrum(x, np.ones(len(x)), np.ones(len(x)))
+  with pytest.raises(ValueError):
+    map_chunks(S, lambda Sc: Sc[1:], 100)
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+from scipy.integrate import trapz
+from spectra import Spectrum, SpectrumBatch, synphot
+from spectra.synphot import register_filter, write_filter_pack, load_filter_pack, clear_filter_cache
+from spectra.synphot import load_transmission_curve, mag_calc_AB, mag_calc_AB_batch
+
+@pytest.fixture
+def test_filter(tmp_path):
+  fname = str(tmp_path / "test.dat")
+  np.savetxt(fname, np.column_stack([np.linspace(4000, 5000, 11), np.ones(11)]))
+  register_filter("test", fname=fname)
+  yield fname
+  synphot._registered_filters.pop("test", None)
+  clear_filter_cache()
+
+def test_filter_pack_roundtrip(tmp_path, test_filter):
+  pack = str(tmp_path / "filters.npz")
+  write_filter_pack(pack, ["test", "V"])
+  clear_filter_cache()
+  assert load_filter_pack(pack) == []
+  x, y = synphot._packed_filters["V"]
+  assert np.array_equal(x, np.loadtxt(synphot._filter_source("V"), usecols=0))
+  assert np.array_equal(synphot._packed_filters["test"][0], np.linspace(4000, 5000, 11))
+
+def test_filter_pack_ignores_modified_files(tmp_path, test_filter):
+  pack = str(tmp_path / "filters.npz")
+  write_filter_pack(pack, ["test", "V"])
+  np.savetxt(test_filter, np.column_stack([np.linspace(4000, 6000, 21), np.ones(21)]))
+  clear_filter_cache()
+  assert load_filter_pack(pack) == ["test"]
+  assert "test" not in synphot._packed_filters and "V" in synphot._packed_filters
+  x, _ = synphot._filter_arrays("test")
+  assert x[-1] == 6000.
+
+@pytest.mark.parametrize("filt", ["V", "2mJ", "GaiaBp", "swUVW2"])
+def test_transmission_curve_matches_text_file(filt):
+  clear_filter_cache()
+  x, y = np.loadtxt(synphot._filter_source(filt), unpack=True, usecols=(0,1))
+  R1 = load_transmission_curve(filt)
+  R2 = load_transmission_curve(filt)
+  assert np.array_equal(R1.x, x) and np.array_equal(R1.y, y)
+  assert np.array_equal(R2.y, y) and filt in synphot._filter_cache
+  assert R1.x_unit == "Angstrom" and R1.wave == "vac" and R1.name == filt
+
+def test_registered_filter_arrays(test_filter):
+  x, y = np.loadtxt(test_filter, unpack=True)
+  register_filter("test2", x=x, y=y)
+  try:
+    S = Spectrum(np.linspace(3900, 5100, 500), 1., 0.1, y_unit="mJy")
+    m1 = mag_calc_AB(S.copy(), "test", NMONTE=0)
+    m2 = mag_calc_AB(S.copy(), "test2", NMONTE=0)
+    assert m1 == m2 and np.isclose(m1, -2.5*np.log10(1e-3) + 8.90)
+  finally:
+    synphot._registered_filters.pop("test2")
+
+def mag_calc_AB_loop(S, filt, NMONTE):
+  """
+  Monte-carlo loop of the original mag_calc_AB, one realisation at a time
+  """
+  R = load_transmission_curve(filt)
+  R.wave = S.wave
+  R.x_unit_to("Hz")
+  S.x_unit_to("Hz")
+  S.y_unit_to("Jy")
+  S = S.clip(np.min(R.x), np.max(R.x))
+  R = R.interp(S)
+  m_AB = lambda y: -2.5*np.log10(trapz(y*R.y/S.x, S.x)/trapz(R.y/S.x, S.x)) + 8.90
+  if NMONTE == 0:
+    return m_AB(S.y)
+  m = np.array([m_AB(np.random.normal(S.y, S.e)) for _ in range(NMONTE)])
+  return np.mean(m), np.std(m)
+
+def make_sed(err=0.05):
+  x = np.linspace(3000, 10000, 2000)
+  return Spectrum(x, 1 + 0.2*np.sin(x/300), np.full(len(x), err), y_unit="mJy")
+
+@pytest.mark.parametrize("filt", ["V", "g", "psz"])
+def test_mag_calc_AB_matches_loop(filt):
+  S = make_sed()
+  assert np.isclose(mag_calc_AB(S.copy(), filt, 0), mag_calc_AB_loop(S.copy(), filt, 0), rtol=0, atol=1e-10)
+  np.random.seed(5)
+  m1, e1 = mag_calc_AB(S.copy(), filt, 200, chunk_size=64)
+  np.random.seed(5)
+  m2, e2 = mag_calc_AB_loop(S.copy(), filt, 200)
+  assert np.isclose(m1, m2, rtol=0, atol=1e-10) and np.isclose(e1, e2, rtol=1e-8)
+
+def test_mag_calc_AB_analytic_errors():
+  S = make_sed(0.2)
+  m, e = mag_calc_AB(S.copy(), "V", errors='analytic')
+  np.random.seed(6)
+  m_mc, e_mc = mag_calc_AB(S.copy(), "V", 4000)
+  assert np.isclose(m, mag_calc_AB(S.copy(), "V", 0), rtol=0, atol=1e-12)
+  assert np.isclose(m, m_mc, rtol=0, atol=3*e_mc/np.sqrt(4000))
+  assert np.isclose(e, e_mc, rtol=0.05)
+  with pytest.raises(ValueError):
+    mag_calc_AB(S.copy(), "V", errors='other')
+
+def test_mag_calc_AB_batch_matches_mag_calc_AB():
+  x = np.linspace(3000, 10000, 2000)
+  SS = [Spectrum(x, (1 + 0.2*np.sin(x/(200+50*i)))*1e-16, np.full(len(x), 1e-18)) for i in range(3)]
+  filts = ["V", "g", "r", "GaiaG"]
+  B = SpectrumBatch.from_spectra(SS)
+  m, m_e = mag_calc_AB_batch(B, filts, errors=True)
+  assert m.shape == m_e.shape == (3, 4)
+  for i, S in enumerate(SS):
+    for j, filt in enumerate(filts):
+      m0, e0 = mag_calc_AB(S.copy(), filt, errors='analytic')
+      assert np.isclose(m[i,j], m0, rtol=0, atol=1e-6)
+      assert np.isclose(m_e[i,j], e0, rtol=1e-4)
+  assert np.allclose(mag_calc_AB_batch(SS[1], filts), m[1])
+  assert mag_calc_AB_batch(SS[2], "r") == m[2,2]
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+import astropy.units as u
+from spectra import Spectrum
+from spectra.units import convert_x, convert_y
+
+X_UNITS = ["AA", "nm", "um", "Hz", "GHz", "eV", "keV", "1/cm", "1/um", "m"]
+Y_UNITS = ["erg/(s cm2 AA)", "W/(m2 nm)", "Jy", "mJy", "erg/(s cm2 Hz)", "W/(m2 Hz)", "ph/(s cm2 AA)", "AB"]
+
+@pytest.mark.parametrize("new_unit", X_UNITS)
+def test_convert_x_matches_astropy(new_unit):
+  x = np.linspace(3000, 10000, 50)
+  for x_unit in ("AA", "Hz"):
+    x0 = x if x_unit == "AA" else (x*u.AA).to("Hz", u.spectral()).value
+    x_ref = (x0 * u.Unit(x_unit)).to(new_unit, u.spectral()).value
+    assert np.allclose(convert_x(x0, x_unit, new_unit), x_ref, rtol=1e-12, atol=0)
+
+@pytest.mark.parametrize("new_unit", Y_UNITS)
+@pytest.mark.parametrize("x_unit", ["AA", "nm", "Hz", "1/um"])
+def test_convert_y_matches_astropy(x_unit, new_unit):
+  x = (np.linspace(3000, 10000, 50)*u.AA).to(x_unit, u.spectral()).value
+  y = np.linspace(1, 2, 50) * 1e-16
+  e = np.full(50, 1e-18)
+  xq = x * u.Unit(x_unit)
+  y2, e2 = convert_y(x, x_unit, "erg/(s cm2 AA)", new_unit, y, e)
+  y_ref = (y * u.Unit("erg/(s cm2 AA)")).to(new_unit, u.spectral_density(xq)).value
+  e_ref = (e * u.Unit("erg/(s cm2 AA)")).to(new_unit, u.spectral_density(xq)).value
+  assert np.allclose(y2, y_ref, rtol=1e-12, atol=0)
+  assert np.allclose(e2, e_ref, rtol=1e-12, atol=0)
+
+def test_spectrum_unit_roundtrip():
+  x = np.linspace(4000, 5000, 101)
+  S = Spectrum(x, np.linspace(1, 2, 101)*1e-16, np.full(101, 1e-18))
+  T = S.copy()
+  T.x_unit_to("Hz")
+  T.y_unit_to("mJy")
+  assert np.allclose(T.y, (S.y*u.Unit(S.y_unit)).to("mJy", u.spectral_density(x*u.AA)).value, rtol=1e-12)
+  T.x_unit_to("nm")
+  T.y_unit_to("erg/(s cm2 AA)")
+  T.x_unit_to("AA")
+  assert np.allclose(T.x, S.x, rtol=1e-12) and np.allclose(T.y, S.y, rtol=1e-12) and np.allclose(T.e, S.e, rtol=1e-12)